@@ -1,5 +1,6 @@
 import numpy as np
 import os
+import warnings
 import pandas as pd
 import sqlite3
 from datetime import date
@@ -19,8 +20,58 @@ RECIPIENT_EMAIL = os.getenv('RECIPIENT_EMAIL')
 DIR_PATH = os.path.dirname(os.path.realpath(__file__))
 SQLITE_DB_FULL_PATH = f'{DIR_PATH}/{SQLITE_DB_PATH}'
 
-
-def get_listing_data(today_filter=True):
+# Weight of every standardized column in SCORE. SQFT_PER_THOUSAND is the
+# square feet a thousand dollars of PRICE buys.
+SCORE_WEIGHTS = {
+    'PRICE': 1.0,
+    'MORTGAGE': 1.0,
+    'YEAR': 1.0,
+    'SQFT': 1.0,
+    'LOT_SIZE': 0.8,
+    'SQFT_PER_THOUSAND': 1.0,
+}
+# Columns where a lower value scores higher.
+INVERTED_COLUMNS = ('PRICE', 'MORTGAGE')
+# Listings in the emailed report.
+REPORT_SIZE = 20
+
+
+def score_listings(df, weights=SCORE_WEIGHTS):
+    """Add the min-max standardized, weighted STD_* columns of df and their sum as SCORE.
+
+    Each column is scaled to [0, weight]; for PRICE and MORTGAGE lower is
+    better. A NaN in any column leaves the row's SCORE NaN.
+    """
+    df['SQFT_PER_THOUSAND'] = df['SQFT'].to_numpy(dtype=float) / (df['PRICE'].to_numpy(dtype=float) / 1000)
+    score = np.zeros(len(df))
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        # An all-NaN column scores NaN, as pandas' min() and max() would give.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for c, weight in weights.items():
+            values = df[c].to_numpy(dtype=float)
+            col_min, col_max = np.nanmin(values), np.nanmax(values)
+            std = (values - col_min) / (col_max - col_min)
+            if c in INVERTED_COLUMNS:
+                std = 1 - std
+            std = std * weight
+            df['STD_' + c] = std
+            score += std
+    df['SCORE'] = score
+    return df
+
+
+def top_rows(scores, k):
+    """Return the positions of the k highest scores, best first; NaN scores come last."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.arange(0)
+    # Negated so the best is smallest; argpartition and argsort put NaN last.
+    keys = -scores
+    top = np.argpartition(keys, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return top[np.argsort(keys[top], kind='stable')]
+
+
+def get_listing_data(today_filter=True, weights=SCORE_WEIGHTS, top=REPORT_SIZE):
     conn = sqlite3.connect(SQLITE_DB_FULL_PATH)
     cur = conn.cursor()
 
@@ -42,50 +93,12 @@ def get_listing_data(today_filter=True):
     column_names = [info[1] for info in table_info]
     df = pd.DataFrame(query_results, columns=column_names)
 
-    standardizaiton_columns = ['PRICE', 'MORTGAGE',
-                               'YEAR', 'SQFT', 'LOT_SIZE', 'SQFT_PRICE']
-
-    lot_size_weight = 0.8
-    for c in standardizaiton_columns:
-        col_range = df[c].max() - df[c].min()
-        col_min = df[c].min()
-        if c == 'PRICE' or c == 'MORTGAGE':
-            df['STD_' + c] = df.apply(lambda row: 1 -
-                                      ((row[c] - col_min) / col_range), axis=1)
-        elif c == 'LOT_SIZE':
-            df['STD_' + c] = df.apply(lambda row: (
-                (row[c] - col_min) / col_range) * lot_size_weight, axis=1)
-        elif c == 'SQFT_PRICE':
-            new_col = 'SQFT_PER_THOUSAND'
-            df[new_col] = df.apply(
-                lambda row: row['SQFT'] / (row['PRICE'] / 1000), axis=1)
-            col_range = df[new_col].max() - df[new_col].min()
-            col_min = df[new_col].min()
-            df['STD_' + new_col] = df.apply(
-                lambda row: (row[new_col] - col_min) / col_range, axis=1)
-        else:
-            df['STD_' +
-                c] = df.apply(lambda row: (row[c] - col_min) / col_range, axis=1)
-
-    df[['STD_PRICE',
-        'STD_MORTGAGE',
-        'STD_YEAR',
-        'STD_SQFT',
-        'STD_LOT_SIZE',
-        'STD_SQFT_PER_THOUSAND']].describe()
-
-    df['SCORE'] = df.apply(lambda row: np.sum([row['STD_PRICE'],
-                                               row['STD_MORTGAGE'],
-                                               row['STD_YEAR'],
-                                               row['STD_SQFT'],
-                                               row['STD_LOT_SIZE'],
-                                               row['STD_SQFT_PER_THOUSAND']]), axis=1)
-    df_sorted = df.sort_values(by=['SCORE'], ascending=False)
+    df = score_listings(df, weights)
     # Define the columns that will appear in the report
     report_columns = ['URL', 'PRICE', 'MORTGAGE', 'YEAR', 'NUMBER_ROOMS',
                       'NUMBER_BATHROOMS', 'SQFT', 'LOT_SIZE', 'SQFT_PRICE', 'TIME_ON_REDFIN', 'DATE', 'SCORE']
-    # Return the top 20 rows of the sorted df for the report
-    return df_sorted[report_columns].iloc[:20]
+    # Return the `top` best scored rows for the report
+    return df[report_columns].iloc[top_rows(df['SCORE'].to_numpy(), top)]
 
 
 def send_mail(city, body):
@@ -131,4 +144,5 @@ def generate_listing_report():
     print('report distributed')
 
 
-generate_listing_report()
+if __name__ == '__main__':
+    generate_listing_report()
@@ -0,0 +1,74 @@
+import json
+import zlib
+
+# Encodings of the search page json kept in LISTING_BLOBS.INFO; ENCODING is
+# NULL for the plain json text every db started with.
+# zlib: the json, compressed with ZDICT as preset dictionary.
+# slim: only the fields parse_listing_page reads, compressed the same way.
+ZLIB = 'zlib'
+SLIM = 'slim'
+ENCODINGS = (ZLIB, SLIM)
+
+ADDRESS_KEYS = ('addressCountry', 'addressRegion', 'addressLocality', 'streetAddress', 'postalCode')
+LISTING_KEYS = ('numberOfRooms', 'name', '@type')
+
+# The keys and values every page repeats, so even a small page compresses
+# well. Stored blobs can only be read back with the dictionary they were
+# written with: never change it, add a new encoding instead.
+ZDICT = json.dumps([[
+    {'@context': 'http://schema.org', 'name': '', 'url': '/home/',
+     'address': {'@type': 'PostalAddress', 'streetAddress': '', 'addressLocality': '', 'addressRegion': '',
+                 'postalCode': '', 'addressCountry': 'US'},
+     'numberOfRooms': '', '@type': 'SingleFamilyResidence'},
+    {'@context': 'http://schema.org', '@type': 'Product', 'name': '',
+     'offers': {'@type': 'Offer', 'price': '', 'priceCurrency': 'USD'}, 'url': '/home/'}]]).encode()
+
+
+def _slim_info(info):
+    slim = {}
+    if 'url' in info and 'address' in info:
+        slim['url'] = info['url']
+        address = info['address']
+        if isinstance(address, dict):
+            address = {key: address[key] for key in ADDRESS_KEYS if key in address}
+        slim['address'] = address
+        slim.update((key, info[key]) for key in LISTING_KEYS if key in info)
+    if 'offers' in info:
+        offers = info['offers']
+        if isinstance(offers, dict):
+            offers = {'price': offers['price']} if 'price' in offers else {}
+        slim['offers'] = offers
+    return slim
+
+
+def slim_details(details):
+    """Strip the json-ld payloads of a search page down to what parse_listing_page reads."""
+    slim = []
+    for listing in details:
+        if isinstance(listing, dict):
+            slim.append(_slim_info(listing))
+        elif isinstance(listing, list):
+            slim.append([x for x in (_slim_info(info) for info in listing if isinstance(info, dict)) if x])
+    return slim
+
+
+def encode_blob(info, encoding=None):
+    """Return the LISTING_BLOBS.INFO value of a page's json text in `encoding`."""
+    if encoding is None:
+        return info
+    if encoding == SLIM:
+        info = json.dumps(slim_details(json.loads(info)), separators=(',', ':'))
+    elif encoding != ZLIB:
+        raise ValueError('unknown blob encoding {}'.format(encoding))
+    compressor = zlib.compressobj(9, zdict=ZDICT)
+    return compressor.compress(info.encode('utf-8')) + compressor.flush()
+
+
+def decode_blob(value, encoding=None):
+    """Return the json text of a LISTING_BLOBS.INFO value stored in `encoding`."""
+    if encoding is None:
+        return value
+    if encoding not in ENCODINGS:
+        raise ValueError('unknown blob encoding {}'.format(encoding))
+    decompressor = zlib.decompressobj(zdict=ZDICT)
+    return (decompressor.decompress(value) + decompressor.flush()).decode('utf-8')
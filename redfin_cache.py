@@ -0,0 +1,140 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+
+from redfin_fetcher import FetchResponse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds a cached response is served before it is fetched again.
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# Eviction trims the cache to this share of max_bytes, so it does not run on every write.
+EVICT_TO = 0.9
+# Response headers kept with the body, for the conditional listing requests.
+CACHED_HEADERS = ('ETag', 'Last-Modified')
+
+# zstd when the zstandard package is installed, gzip otherwise; either is read back.
+EXTENSIONS = ('.zst', '.gz') if zstandard else ('.gz',)
+
+
+def _compress(data, ext):
+    if ext == '.zst':
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data, ext):
+    if ext == '.zst':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def cache_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def read_entry(path):
+    """Return (response, fetched_at) stored in a cache file, or None if it cannot be read."""
+    ext = os.path.splitext(path)[1]
+    if ext not in EXTENSIONS:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            data = _decompress(f.read(), ext)
+    except (OSError, EOFError, ValueError) as e:
+        LOGGER.warning('unreadable cache entry {}: {!r}'.format(path, e))
+        return None
+    meta, _, text = data.decode('utf-8').partition('\n')
+    meta = json.loads(meta)
+    return FetchResponse(meta['url'], meta['status'], text, None, meta['headers']), meta['fetched_at']
+
+
+class ResponseCache:
+    """Compressed on-disk cache of successful responses, keyed by the sha256 of the url.
+
+    Entries older than `ttl` seconds are not served (ttl=None serves any
+    age, for replay). Once the files take more than `max_bytes`, the least
+    recently used ones are deleted; a hit touches its file's mtime.
+    """
+
+    def __init__(self, cache_dir, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.size = sum(os.path.getsize(path) for path in self.paths())
+
+    def _path(self, url, ext):
+        key = cache_key(url)
+        return os.path.join(self.cache_dir, key[:2], key + ext)
+
+    def paths(self):
+        """Yield the path of every cache entry."""
+        for shard in os.scandir(self.cache_dir):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(EXTENSIONS):
+                        yield entry.path
+
+    def get(self, url):
+        """Return the cached response for `url`, or None."""
+        for ext in EXTENSIONS:
+            path = self._path(url, ext)
+            if not os.path.exists(path):
+                continue
+            entry = read_entry(path)
+            if entry is None:
+                break
+            resp, fetched_at = entry
+            if self.ttl is not None and time.time() - fetched_at > self.ttl:
+                break
+            os.utime(path)
+            self.hits += 1
+            return resp
+        self.misses += 1
+        return None
+
+    def put(self, resp):
+        """Cache a response; only 200s are kept."""
+        if resp.status != 200:
+            return
+        headers = {name: resp.headers[name] for name in CACHED_HEADERS if resp.headers and name in resp.headers}
+        meta = {'url': resp.url, 'status': resp.status, 'headers': headers, 'fetched_at': time.time()}
+        data = _compress((json.dumps(meta) + '\n' + resp.text).encode('utf-8'), EXTENSIONS[0])
+        path = self._path(resp.url, EXTENSIONS[0])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            self.size -= os.path.getsize(path)
+        # Written aside and renamed, so a reader never sees half an entry.
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        entries = sorted((os.path.getmtime(path), os.path.getsize(path), path) for path in self.paths())
+        removed = 0
+        for _, size, path in entries:
+            if self.size <= self.max_bytes * EVICT_TO:
+                break
+            os.remove(path)
+            self.size -= size
+            removed += 1
+        LOGGER.info('evicted {} cached responses, {} bytes left'.format(removed, self.size))
+
+    def summary(self):
+        return 'cache: {} hits, {} misses, {} bytes'.format(self.hits, self.misses, self.size)
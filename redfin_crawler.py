@@ -1,20 +1,29 @@
 from email.mime import base
 import os
 import re
+import asyncio
+import hashlib
+import itertools
 import json
-import random
+import math
 from turtle import home
-import requests
 import logging
-import time
 import pandas as pd
 import argparse
 from concurrent.futures import ProcessPoolExecutor
-from bs4 import BeautifulSoup
-import sqlite3
 from datetime import date
 from dotenv import load_dotenv
-from redfin_filters import apply_filters
+from redfin_filters import apply_filters, merge_adjacent_filters, FILL_FACTOR
+from redfin_extract import ld_json_scripts, homes_summary, go_to_pages, extract_listing, LISTING_FIELDS
+from redfin_blobs import encode_blob, decode_blob, ENCODINGS
+from redfin_cache import ResponseCache, cache_key, read_entry, DEFAULT_TTL, DEFAULT_MAX_BYTES
+from redfin_fetcher import Fetcher, DEFAULT_CONCURRENCY, DEFAULT_POOL_SIZE, DEFAULT_MAX_POOLS
+from redfin_scheduler import RateScheduler, DEFAULT_PROXY_RATE, DEFAULT_JITTER
+from redfin_proxies import ProxyManager, is_ban
+from redfin_frontier import Frontier, PARTITION, PAGES, LISTINGS, BULK
+from redfin_migrations import migrate
+from redfin_stingray import gis_csv_url, parse_gis_csv, NUM_HOMES
+from redfin_storage import SQLiteWriter, connect, DEFAULT_BATCH_SIZE, DEFAULT_FLUSH_INTERVAL
 
 
 load_dotenv()
@@ -27,6 +36,150 @@ HEADER = {
 SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH')
 DIR_PATH = os.path.dirname(os.path.realpath(__file__))
 SQLITE_DB_FULL_PATH = f'{DIR_PATH}/{SQLITE_DB_PATH}'
+# How new search page json is stored in LISTING_BLOBS (see redfin_blobs); None is plain json.
+BLOB_ENCODING = None
+
+
+INSERT_URL_SQL = """
+    INSERT INTO URLS (URL, NUM_PROPERTIES, NUM_PAGES, PER_PAGE_PROPERTIES)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (URL) DO UPDATE SET
+        NUM_PROPERTIES = excluded.NUM_PROPERTIES,
+        NUM_PAGES = excluded.NUM_PAGES,
+        PER_PAGE_PROPERTIES = excluded.PER_PAGE_PROPERTIES"""
+ADD_CHILD_SQL = """
+    INSERT INTO URLS (URL, PARENT, LEAF)
+    VALUES (?, ?, 1)
+    ON CONFLICT (URL) DO UPDATE SET PARENT = excluded.PARENT, LEAF = 1"""
+DROP_CHILDREN_SQL = 'DELETE FROM URLS WHERE PARENT = ?'
+SET_LEAF_SQL = 'UPDATE URLS SET LEAF = ? WHERE URL = ?'
+DELETE_URL_SQL = 'DELETE FROM URLS WHERE URL = ?'
+# A parent whose children were merged back into it.
+COLLAPSE_SQL = 'UPDATE URLS SET LEAF = 1, NUM_PROPERTIES = ?, NUM_PAGES = ? WHERE URL = ?'
+INSERT_MERGED_URL_SQL = """
+    INSERT INTO URLS (URL, NUM_PROPERTIES, NUM_PAGES, PER_PAGE_PROPERTIES, PARENT, LEAF)
+    VALUES (?, ?, ?, ?, ?, 1)
+    ON CONFLICT (URL) DO UPDATE SET
+        NUM_PROPERTIES = excluded.NUM_PROPERTIES,
+        NUM_PAGES = excluded.NUM_PAGES,
+        PER_PAGE_PROPERTIES = excluded.PER_PAGE_PROPERTIES,
+        PARENT = excluded.PARENT,
+        LEAF = 1"""
+# Every write of a page takes the next SEQ, so SEQ only grows and pages
+# written after a parse_addresses pass are always above its high-water mark.
+INSERT_LISTING_SQL = """
+    INSERT INTO LISTINGS (URL, FETCHED_AT, SEQ, PARSED)
+    VALUES (?, datetime('now'), (SELECT COALESCE(MAX(SEQ), 0) + 1 FROM LISTINGS), 0)
+    ON CONFLICT (URL) DO UPDATE SET FETCHED_AT = excluded.FETCHED_AT, SEQ = excluded.SEQ, PARSED = 0"""
+# Pages parsed as they are written (crawl_pipeline) are marked PARSED, so
+# parse_addresses does not parse them again.
+INSERT_PARSED_LISTING_SQL = """
+    INSERT INTO LISTINGS (URL, FETCHED_AT, SEQ, PARSED)
+    VALUES (?, datetime('now'), (SELECT COALESCE(MAX(SEQ), 0) + 1 FROM LISTINGS), 1)
+    ON CONFLICT (URL) DO UPDATE SET FETCHED_AT = excluded.FETCHED_AT, SEQ = excluded.SEQ, PARSED = 1"""
+INSERT_LISTING_BLOB_SQL = """
+    INSERT INTO LISTING_BLOBS (URL, INFO, ENCODING)
+    VALUES (?, ?, ?)
+    ON CONFLICT (URL) DO UPDATE SET INFO = excluded.INFO, ENCODING = excluded.ENCODING"""
+INSERT_SHORT_DETAILS_SQL = """
+    INSERT INTO LISTING_SHORT_DETAILS (
+        URL,
+        NUMBER_OF_ROOMS,
+        NAME,
+        COUNTRY,
+        REGION,
+        LOCALITY,
+        STREET,
+        POSTAL,
+        TYPE,
+        PRICE
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (URL) DO UPDATE SET
+        NUMBER_OF_ROOMS = excluded.NUMBER_OF_ROOMS,
+        NAME = excluded.NAME,
+        COUNTRY = excluded.COUNTRY,
+        REGION = excluded.REGION,
+        LOCALITY = excluded.LOCALITY,
+        STREET = excluded.STREET,
+        POSTAL = excluded.POSTAL,
+        TYPE = excluded.TYPE,
+        PRICE = excluded.PRICE"""
+INSERT_FULL_DETAILS_SQL = """
+    INSERT INTO LISTING_FULL_DETAILS (
+        URL,
+        DATE,
+        STATUS,
+        PRICE,
+        NUMBER_ROOMS,
+        NUMBER_BATHROOMS,
+        SQFT,
+        TIME_ON_REDFIN,
+        YEAR,
+        LOT_SIZE,
+        REDFIN_PRICE,
+        SQFT_PRICE,
+        MORTGAGE
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (URL, DATE) DO UPDATE SET
+        STATUS = excluded.STATUS,
+        PRICE = excluded.PRICE,
+        NUMBER_ROOMS = excluded.NUMBER_ROOMS,
+        NUMBER_BATHROOMS = excluded.NUMBER_BATHROOMS,
+        SQFT = excluded.SQFT,
+        TIME_ON_REDFIN = excluded.TIME_ON_REDFIN,
+        YEAR = excluded.YEAR,
+        LOT_SIZE = excluded.LOT_SIZE,
+        REDFIN_PRICE = excluded.REDFIN_PRICE,
+        SQFT_PRICE = excluded.SQFT_PRICE,
+        MORTGAGE = excluded.MORTGAGE"""
+
+# Copies the last scraped details of a listing to today, for listings that
+# did not change (or were not re-scraped). TIME_ON_REDFIN moves with the date.
+CARRY_FORWARD_SQL = """
+    INSERT INTO LISTING_FULL_DETAILS (
+        URL, DATE, STATUS, PRICE, NUMBER_ROOMS, NUMBER_BATHROOMS, SQFT, TIME_ON_REDFIN,
+        YEAR, LOT_SIZE, REDFIN_PRICE, SQFT_PRICE, MORTGAGE
+    )
+    SELECT URL, ?1, STATUS, PRICE, NUMBER_ROOMS, NUMBER_BATHROOMS, SQFT,
+           TIME_ON_REDFIN + CAST(julianday(replace(?1, '/', '-')) - julianday(replace(DATE, '/', '-')) AS INT),
+           YEAR, LOT_SIZE, REDFIN_PRICE, SQFT_PRICE, MORTGAGE
+    FROM LISTING_FULL_DETAILS WHERE URL = ?2 AND DATE < ?1
+    ORDER BY DATE DESC LIMIT 1
+    ON CONFLICT (URL, DATE) DO NOTHING"""
+SET_FETCH_STATE_SQL = """
+    INSERT INTO FETCH_STATE (URL, ETAG, LAST_MODIFIED, HASH, CHECKED_AT, CHANGED_AT)
+    VALUES (?, ?, ?, ?, datetime('now'), datetime('now'))
+    ON CONFLICT (URL) DO UPDATE SET
+        ETAG = excluded.ETAG,
+        LAST_MODIFIED = excluded.LAST_MODIFIED,
+        CHANGED_AT = CASE WHEN HASH IS excluded.HASH THEN CHANGED_AT ELSE excluded.CHANGED_AT END,
+        HASH = excluded.HASH,
+        CHECKED_AT = excluded.CHECKED_AT"""
+SET_CHECKED_SQL = "UPDATE FETCH_STATE SET CHECKED_AT = datetime('now') WHERE URL = ?"
+# Listing page answers that are stored; 304 answers a conditional request.
+LISTING_STATUSES = (200, 304)
+
+# Weights of the signals that a listing page changed since its last scrape
+# (see change_score).
+PRICE_MOVED_SCORE = 10
+OPEN_STATUS_SCORE = 3
+OPEN_STATUSES = {'active', 'pending', 'contingent', 'coming'}
+NEW_LISTING_SCORE = 3
+NEW_LISTING_DAYS = 14
+RECENT_CHANGE_SCORE = 2
+RECENT_CHANGE_DAYS = 7
+STALE_SCORE_PER_DAY = 0.2
+SET_STATE_SQL = """
+    INSERT INTO CRAWL_STATE (KEY, VALUE)
+    VALUES (?, ?)
+    ON CONFLICT (KEY) DO UPDATE SET VALUE = excluded.VALUE"""
+PARSE_ADDRESSES_KEY = 'parse_addresses_seq'
+# Summary pages read and parsed at a time by parse_addresses.
+PARSE_CHUNK_SIZE = 1000
+# Search pages re-encoded per commit by compact_listings.
+COMPACT_CHUNK_SIZE = 500
 
 
 def construct_proxy(ip_addr, port, user=None, password=None):
@@ -43,505 +196,1008 @@ def construct_proxy(ip_addr, port, user=None, password=None):
 
 
 def create_tables_if_not_exist():
-    conn = sqlite3.connect(SQLITE_DB_FULL_PATH)
-    conn.execute('''CREATE TABLE IF NOT EXISTS URLS
-             (
-             URL                    TEXT    NOT NULL,
-             NUM_PROPERTIES         INT,
-             NUM_PAGES              INT,
-             PER_PAGE_PROPERTIES    INT);''')
-    conn.execute('''CREATE TABLE IF NOT EXISTS LISTINGS
-             (
-             URL            TEXT    NOT NULL,
-             INFO           TEXT);''')
-    conn.execute('''CREATE TABLE IF NOT EXISTS LISTING_SHORT_DETAILS
-             (
-             URL                TEXT    NOT NULL,
-             NUMBER_OF_ROOMS    INT,
-             NAME               TEXT,
-             COUNTRY            TEXT,
-             REGION             TEXT,
-             LOCALITY           TEXT,
-             STREET             TEXT,
-             POSTAL             TEXT,
-             TYPE               TEXT,
-             PRICE              REAL
-             );''')
-    conn.execute('''CREATE TABLE IF NOT EXISTS LISTING_FULL_DETAILS
-            (
-            URL                 TEXT    NOT NULL,
-            DATE                TEXT,
-            STATUS              TEXT,
-            PRICE               INT,
-            NUMBER_ROOMS        INT,
-            NUMBER_BATHROOMS    REAL,
-            SQFT                INT,
-            TIME_ON_REDFIN      INT,
-            YEAR                INT,
-            LOT_SIZE            REAL,
-            REDFIN_PRICE        INT,
-            SQFT_PRICE          INT,
-            MORTGAGE            INT
-            );''')
-
-    conn.close()
-
-
-def get_page_info(url_and_proxy):
-    """Return property count, page count and total properties under a given URL."""
-    url, proxy = url_and_proxy
+    migrate(SQLITE_DB_FULL_PATH)
+
+
+def fetched(resp, statuses=(200,)):
+    """Whether a response is worth storing: the request got an answer in `statuses` that is not a ban page.
+
+    Anything else goes back to the frontier, so a later pass or --resume
+    retries the url.
+    """
+    return resp is not None and resp.status in statuses and not is_ban(resp.status, resp.text)
 
-    time.sleep(random.random() * 10)
-    session = requests.Session()
+
+def get_page_info(url, resp):
+    """Return property count, page count and total properties under a given URL."""
     total_properties, num_pages, properties_per_page = None, None, None
+    if resp is None:
+        return (url, total_properties, num_pages, properties_per_page)
+    if resp.status != 200:
+        LOGGER.warning('status code {} on url {}'.format(resp.status, url))
+        return (url, total_properties, num_pages, properties_per_page)
     try:
-        resp = session.get(url, headers=HEADER, proxies=proxy)
-        resp.raise_for_status()
-
-        if resp.status_code == 200:
-            bf = BeautifulSoup(resp.text, 'lxml')
-            page_description_div = bf.find('div', {'class': 'homes summary'})
-            if not page_description_div:
-                # The page has nothing!
-                return(url, 0, 0, 20)
-            page_description = page_description_div.get_text()
-            if 'of' in page_description:
-                property_cnt_pattern = r'([0-9]+) of ([0-9]+) •*'
-                property_cnt_one_page_pattern = r'([0-9]+)•*'
-                m = re.match(property_cnt_pattern, page_description)
-                # n = re.match(property_cnt_one_page_pattern, page_description)
-                if m:
-                    properties_per_page = int(m.group(1))
-                    total_properties = int(m.group(2))
-                # elif n:
-                #     properties_per_page = int(n.group(1))
-                #     total_properties = properties_per_page
-                pages = [int(x.get_text())
-                         for x in bf.find_all('a', {'class': "goToPage"})]
-                num_pages = max(pages)
-            else:
-                property_cnt_pattern = r'([0-9]+)•*'
-                m = re.match(property_cnt_pattern, page_description)
-                if m:
-                    properties_per_page = int(m.group(1))
-                    total_properties = properties_per_page
-                num_pages = 1
+        page_description = homes_summary(resp.text)
+        if page_description is None:
+            # The page has nothing!
+            return(url, 0, 0, 20)
+        if 'of' in page_description:
+            property_cnt_pattern = r'([0-9]+) of ([0-9]+) •*'
+            property_cnt_one_page_pattern = r'([0-9]+)•*'
+            m = re.match(property_cnt_pattern, page_description)
+            # n = re.match(property_cnt_one_page_pattern, page_description)
+            if m:
+                properties_per_page = int(m.group(1))
+                total_properties = int(m.group(2))
+            # elif n:
+            #     properties_per_page = int(n.group(1))
+            #     total_properties = properties_per_page
+            pages = [int(x) for x in go_to_pages(resp.text)]
+            num_pages = max(pages)
+        else:
+            property_cnt_pattern = r'([0-9]+)•*'
+            m = re.match(property_cnt_pattern, page_description)
+            if m:
+                properties_per_page = int(m.group(1))
+                total_properties = properties_per_page
+            num_pages = 1
     except Exception as e:
         LOGGER.exception('Swallowing exception {} on url {}'.format(e, url))
     return (url, total_properties, num_pages, properties_per_page)
 
 
-def url_partition(base_url, proxies, max_levels=6):
+def city_of(base_url):
+    """Return the (REGION, LOCALITY) of LISTING_SHORT_DETAILS rows in a /city/ base url, or None."""
+    m = re.search(r'/city/[0-9]+/([^/]+)/([^/]+)', base_url)
+    if not m:
+        return None
+    return m.group(1), m.group(2).replace('-', ' ')
+
+
+def get_price_samples(base_url):
+    """Return the sorted prices of the homes seen in this city by earlier runs."""
+    city = city_of(base_url)
+    if not city:
+        return []
+    with connect(SQLITE_DB_FULL_PATH, readonly=True) as db:
+        return [row[0] for row in db.execute("""
+            SELECT PRICE FROM LISTING_SHORT_DETAILS
+            WHERE REGION = ? AND LOCALITY = ? AND PRICE IS NOT NULL
+            ORDER BY PRICE""", city)]
+
+
+def partition_statements(url, children):
+    """Return the (sql, params) marking `url` as split into `children`.
+
+    Children of an earlier split of `url` are dropped first.
+    """
+    statements = [(DROP_CHILDREN_SQL, (url,)), (SET_LEAF_SQL, (0, url))]
+    statements.extend((ADD_CHILD_SQL, (child, url)) for child in children)
+    return statements
+
+
+def get_partition_leaves(base_url):
+    with connect(SQLITE_DB_FULL_PATH, readonly=True) as db:
+        return [row[0] for row in db.execute(
+            'SELECT URL FROM URLS WHERE substr(URL, 1, ?) = ? AND LEAF = 1',
+            (len(base_url), base_url))]
+
+
+def merge_partition_leaves(writer, base_url):
+    """Collapse sibling leaves back into their parent when they fit under its cap together.
+
+    The parent's stored page count and page size are the cap it was split
+    at. The merged parent takes the summed count until it is probed again.
+    """
+    merged = 0
+    collapsed = set()
+    while True:
+        statements = []
+        with connect(SQLITE_DB_FULL_PATH, readonly=True) as db:
+            # A row that is its own parent (written by older versions) is not a child.
+            rows = db.execute("""
+                SELECT C.PARENT, P.NUM_PAGES, P.PER_PAGE_PROPERTIES, SUM(C.NUM_PROPERTIES),
+                       MIN(C.LEAF), COUNT(C.NUM_PROPERTIES), COUNT(*)
+                FROM URLS C JOIN URLS P ON P.URL = C.PARENT
+                WHERE substr(C.URL, 1, ?) = ? AND C.URL != C.PARENT
+                GROUP BY C.PARENT""", (len(base_url), base_url)).fetchall()
+        for parent, num_pages, per_page, total, all_leaves, counted, children in rows:
+            # Every pass must collapse new parents, or the loop would never end.
+            if parent in collapsed:
+                continue
+            if not (all_leaves and counted == children and num_pages and per_page):
+                continue
+            if total > num_pages * per_page * FILL_FACTOR:
+                continue
+            statements.append(('UPDATE URLS SET LEAF = 0 WHERE PARENT = ?', (parent,)))
+            statements.append(("""
+                UPDATE URLS SET LEAF = 1, NUM_PROPERTIES = ?, NUM_PAGES = ?
+                WHERE URL = ?""", (total, max(1, math.ceil(total / per_page)), parent)))
+            collapsed.add(parent)
+        if not statements:
+            break
+        writer.write_all(statements)
+        writer.flush()
+        merged += len(statements) // 2
+    if merged:
+        LOGGER.info('merged {} partitions back into their parent'.format(merged))
+    return merged
+
+
+def merge_sibling_partitions(writer, base_url):
+    """Merge adjacent leaf siblings that fit under their parent's cap together into one wider url.
+
+    Fewer, fuller leaves mean fewer search pages to fetch. The merged url
+    replaces its members in URLS and takes their summed count until it is
+    probed again. A run of all the children is the parent itself, which
+    becomes a leaf again instead.
+    """
+    with connect(SQLITE_DB_FULL_PATH, readonly=True) as db:
+        rows = db.execute("""
+            SELECT C.PARENT, P.NUM_PAGES, P.PER_PAGE_PROPERTIES,
+                   (SELECT COUNT(*) FROM URLS S WHERE S.PARENT = C.PARENT), C.URL, C.NUM_PROPERTIES
+            FROM URLS C JOIN URLS P ON P.URL = C.PARENT
+            WHERE substr(C.URL, 1, ?) = ? AND C.LEAF = 1 AND C.NUM_PROPERTIES IS NOT NULL
+                AND C.URL != C.PARENT
+            ORDER BY C.PARENT""", (len(base_url), base_url)).fetchall()
+    statements = []
+    merged = 0
+    for (parent, num_pages, per_page, num_children), children in itertools.groupby(rows, key=lambda row: row[:4]):
+        if not (num_pages and per_page):
+            continue
+        siblings = [(url, count) for _, _, _, _, url, count in children]
+        for url, members, total in merge_adjacent_filters(
+                siblings, base_url, num_pages * per_page * FILL_FACTOR):
+            if len(members) == num_children or url == parent:
+                statements.append((DROP_CHILDREN_SQL, (parent,)))
+                statements.append((COLLAPSE_SQL, (total, max(1, math.ceil(total / per_page)), parent)))
+            else:
+                statements.extend((DELETE_URL_SQL, (member,)) for member in members)
+                statements.append((INSERT_MERGED_URL_SQL, (
+                    url, total, max(1, math.ceil(total / per_page)), per_page, parent)))
+            merged += len(members)
+    writer.write_all(statements)
+    writer.flush()
+    if merged:
+        LOGGER.info('merged {} sibling partitions into {} urls'.format(
+            merged, sum(1 for sql, _ in statements if sql in (INSERT_MERGED_URL_SQL, COLLAPSE_SQL))))
+    return merged
+
+
+def seed_partition(frontier, writer, base_url, resume=False, incremental=False):
+    """Fill the partition frontier of a new run, or pick an interrupted one back up."""
+    if resume and frontier.has(PARTITION):
+        frontier.resume(PARTITION)
+        return
+    leaves = get_partition_leaves(base_url) if incremental else []
+    frontier.clear(PARTITION)
+    if leaves:
+        LOGGER.info('re-probing {} stored partitions of {}'.format(len(leaves), base_url))
+        # Level 0 always splits, so stored leaves start one level down.
+        frontier.add(PARTITION, leaves, level=1)
+    else:
+        first_urls = apply_filters(base_url, base_url)
+        # A full run rebuilds the tree, so leaves of earlier runs no longer count.
+        writer.write('UPDATE URLS SET LEAF = 0 WHERE substr(URL, 1, ?) = ?', (len(base_url), base_url))
+        writer.write_all((ADD_CHILD_SQL, (url, None)) for url in first_urls)
+        frontier.add(PARTITION, first_urls, level=0)
+
+
+def probe_statements(frontier, base_url, url, result, level, price_samples):
+    """Return (statements, leaf) storing the probe `result` of a url at `level`.
+
+    A url over the pagination cap is split, and its children are added to
+    the frontier one level down; leaf is False then.
+    """
+    statements = [(INSERT_URL_SQL, result)]
+    leaf = True
+    if (result[1] and result[2] and result[3] and result[1] > result[2] * result[3]) or (level == 0):
+        print("result", result, "base", base_url)
+        expanded_urls = apply_filters(result[0], base_url, count=result[1],
+                                      cap=(result[2] or 0) * (result[3] or 0),
+                                      price_samples=price_samples)
+        if len(expanded_urls) == 1 and expanded_urls[0] == result[0]:
+            LOGGER.info('Cannot further split {}'.format(result[0]))
+        else:
+            statements.extend(partition_statements(url, expanded_urls))
+            statements.extend(frontier.add_statement(PARTITION, expanded_url, level + 1)
+                              for expanded_url in expanded_urls)
+            leaf = False
+    statements.append(frontier.done_statement(PARTITION, url))
+    return statements, leaf
+
+
+def finish_partition(frontier, writer, base_url, incremental=False):
+    """Tidy the partition tree once every url is probed."""
+    if incremental:
+        merge_partition_leaves(writer, base_url)
+    merge_sibling_partitions(writer, base_url)
+    LOGGER.info('Partitioning finished: {}'.format(frontier.counts(PARTITION)))
+
+
+async def url_partition(fetcher, frontier, writer, base_url, max_levels=6, resume=False, incremental=False,
+                        on_leaf=None, tidy=True):
     """Partition the listings for a given url into multiple sub-urls,
     such that each url contains at most 20 properties.
+
+    A url over the pagination cap is split into as many children as its
+    result count calls for, with price cuts placed at the quantiles of the
+    prices earlier runs saw in the city (see apply_filters).
+
+    URLS keeps the partition tree: every url has its PARENT and LEAF is set
+    on the urls that were not split. With incremental=True, a run starts
+    from the stored leaves instead of the root, splits the ones that grew
+    over the cap and merges siblings that shrank back under it.
+
+    Probe results stream into URLS in batches as they come back, and the
+    frontier tracks which urls are still to be probed, so an interrupted
+    run continues from there with resume=True.
+
+    `on_leaf`, if given, is called with the URLS row of every url that is
+    not split further as soon as its probe comes back. With tidy=False the
+    leaves are not merged afterwards (see finish_partition); callers that
+    already fetched the pages of the leaves merge once they are done.
     """
-    # urls = [base_url]
-    urls = apply_filters(base_url, base_url)
-    # first_iter = True
-    num_levels = 0
+    seed_partition(frontier, writer, base_url, resume, incremental)
     partitioned_urls = []
-    while urls and (num_levels < max_levels):
-        scraper_results = []
-        partition_inputs = []
-
-        if proxies:
-            rand_move = random.randint(0, len(proxies) - 1)
-
-        # print("urls:", urls)
-        for i, url in enumerate(urls):
-            print("url:", url)
-            if proxies:
-                proxy = construct_proxy(
-                    *proxies[(rand_move + i) % len(proxies)])
-                LOGGER.debug(f"scraping url {url} with proxy {proxy}")
-                partition_inputs.append((url, proxy))
-            else:
-                partition_inputs.append((url, ''))
-
-        with ProcessPoolExecutor(max_workers=min(50, len(partition_inputs))) as executor:
-            scraper_results = list(executor.map(
-                get_page_info, partition_inputs))
-
-        LOGGER.info('Getting {} results'.format(len(scraper_results)))
-
-        with sqlite3.connect(SQLITE_DB_FULL_PATH) as db:
-            LOGGER.info('stage {} saving to db!'.format(num_levels))
-            values = []
-            for result in scraper_results:
-                to_nulls = [x if x else 'NULL' for x in result]
-                values.append("('{}', {}, {}, {})".format(*to_nulls))
-            cursor = db.cursor()
-            cursor.execute("""
-                INSERT INTO URLS (URL, NUM_PROPERTIES, NUM_PAGES, PER_PAGE_PROPERTIES)
-                VALUES {};
-            """.format(','.join(values)))
-
-        LOGGER.info('Writing to sqlite {} results'.format(
-            len(scraper_results)))
-        new_urls = []
-        for result in scraper_results:
-            if (result[1] and result[2] and result[3] and result[1] > result[2] * result[3]) or (num_levels == 0):
-                print("result", result, "base", base_url)
-                expanded_urls = apply_filters(result[0], base_url)
-                if len(expanded_urls) == 1 and expanded_urls[0] == result[0]:
-                    LOGGER.info('Cannot further split {}'.format(result[0]))
-                else:
-                    new_urls.extend(expanded_urls)
-            else:
-                partitioned_urls.append(result)
+    price_samples = get_price_samples(base_url)
+
+    while True:
+        num_levels = frontier.next_level(PARTITION)
+        if num_levels is None or num_levels >= max_levels:
+            break
+        urls = frontier.pending(PARTITION, num_levels)
         LOGGER.info('stage {}: running for {} urls. We already captured {} urls'.format(
-            num_levels, len(new_urls), len(partitioned_urls)))
-        urls = new_urls
-        num_levels += 1
-        time.sleep(random.randint(2, 5))
+            num_levels, len(urls), len(partitioned_urls)))
+        frontier.start(PARTITION, urls)
+        async for url, resp in fetcher.stream(urls):
+            result = get_page_info(url, resp)
+            if not fetched(resp):
+                if frontier.fail(PARTITION, url):
+                    # Out of attempts: keep the url so its pages are still crawled directly.
+                    writer.write(INSERT_URL_SQL, result)
+                    if on_leaf:
+                        on_leaf(result)
+                continue
+            statements, leaf = probe_statements(frontier, base_url, url, result, num_levels, price_samples)
+            writer.write_all(statements)
+            if leaf:
+                partitioned_urls.append(result)
+                if on_leaf:
+                    on_leaf(result)
+        # The next level is read back from the frontier.
+        writer.flush()
+    if tidy:
+        finish_partition(frontier, writer, base_url, incremental)
     return partitioned_urls
 
 
-def parse_addresses():
-    listing_details = {}
-    with sqlite3.connect(SQLITE_DB_FULL_PATH) as db:
-        cur = db.cursor()
-        cur.execute("SELECT * FROM listings")
-        rows = cur.fetchall()
-        urls = set()
+def parse_listing_page(json_details):
+    """Return the LISTING_SHORT_DETAILS rows of one summary page's json."""
+    rows = []
+    for listing in json.loads(json_details):
+        num_rooms, name, country, region, locality, street, postal, house_type, price = \
+            None, None, None, None, None, None, None, None, None
+        listing_url = None
+        if (not isinstance(listing, list)) and (not isinstance(listing, dict)):
+            continue
 
-        for url, json_details in rows:
-            if url in urls:
-                continue
-            urls.add(url)
-            listings_on_page = (json.loads(json_details))
-            for listing in listings_on_page:
-                num_rooms, name, country, region, locality, street, postal, house_type, price = \
-                    None, None, None, None, None, None, None, None, None
-                listing_url = None
-                if (not isinstance(listing, list)) and (not isinstance(listing, dict)):
-                    continue
-
-                if isinstance(listing, dict):
-                    info = listing
-                    if ('url' in info) and ('address' in info):
-                        listing_url = info.get('url')
-                        address_details = info['address']
-                        num_rooms = info.get('numberOfRooms')
-                        name = info.get('name')
-                        country = address_details.get('addressCountry')
-                        region = address_details.get('addressRegion')
-                        locality = address_details.get('addressLocality')
-                        street = address_details.get('streetAddress')
-                        postal = address_details.get('postalCode')
-                        house_type = info.get('@type')
-                        listing_details[listing_url] = (listing_url, num_rooms, name, country,
-                                                        region, locality, street, postal, house_type, price)
-                    continue
-
-                for info in listing:
-                    if ('url' in info) and ('address' in info):
-                        listing_url = info.get('url')
-                        address_details = info['address']
-                        num_rooms = info.get('numberOfRooms')
-                        name = info.get('name')
-                        country = address_details.get('addressCountry')
-                        region = address_details.get('addressRegion')
-                        locality = address_details.get('addressLocality')
-                        street = address_details.get('streetAddress')
-                        postal = address_details.get('postalCode')
-                        house_type = info.get('@type')
-                    if 'offers' in info:
-                        price = info['offers'].get('price')
-                if listing_url:
-                    listing_details[listing_url] = (listing_url, num_rooms, name, country,
-                                                    region, locality, street, postal, house_type, price)
-
-    with sqlite3.connect(SQLITE_DB_FULL_PATH) as db:
-        cursor = db.cursor()
-        try:
-            cursor.executemany("""
-                INSERT INTO LISTING_SHORT_DETAILS (
-                             URL,
-                             NUMBER_OF_ROOMS,
-                             NAME     ,
-                             COUNTRY  ,
-                             REGION    ,
-                             LOCALITY  ,
-                             STREET    ,
-                             POSTAL   ,
-                             TYPE      ,
-                             PRICE)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-            """, listing_details.values())
-        except Exception as e:
-            LOGGER.info(e)
-
-
-def scrape_page(url_proxy):
-    time.sleep(random.random() * 16)
+        if isinstance(listing, dict):
+            info = listing
+            if ('url' in info) and ('address' in info):
+                listing_url = info.get('url')
+                address_details = info['address']
+                num_rooms = info.get('numberOfRooms')
+                name = info.get('name')
+                country = address_details.get('addressCountry')
+                region = address_details.get('addressRegion')
+                locality = address_details.get('addressLocality')
+                street = address_details.get('streetAddress')
+                postal = address_details.get('postalCode')
+                house_type = info.get('@type')
+                rows.append((listing_url, num_rooms, name, country,
+                             region, locality, street, postal, house_type, price))
+            continue
+
+        for info in listing:
+            if ('url' in info) and ('address' in info):
+                listing_url = info.get('url')
+                address_details = info['address']
+                num_rooms = info.get('numberOfRooms')
+                name = info.get('name')
+                country = address_details.get('addressCountry')
+                region = address_details.get('addressRegion')
+                locality = address_details.get('addressLocality')
+                street = address_details.get('streetAddress')
+                postal = address_details.get('postalCode')
+                house_type = info.get('@type')
+            if 'offers' in info:
+                price = info['offers'].get('price')
+        if listing_url:
+            rows.append((listing_url, num_rooms, name, country,
+                         region, locality, street, postal, house_type, price))
+    return rows
+
+
+def parse_stored_page(info, encoding=None):
+    """Return the LISTING_SHORT_DETAILS rows of a LISTING_BLOBS.INFO value stored in `encoding`."""
+    return parse_listing_page(decode_blob(info, encoding))
+
+
+def parse_addresses(writer, chunk_size=PARSE_CHUNK_SIZE, max_workers=None):
+    """Parse the summary pages stored since the last run into LISTING_SHORT_DETAILS.
+
+    Pages are read in chunks of `chunk_size` in LISTINGS.SEQ order and parsed
+    on a process pool. Every chunk's rows are committed together with the
+    new high-water mark in CRAWL_STATE, so an interrupted pass continues
+    after the last committed chunk.
+    """
+    with connect(SQLITE_DB_FULL_PATH, readonly=True) as db:
+        row = db.execute('SELECT VALUE FROM CRAWL_STATE WHERE KEY = ?', (PARSE_ADDRESSES_KEY,)).fetchone()
+        mark = row[0] if row else 0
+        cur = db.execute("""
+            SELECT L.SEQ, B.INFO, B.ENCODING FROM LISTINGS L JOIN LISTING_BLOBS B ON B.URL = L.URL
+            WHERE L.SEQ > ? AND L.PARSED = 0 ORDER BY L.SEQ""", (mark,))
+        pages, listings = 0, 0
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                chunk = cur.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                mark = chunk[-1][0]
+                statements = [(INSERT_SHORT_DETAILS_SQL, row)
+                              for rows in executor.map(parse_stored_page, [info for _, info, _ in chunk],
+                                                       [encoding for _, _, encoding in chunk],
+                                                       chunksize=max(1, chunk_size // 50))
+                              for row in rows]
+                statements.append((SET_STATE_SQL, (PARSE_ADDRESSES_KEY, mark)))
+                writer.write_all(statements)
+                pages += len(chunk)
+                listings += len(statements) - 1
+    writer.flush()
+    LOGGER.info('parsed {} new summary pages into {} listings'.format(pages, listings))
+
+
+def compact_listings(writer, encoding, chunk_size=COMPACT_CHUNK_SIZE):
+    """Re-encode every stored search page into `encoding`, then VACUUM to give the space back.
+
+    Pages already in `encoding` are left alone, so an interrupted pass can
+    simply be run again. Going from slim back to plain json keeps only the
+    slim fields.
+    """
+    pages = 0
+    with connect(SQLITE_DB_FULL_PATH, readonly=True) as db:
+        cur = db.execute('SELECT URL, INFO, ENCODING FROM LISTING_BLOBS WHERE ENCODING IS NOT ?', (encoding,))
+        while True:
+            chunk = cur.fetchmany(chunk_size)
+            if not chunk:
+                break
+            writer.write_all(blob_statement(url, decode_blob(info, old), encoding) for url, info, old in chunk)
+            pages += len(chunk)
+    writer.flush()
+    db = connect(SQLITE_DB_FULL_PATH)
+    db.isolation_level = None
+    try:
+        size = db.execute('PRAGMA page_count').fetchone()[0]
+        db.execute('VACUUM')
+        # VACUUM goes through the WAL; checkpoint so the db file shrinks now.
+        db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        page_size = db.execute('PRAGMA page_size').fetchone()[0]
+        LOGGER.info('re-encoded {} search pages as {}, db went from {} to {} bytes'.format(
+            pages, encoding or 'json', size * page_size, db.execute('PRAGMA page_count').fetchone()[0] * page_size))
+    finally:
+        db.close()
+
+
+def scrape_page(url, resp):
     details = []
     try:
-        url, proxy = url_proxy
-        session = requests.Session()
-        resp = session.get(url, headers=HEADER, proxies=proxy)
-        bf = BeautifulSoup(resp.text, 'lxml')
-        details = [json.loads(x.text) for x in bf.find_all(
-            'script', type='application/ld+json')]
+        if resp is not None:
+            details = [json.loads(x) for x in ld_json_scripts(resp.text)]
     except Exception as e:
-        LOGGER.exception('failed for url {}, proxy {}'.format(url, proxy))
+        LOGGER.exception('failed for url {}'.format(url))
     return url, json.dumps(details)
 
 
+def page_urls(url, num_properties, num_pages, per_page_properties):
+    """Return the search page urls of one partitioned url (a URLS row)."""
+    if num_properties == 0:
+        return []
+    if not num_pages:
+        return [url]
+    if (not num_properties) and int(num_pages) == 1 and per_page_properties:
+        return ['{},sort=lo-price/page-1'.format(url)]
+    if num_properties <= num_pages * per_page_properties:
+        # Build per page urls.
+        return ['{},sort=lo-price/page-{}'.format(url, p) for p in range(1, num_pages + 1)]
+    return []
+
+
+def blob_statement(url, info, encoding=None):
+    """Return the (sql, params) storing a search page's json in LISTING_BLOBS in `encoding`."""
+    return INSERT_LISTING_BLOB_SQL, (url, encode_blob(info, encoding), encoding)
+
+
+def parsed_page_statements(url, info, rows, encoding=None):
+    """Return the (sql, params) storing a search page together with its parsed listings."""
+    statements = [(INSERT_PARSED_LISTING_SQL, (url,)), blob_statement(url, info, encoding)]
+    statements.extend((INSERT_SHORT_DETAILS_SQL, row) for row in rows)
+    return statements
+
+
 def get_paginated_urls(prefix):
     # Return a set of paginated urls with at most 20 properties each.
     paginated_urls = []
-    with sqlite3.connect(SQLITE_DB_FULL_PATH) as db:
+    with connect(SQLITE_DB_FULL_PATH, readonly=True) as db:
         cursor = db.execute("""
             SELECT URL, NUM_PROPERTIES, NUM_PAGES, PER_PAGE_PROPERTIES
-            FROM URLS
+            FROM URLS WHERE LEAF IS NOT 0
         """)
-        seen_urls = set()
         for row in cursor:
-            url, num_properties, num_pages, per_page_properties = row
-            if prefix and (prefix not in url):
+            if prefix and (prefix not in row[0]):
                 continue
-            if url in seen_urls:
+            paginated_urls.extend(page_urls(*row))
+    return paginated_urls
+
+
+def get_bulk_urls(prefix):
+    """Return a gis-csv request for every search url that was not split further."""
+    urls = []
+    with connect(SQLITE_DB_FULL_PATH, readonly=True) as db:
+        cursor = db.execute("""
+            SELECT URL, NUM_PROPERTIES, NUM_PAGES, PER_PAGE_PROPERTIES
+            FROM URLS WHERE LEAF IS NOT 0
+        """)
+        for url, num_properties, num_pages, per_page_properties in cursor:
+            if prefix and (prefix not in url):
                 continue
             if num_properties == 0:
                 continue
-            urls = []
-            if not num_pages:
-                urls = [url]
-            elif (not num_properties) and int(num_pages) == 1 and per_page_properties:
-                urls = ['{},sort=lo-price/page-1'.format(url)]
-            elif num_properties < num_pages * per_page_properties:
-                # Build per page urls.
-                urls = [
-                    '{},sort=lo-price/page-{}'.format(url, p) for p in range(1, num_pages + 1)]
-            paginated_urls.extend(urls)
-    return list(set(paginated_urls))
-
-
-def crawl_redfin_with_proxies(proxies, prefix=''):
-    small_urls = get_paginated_urls(prefix)
-
-    if proxies:
-        rand_move = random.randint(0, len(proxies) - 1)
-
-    scrape_inputs, scraper_results = [], []
-    for i, url in enumerate(small_urls):
-        if proxies:
-            proxy = construct_proxy(*proxies[(rand_move + i) % len(proxies)])
-            scrape_inputs.append((url, proxy))
-        else:
-            scrape_inputs.append((url, ''))
+            if num_properties and num_pages and per_page_properties and \
+                    num_properties > num_pages * per_page_properties:
+                # Partitioned into sub-urls.
+                continue
+            if num_properties and num_properties > NUM_HOMES:
+                LOGGER.warning('{} has {} homes, the csv only returns {}'.format(
+                    url, num_properties, NUM_HOMES))
+            urls.append(gis_csv_url(url))
+    return urls
 
-    with ProcessPoolExecutor(max_workers=min(50, len(scrape_inputs))) as executor:
-        scraper_results = list(executor.map(scrape_page, scrape_inputs))
 
-    LOGGER.warning('Finished scraping!')
+async def crawl_redfin_gis_csv(fetcher, frontier, writer, prefix='', listing_prefix="https://redfin.com",
+                               resume=False):
+    """Fill LISTING_SHORT_DETAILS and LISTING_FULL_DETAILS from Redfin's csv download.
 
-    with sqlite3.connect(SQLITE_DB_FULL_PATH) as db:
-        cursor = db.cursor()
-        for result in scraper_results:
-            url, info = result
-            try:
-                cursor.execute("""
-                    INSERT INTO LISTINGS (URL, INFO)
-                    VALUES (?, ?)""", (url, info))
-            except Exception as e:
-                LOGGER.info('failed record: {}'.format(result))
-                LOGGER.info(e)
+    One request per partitioned search url replaces its search pages and
+    the detail page of every home on them.
+    """
+    if resume and frontier.has(BULK):
+        frontier.resume(BULK)
+    else:
+        frontier.clear(BULK)
+        frontier.add(BULK, get_bulk_urls(prefix))
+
+    urls = frontier.pending(BULK)
+    while urls:
+        frontier.start(BULK, urls)
+        async for url, resp in fetcher.stream(urls):
+            if not fetched(resp):
+                frontier.fail(BULK, url)
+                continue
+            short_rows, full_rows = parse_gis_csv(resp.text, listing_prefix)
+            statements = [(INSERT_SHORT_DETAILS_SQL, row) for row in short_rows]
+            statements.extend((INSERT_FULL_DETAILS_SQL, row) for row in full_rows)
+            statements.append(frontier.done_statement(BULK, url))
+            writer.write_all(statements)
+        writer.flush()
+        urls = frontier.pending(BULK)
 
+    LOGGER.info('Finished downloading listings! {}'.format(frontier.counts(BULK)))
 
-def get_listing_urls(prefix):
-    # Return a set of paginated urls with at most 20 properties each.
+
+async def crawl_redfin_with_proxies(fetcher, frontier, writer, prefix='', resume=False):
+    if resume and frontier.has(PAGES):
+        frontier.resume(PAGES)
+    else:
+        frontier.clear(PAGES)
+        frontier.add(PAGES, get_paginated_urls(prefix))
+
+    urls = frontier.pending(PAGES)
+    while urls:
+        frontier.start(PAGES, urls)
+        async for url, resp in fetcher.stream(urls):
+            if not fetched(resp):
+                frontier.fail(PAGES, url)
+                continue
+            page = scrape_page(url, resp)
+            writer.write_all([(INSERT_LISTING_SQL, (url,)),
+                              blob_statement(*page, encoding=BLOB_ENCODING),
+                              frontier.done_statement(PAGES, url)])
+        writer.flush()
+        urls = frontier.pending(PAGES)
+
+    LOGGER.warning('Finished scraping! {}'.format(frontier.counts(PAGES)))
+
+
+def get_listing_urls(prefix, city=None):
+    # Return the listing urls, of a single city if `city` is a base url.
     urls = []
-    with sqlite3.connect(SQLITE_DB_FULL_PATH) as db:
-        cursor = db.execute("""
-            SELECT URL FROM LISTING_SHORT_DETAILS
-        """)
+    with connect(SQLITE_DB_FULL_PATH, readonly=True) as db:
+        if city:
+            cursor = db.execute("""
+                SELECT URL FROM LISTING_SHORT_DETAILS WHERE REGION = ? AND LOCALITY = ?
+            """, city_of(city))
+        else:
+            cursor = db.execute("""
+                SELECT URL FROM LISTING_SHORT_DETAILS
+            """)
         for row in cursor:
             urls.append(prefix + row[0])
 
         return urls
 
 
-def scrape_redfin_listing(url_proxy):
-    time.sleep(random.random() * 16)
-    price, num_beds, num_baths, sqft = 0, 0, 0, 0
-    time_on, year, lot, redfin_price, sqft_price = 0, 0, 0, 0, 0
-    mortgage = 0
+def scrape_redfin_listing(url, resp):
+    """Return the LISTING_FULL_DETAILS fields (after URL and DATE) of a listing page."""
+    fields = {spec.name: spec.default for spec in LISTING_FIELDS}
     try:
-        url, proxy = url_proxy
-        session = requests.Session()
-        resp = session.get(url, headers=HEADER, proxies=proxy)
-        bf = BeautifulSoup(resp.text, 'lxml')
-        home_main_stats_div = bf.find(
-            'div', {'class': 'home-main-stats-variant'})
-        if home_main_stats_div:
-            price_div = home_main_stats_div.find(
-                'div', {'data-rf-test-id': 'abp-price'})
-            beds_div = home_main_stats_div.find(
-                'div', {'data-rf-test-id': 'abp-beds'})
-            baths_div = home_main_stats_div.find(
-                'div', {'data-rf-test-id': 'abp-baths'})
-            sqft_div = home_main_stats_div.find(
-                'div', {'data-rf-test-id': 'abp-sqFt'})
-            price_txt = price_div.get_text()
-            beds_txt = beds_div.get_text()
-            baths_txt = baths_div.get_text()
-            sqft_txt = sqft_div.get_text()
-            price_pattern = r'\$([0-9,]+)*'
-            beds_pattern = r'([0-9]+)Beds*'
-            baths_pattern = r'([0-9.]+)Baths*'
-            sqft_pattern = r'([0-9,]+)Sq Ft*'
-            m_price = re.match(price_pattern, price_txt)
-            m_beds = re.match(beds_pattern, beds_txt)
-            m_baths = re.match(baths_pattern, baths_txt)
-            m_sqft = re.match(sqft_pattern, sqft_txt)
-            if m_price:
-                price = int(re.sub(r'[,]', '', m_price.group(1)))
-            if m_beds:
-                num_beds = int(m_beds.group(1))
-            if m_baths:
-                num_baths = float(m_baths.group(1))
-            if m_sqft:
-                sqft = int(re.sub(r'[,]', '', m_sqft.group(1)))
-
-        page_content_div = bf.find('div', {'class': 'content clear-fix'})
-        if page_content_div:
-            status_pattern = r'Status([a-zA-Z]+)*'
-            time_on_redfin_pattern = r'Time on Redfin([0-9]+)*'
-            year_built_pattern = r'Year Built([0-9]+)*'
-            lot_size_pattern = r'Lot Size([0-9,]+)*'
-            redfin_estimate_pattern = r'Redfin Estimate\$([0-9,]+)*'
-            price_sqrt_pattern = r'Price/Sq.Ft.\$([0-9,]+)*'
-
-            key_details = page_content_div.findChildren(
-                'div', {'class': 'keyDetail'})
-            for d_div in key_details:
-                d_text = d_div.get_text()
-                m_status = re.match(status_pattern, d_text)
-                m_time_on = re.match(time_on_redfin_pattern, d_text)
-                m_year = re.match(year_built_pattern, d_text)
-                m_lot = re.match(lot_size_pattern, d_text)
-                m_redfin_price = re.match(redfin_estimate_pattern, d_text)
-                m_sqft_price = re.match(price_sqrt_pattern, d_text)
-                if m_status:
-                    status = m_status.group(1)
-                if m_time_on:
-                    time_on = int(m_time_on.group(1))
-                if m_year:
-                    year = int(m_year.group(1))
-                if m_lot:
-                    lot = float(re.sub(r'[,]', '', m_lot.group(1)))
-                    # if lot size in acres, convert to sqft
-                    if lot < 100:
-                        lot *= 43560
-                if m_redfin_price:
-                    redfin_price = int(
-                        re.sub(r'[,]', '', m_redfin_price.group(1)))
-                if m_sqft_price:
-                    sqft_price = int(re.sub(r'[,]', '', m_sqft_price.group(1)))
-
-        calculator_summary_div = bf.find('div', {'class': 'CalculatorSummary'})
-
-        if calculator_summary_div:
-            mortgage_text = calculator_summary_div.get_text()
-            mortgage_pattern = r'\$([0-9,]+)* per month'
-            m_mortgage = re.match(mortgage_pattern, mortgage_text)
-            if m_mortgage:
-                mortgage = int(re.sub(r'[,]', '', m_mortgage.group(1)))
-
+        if resp is None:
+            raise Exception('no response')
+        fields = extract_listing(resp.text)
     except Exception as e:
-        LOGGER.exception('failed for url {}, proxy {}'.format(url, proxy))
+        LOGGER.exception('failed for url {}'.format(url))
 
-    return url, (status, price, num_beds, num_baths,
-                 sqft, time_on, year, lot,
-                 redfin_price, sqft_price, mortgage)
+    return url, tuple(fields[spec.name] for spec in LISTING_FIELDS)
 
 
-def crawl_redfin_listings(proxies, prefix="https://redfin.com"):
-    # Get listing urls
-    # Iterate over urls and scrape listing page
-    # Extract bedrooms, bathrooms, sqft, year, price/sqft, price, redfin price,
-    # Write data to db
-    listing_urls = get_listing_urls(prefix)
+def change_score(status, price, listed_price, time_on_redfin, days_checked, days_changed):
+    """Score how likely a listing page changed since it was last scraped; higher first.
 
-    if proxies:
-        rand_move = random.randint(0, len(proxies) - 1)
+    The signals are a price on the search pages that differs from the
+    scraped one, a status that can still move (active, pending), a listing
+    that is new on Redfin, a recent change and the days since the last check.
+    """
+    score = STALE_SCORE_PER_DAY * (days_checked or 0)
+    if listed_price and price and int(listed_price) != int(price):
+        score += PRICE_MOVED_SCORE
+    if (status or '').lower() in OPEN_STATUSES:
+        score += OPEN_STATUS_SCORE
+    if time_on_redfin is not None:
+        score += NEW_LISTING_SCORE * NEW_LISTING_DAYS / (NEW_LISTING_DAYS + max(0, time_on_redfin))
+    if days_changed is not None and days_changed < RECENT_CHANGE_DAYS:
+        score += RECENT_CHANGE_SCORE
+    return score
 
-    scrape_inputs, scraper_results = [], []
-    for i, url in enumerate(listing_urls):
-        if proxies:
-            proxy = construct_proxy(*proxies[(rand_move + i) % len(proxies)])
-            scrape_inputs.append((url, proxy))
-        else:
-            scrape_inputs.append((url, ''))
 
-    with ProcessPoolExecutor(max_workers=min(50, len(scrape_inputs))) as executor:
-        scraper_results = list(executor.map(
-            scrape_redfin_listing, scrape_inputs))
+def rank_listing_urls(urls, prefix):
+    """Return `urls` ordered by change_score; listings never scraped come first."""
+    with connect(SQLITE_DB_FULL_PATH, readonly=True) as db:
+        listed = dict(db.execute('SELECT ? || URL, PRICE FROM LISTING_SHORT_DETAILS', (prefix,)))
+        signals = {row[0]: row[1:] for row in db.execute("""
+            SELECT F.URL, F.STATUS, F.PRICE, F.TIME_ON_REDFIN,
+                   julianday('now') - julianday(COALESCE(S.CHECKED_AT, replace(F.DATE, '/', '-'))),
+                   julianday('now') - julianday(S.CHANGED_AT)
+            FROM LISTING_FULL_DETAILS F LEFT JOIN FETCH_STATE S ON S.URL = F.URL
+            WHERE F.DATE = (SELECT MAX(DATE) FROM LISTING_FULL_DETAILS WHERE URL = F.URL)""")}
+
+    def score(url):
+        if url not in signals:
+            return float('inf')
+        status, price, time_on_redfin, days_checked, days_changed = signals[url]
+        return change_score(status, price, listed.get(url), time_on_redfin, days_checked, days_changed)
+
+    return sorted(urls, key=score, reverse=True)
+
+
+def get_fetch_state():
+    """Return url -> (ETAG, LAST_MODIFIED, HASH) of the listing pages fetched before."""
+    with connect(SQLITE_DB_FULL_PATH, readonly=True) as db:
+        return {row[0]: row[1:] for row in db.execute(
+            'SELECT URL, ETAG, LAST_MODIFIED, HASH FROM FETCH_STATE')}
+
 
-    LOGGER.info('Finished scraping listings!')
+def conditional_headers(state):
+    """Return the headers of a conditional request for a page last fetched with `state`."""
+    etag, last_modified, _ = state
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+def fields_hash(info):
+    return hashlib.sha1(json.dumps(info).encode()).hexdigest()
+
+
+def listing_statements(url, resp, today, state=None):
+    """Return (statements, changed) storing a fetched listing page.
+
+    An unchanged page (a 304 answer to a conditional request, or the same
+    extracted fields) carries its last details forward to today instead of
+    being parsed or stored again.
+    """
+    if resp.status == 304:
+        return [(CARRY_FORWARD_SQL, (today, url)), (SET_CHECKED_SQL, (url,))], False
+    url, info = scrape_redfin_listing(url, resp)
+    digest = fields_hash(info)
+    changed = state is None or state[2] != digest
+    if changed:
+        statements = [(INSERT_FULL_DETAILS_SQL, (url, today) + info)]
+    else:
+        statements = [(CARRY_FORWARD_SQL, (today, url))]
+    headers = resp.headers or {}
+    statements.append((SET_FETCH_STATE_SQL, (url, headers.get('ETag'), headers.get('Last-Modified'), digest)))
+    return statements, changed
+
+
+async def crawl_redfin_listings(fetcher, frontier, writer, prefix="https://redfin.com", resume=False, city=None,
+                                max_details=None):
+    """Scrape the listing page of every home in LISTING_SHORT_DETAILS into LISTING_FULL_DETAILS.
+
+    Pages fetched before are requested conditionally and unchanged ones are
+    carried forward (see listing_statements). With max_details, only that
+    many listings, the likeliest to have changed first, are fetched; the
+    rest keep their last details for today.
+    """
     today = date.today().strftime('%Y/%m/%d')
+    if resume and frontier.has(LISTINGS):
+        frontier.resume(LISTINGS)
+    else:
+        frontier.clear(LISTINGS)
+        urls = get_listing_urls(prefix, city)
+        if max_details is not None and len(urls) > max_details:
+            urls = rank_listing_urls(urls, prefix)
+            writer.write_all((CARRY_FORWARD_SQL, (today, url)) for url in urls[max_details:])
+            LOGGER.info('re-scraping the {} of {} listings likeliest to have changed'.format(
+                max_details, len(urls)))
+            urls = urls[:max_details]
+        frontier.add(LISTINGS, urls)
+    state = get_fetch_state()
+    headers = {url: conditional_headers(state[url]) for url in frontier.pending(LISTINGS) if url in state}
+    unchanged = 0
+
+    urls = frontier.pending(LISTINGS)
+    while urls:
+        frontier.start(LISTINGS, urls)
+        async for url, resp in fetcher.stream(urls, headers=headers):
+            if not fetched(resp, LISTING_STATUSES):
+                frontier.fail(LISTINGS, url)
+                continue
+            statements, changed = listing_statements(url, resp, today, state.get(url))
+            unchanged += not changed
+            statements.append(frontier.done_statement(LISTINGS, url))
+            writer.write_all(statements)
+        writer.flush()
+        urls = frontier.pending(LISTINGS)
 
-    with sqlite3.connect(SQLITE_DB_FULL_PATH) as db:
-        cursor = db.cursor()
-        for result in scraper_results:
-            url, info = result
-            (status, price, num_beds, num_baths,
-             sqft, time_on, year, lot,
-             redfin_price, sqft_price, mortgage) = info
-            print("Listing info:", url, info)
-            try:
-                cursor.execute("""
-                    INSERT INTO LISTING_FULL_DETAILS (
-                        URL,
-                        DATE,
-                        STATUS,
-                        PRICE,
-                        NUMBER_ROOMS,
-                        NUMBER_BATHROOMS,
-                        SQFT,
-                        TIME_ON_REDFIN,
-                        YEAR,
-                        LOT_SIZE,
-                        REDFIN_PRICE,
-                        SQFT_PRICE,
-                        MORTGAGE
-                    )
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                               (url, today, status, price,
-                                num_beds, num_baths, sqft, time_on,
-                                year, lot, redfin_price, sqft_price, mortgage))
-            except Exception as e:
-                LOGGER.info('failed record: {}'.format(result))
-                LOGGER.info(e)
+    LOGGER.info('Finished scraping listings! {}, {} unchanged'.format(frontier.counts(LISTINGS), unchanged))
+
+
+async def pipeline_stage(fetcher, frontier, writer, stage, inbox, handle, catch_up=None, headers=None):
+    """Fetch the batches of urls put on `inbox` as they arrive, until a None batch.
+
+    `handle(url, resp)` stores every response. Urls that failed, and the
+    urls returned by `catch_up()` that the frontier does not have yet, are
+    then fetched like a regular stage until none are pending. `headers`
+    optionally maps urls to extra request headers.
+    """
+    async def arrivals():
+        while True:
+            urls = await inbox.get()
+            if urls is None:
+                return
+            writer.write_all(frontier.start_statements(stage, urls))
+            for url in urls:
+                yield url
+
+    async for url, resp in fetcher.stream(arrivals(), headers=headers):
+        handle(url, resp)
+    writer.flush()
+    if catch_up:
+        frontier.add(stage, catch_up())
+    urls = frontier.pending(stage)
+    while urls:
+        frontier.start(stage, urls)
+        async for url, resp in fetcher.stream(urls, headers=headers):
+            handle(url, resp)
+        writer.flush()
+        urls = frontier.pending(stage)
+
+
+async def crawl_pipeline(fetcher, frontier, writer, base_url, prefix='', max_levels=6, resume=False,
+                         incremental=False, details=False, listing_prefix="https://redfin.com", city=None):
+    """Partition, scrape the search pages and, with details=True, the listing pages as one pipeline.
+
+    Every leaf partition hands its search pages to the page stage as soon as
+    its probe comes back, and every scraped page hands its listing urls to
+    the detail stage, so the stages overlap instead of waiting on each
+    other. Search pages are parsed into LISTING_SHORT_DETAILS as they are
+    stored.
+    """
+    stages = [PAGES, LISTINGS] if details else [PAGES]
+    for stage in stages:
+        if resume and frontier.has(stage):
+            frontier.resume(stage)
+        else:
+            frontier.clear(stage)
+    pages, listings = asyncio.Queue(), asyncio.Queue()
+    today = date.today().strftime('%Y/%m/%d')
+    # Listing pages fetched by earlier runs are asked for conditionally, as in crawl_redfin_listings.
+    state = get_fetch_state() if details else {}
+    headers = {url: conditional_headers(url_state) for url, url_state in state.items()}
+
+    def store_page(url, resp):
+        if not fetched(resp):
+            frontier.fail(PAGES, url)
+            return
+        url, info = scrape_page(url, resp)
+        rows = parse_listing_page(info)
+        statements = parsed_page_statements(url, info, rows, BLOB_ENCODING)
+        statements.append(frontier.done_statement(PAGES, url))
+        writer.write_all(statements)
+        if details and rows:
+            listings.put_nowait([listing_prefix + row[0] for row in rows])
+
+    def store_listing(url, resp):
+        if not fetched(resp, LISTING_STATUSES):
+            frontier.fail(LISTINGS, url)
+            return
+        statements, _ = listing_statements(url, resp, today, state.get(url))
+        statements.append(frontier.done_statement(LISTINGS, url))
+        writer.write_all(statements)
+
+    async def partition():
+        try:
+            await url_partition(fetcher, frontier, writer, base_url, max_levels=max_levels, resume=resume,
+                                incremental=incremental, on_leaf=lambda row: pages.put_nowait(page_urls(*row)),
+                                tidy=False)
+        finally:
+            pages.put_nowait(None)
+
+    async def scrape_pages():
+        try:
+            # Leaves probed before an interrupted run, and leaves of other
+            # runs, are picked up once partitioning is done.
+            await pipeline_stage(fetcher, frontier, writer, PAGES, pages, store_page,
+                                 lambda: get_paginated_urls(prefix))
+        finally:
+            listings.put_nowait(None)
+
+    stage_runs = [partition(), scrape_pages()]
+    if details:
+        # Listings of pages scraped before an interrupted run are only known from the db.
+        catch_up = (lambda: get_listing_urls(listing_prefix, city)) if resume else None
+        stage_runs.append(pipeline_stage(fetcher, frontier, writer, LISTINGS, listings, store_listing, catch_up,
+                                         headers))
+    # Let every stage wind down before an error is raised, so none is left running.
+    for result in await asyncio.gather(*stage_runs, return_exceptions=True):
+        if isinstance(result, Exception):
+            raise result
+    # Merged leaves would have their pages fetched again by the catch-up, so
+    # the tree is only tidied for the next run once every page is in.
+    finish_partition(frontier, writer, base_url, incremental)
+
+    LOGGER.info('Finished the pipeline! {}'.format({stage: frontier.counts(stage) for stage in stages}))
+
+
+def replay_statements(path, page=False, encoding=None):
+    """Return the statements re-extracting one cached response (runs on a process pool).
+
+    Listing pages and search pages (`page`, or paginated urls) are
+    extracted again; partition probes are skipped, as replaying them could
+    not rebuild the partition tree.
+    """
+    entry = read_entry(path)
+    if entry is None:
+        return []
+    resp, fetched_at = entry
+    if '/home/' in resp.url:
+        url, info = scrape_redfin_listing(resp.url, resp)
+        day = date.fromtimestamp(fetched_at).strftime('%Y/%m/%d')
+        return [(INSERT_FULL_DETAILS_SQL, (url, day) + info)]
+    if page or '/page-' in resp.url:
+        url, info = scrape_page(resp.url, resp)
+        return parsed_page_statements(url, info, parse_listing_page(info), encoding)
+    return []
+
+
+def replay_cache(writer, cache, max_workers=None, encoding=None):
+    """Re-run page and listing extraction over every response in the cache, without fetching.
+
+    Search pages are told apart from probes of the same url by LISTINGS,
+    which holds the urls fetched as pages. Listing details are stored under
+    the day their page was fetched.
+    """
+    with connect(SQLITE_DB_FULL_PATH, readonly=True) as db:
+        page_keys = {cache_key(row[0]) for row in db.execute('SELECT URL FROM LISTINGS')}
+    paths = list(cache.paths())
+    pages = [os.path.splitext(os.path.basename(path))[0] in page_keys for path in paths]
+    statements = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for replayed in executor.map(replay_statements, paths, pages, itertools.repeat(encoding), chunksize=50):
+            writer.write_all(replayed)
+            statements += len(replayed)
+    writer.flush()
+    LOGGER.info('replayed {} cached responses into {} rows'.format(len(paths), statements))
+
+
+async def crawl_city(args, fetcher, frontier, writer, base_url, parse_lock, batch=False):
+    """Run the stages selected by args.type for one city."""
+    # In batch mode every stage is limited to the city's own urls.
+    prefix = base_url if batch else ''
+    if args.source == 'gis-csv' and args.type != 'pages':
+        if args.type != 'filtered_properties':
+            await url_partition(fetcher, frontier, writer, base_url,
+                                max_levels=args.partition_levels, resume=args.resume,
+                                incremental=args.incremental)
+        await crawl_redfin_gis_csv(fetcher, frontier, writer, args.property_prefix or prefix,
+                                   resume=args.resume)
+    elif args.type == 'pages':
+        await url_partition(fetcher, frontier, writer, base_url,
+                            max_levels=args.partition_levels, resume=args.resume,
+                            incremental=args.incremental)
+    elif args.type == 'properties':
+        await crawl_pipeline(fetcher, frontier, writer, base_url, prefix,
+                             max_levels=args.partition_levels, resume=args.resume,
+                             incremental=args.incremental, details=args.details,
+                             city=base_url if batch else None)
+        # The pipeline parses its own pages; this picks up pages stored by
+        # filtered_properties runs. Parsing is CPU bound: keep it off the
+        # event loop so other cities keep fetching.
+        async with parse_lock:
+            await asyncio.get_event_loop().run_in_executor(None, parse_addresses, writer)
+    elif args.type == 'property_details':
+        await crawl_redfin_listings(fetcher, frontier, writer, resume=args.resume,
+                                    city=base_url if batch else None, max_details=args.max_details)
+    elif args.type == 'filtered_properties':
+        await crawl_redfin_with_proxies(fetcher, frontier, writer, args.property_prefix or prefix,
+                                        resume=args.resume)
+    else:
+        raise Exception('Unknown type {}'.format(args.type))
+
+
+async def run(args, base_urls, proxies):
+    """Crawl every city in `base_urls` through one shared fetcher.
+
+    With more than one city (--city_file) each city gets its own frontier
+    scope and fetcher lane, so the cities' stages interleave fairly and a
+    city waiting on stragglers leaves the proxies to the others.
+    """
+    batch = bool(args.city_file)
+    manager = ProxyManager()
+    if args.proxy_stats:
+        manager.load_checker_results(args.proxy_stats)
+    scheduler = RateScheduler(
+        [construct_proxy(*p)['http'] for p in proxies] if proxies is not None else None,
+        proxy_rate=args.proxy_rate, host_rate=args.host_rate, jitter=args.jitter,
+        manager=manager)
+    writer = SQLiteWriter(SQLITE_DB_FULL_PATH, batch_size=args.batch_size,
+                          flush_interval=args.flush_interval)
+    cache = None
+    if args.cache_dir:
+        cache = ResponseCache(args.cache_dir, ttl=args.cache_ttl * 3600, max_bytes=args.cache_size * 1024 ** 2)
+    frontiers = [Frontier(SQLITE_DB_FULL_PATH, writer, scope=base_url if batch else None)
+                 for base_url in base_urls]
+    parse_lock = asyncio.Lock()
+    async with Fetcher(scheduler, concurrency=args.concurrency, headers=HEADER,
+                       pool_size=args.pool_size, max_pools=args.max_pools, cache=cache) as fetcher:
+        results = await asyncio.gather(*(
+            crawl_city(args, fetcher.lane(base_url), frontier, writer, base_url, parse_lock, batch)
+            for base_url, frontier in zip(base_urls, frontiers)), return_exceptions=True)
+    for base_url, result in zip(base_urls, results):
+        if isinstance(result, Exception):
+            LOGGER.error('crawl of {} failed'.format(base_url), exc_info=result)
+    for frontier in frontiers:
+        frontier.close()
+    writer.close()
+
+
+def read_city_file(path):
+    """Read base urls, one per line; blank lines and # comments are skipped."""
+    with open(path, encoding='utf-8') as f:
+        lines = [line.split('#', 1)[0].strip() for line in f]
+    return [normalize_base_url(line) for line in lines if line]
+
+
+def normalize_base_url(base_url):
+    if base_url[-1] != '/':
+        base_url += '/'
+    return base_url
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Scrape Redfin property data.')
     parser.add_argument(
-        'redfin_base_url',
+        'redfin_base_url', nargs='?',
         help='Redfin base url to specify the crawling location, '
              'e.g., https://www.redfin.com/city/11203/CA/Los-Angeles/'
     )
+    parser.add_argument('--city_file', default='',
+                        help='file with one Redfin base url per line, crawled together in one batch '
+                             'instead of redfin_base_url.')
     parser.add_argument('--proxy_csv', default='',
                         help='proxies csv path. '
                         'It should contain ip_addr,port,user,password if using proxies with auth. '
                         'Or just contain ip_addr,port columns if no auth needed.')
+    parser.add_argument('--proxy_stats', default='',
+                        help='sqlite file written by tools/proxy_checker.py, used to pre-rank proxies.')
     parser.add_argument('--type', default='pages',
                         choices=['properties', 'pages',
                                  'property_details', 'filtered_properties'],
                         help='pages or properties (default: properties)')
+    parser.add_argument('--source', default='html', choices=['html', 'gis-csv'],
+                        help='html parses search and listing pages; gis-csv downloads the listings '
+                             'of every partitioned search url as one csv.')
     parser.add_argument('--property_prefix', default='',
                         help='The property prefix for crawling')
     parser.add_argument('--partition_levels',
                         help="Determine the depth of partition. The higher the more properties scraped.",
                         type=int,
                         default=12)
+    parser.add_argument('--concurrency',
+                        help="Maximum number of requests in flight at once.",
+                        type=int,
+                        default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--pool_size',
+                        help="Keep-alive connections kept open per proxy.",
+                        type=int,
+                        default=DEFAULT_POOL_SIZE)
+    parser.add_argument('--max_pools',
+                        help="Maximum number of proxies with an open connection pool.",
+                        type=int,
+                        default=DEFAULT_MAX_POOLS)
+    parser.add_argument('--proxy_rate',
+                        help="Maximum requests per second sent through each proxy.",
+                        type=float,
+                        default=DEFAULT_PROXY_RATE)
+    parser.add_argument('--host_rate',
+                        help="Maximum requests per second sent to one host across all proxies. "
+                             "Unlimited by default.",
+                        type=float,
+                        default=None)
+    parser.add_argument('--jitter',
+                        help="Maximum random seconds added to every rate-limit wait.",
+                        type=float,
+                        default=DEFAULT_JITTER)
+    parser.add_argument('--batch_size',
+                        help="Rows buffered before results are committed to sqlite.",
+                        type=int,
+                        default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--flush_interval',
+                        help="Seconds results may be buffered before they are committed to sqlite.",
+                        type=float,
+                        default=DEFAULT_FLUSH_INTERVAL)
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue an interrupted run from the url frontier instead of starting over.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Start partitioning from the partitions stored by the last run instead of the root.")
+    parser.add_argument('--details', action='store_true',
+                        help="With --type properties, also scrape the listing page of every home "
+                             "as soon as its search page is scraped.")
+    parser.add_argument('--max_details', type=int, default=None,
+                        help="With --type property_details, re-scrape at most this many listings, the ones "
+                             "likeliest to have changed first. The others keep their last details for today.")
+    parser.add_argument('--cache_dir', default='',
+                        help="Keep successful responses compressed in this directory and serve them from "
+                             "there instead of fetching them again.")
+    parser.add_argument('--cache_ttl', type=float, default=DEFAULT_TTL / 3600,
+                        help="Hours a cached response is served before it is fetched again.")
+    parser.add_argument('--cache_size', type=int, default=DEFAULT_MAX_BYTES // 1024 ** 2,
+                        help="Megabytes the cache may take; the least recently used responses are evicted.")
+    parser.add_argument('--replay', action='store_true',
+                        help="Do not crawl: re-extract every search and listing page in --cache_dir into the db.")
+    parser.add_argument('--blob_encoding', default='json', choices=('json',) + ENCODINGS,
+                        help="How search page json is stored: json, zlib-compressed json, or slim "
+                             "(only the fields the crawler parses, compressed).")
+    parser.add_argument('--compact_listings', action='store_true',
+                        help="Do not crawl: re-encode the stored search pages into --blob_encoding and VACUUM.")
     parser.add_argument('--logging_level', default='info',
                         choices=['info', 'debug'])
     args = parser.parse_args()
+    BLOB_ENCODING = None if args.blob_encoding == 'json' else args.blob_encoding
 
     if args.logging_level == 'info':
         logging.basicConfig(level=logging.INFO)
@@ -550,27 +1206,28 @@ if __name__ == '__main__':
     LOGGER = logging.getLogger(__name__)
 
     create_tables_if_not_exist()
-    redfin_base_url = args.redfin_base_url
-    if redfin_base_url[-1] != '/':
-        redfin_base_url += '/'
+    if args.replay:
+        if not args.cache_dir:
+            parser.error('--replay needs --cache_dir')
+        writer = SQLiteWriter(SQLITE_DB_FULL_PATH, batch_size=args.batch_size)
+        replay_cache(writer, ResponseCache(args.cache_dir, ttl=None), encoding=BLOB_ENCODING)
+        writer.close()
+        parser.exit()
+    if args.compact_listings:
+        writer = SQLiteWriter(SQLITE_DB_FULL_PATH, batch_size=args.batch_size)
+        compact_listings(writer, BLOB_ENCODING)
+        writer.close()
+        parser.exit()
+    if args.city_file:
+        base_urls = read_city_file(args.city_file)
+    elif args.redfin_base_url:
+        base_urls = [normalize_base_url(args.redfin_base_url)]
+    else:
+        parser.error('either redfin_base_url or --city_file is required')
 
     proxies = None
     if args.proxy_csv:
         proxies = pd.read_csv(args.proxy_csv, encoding='utf-8').values
         print(proxies)
 
-    if args.type == 'pages':
-        url_partition(redfin_base_url, proxies,
-                      max_levels=args.partition_levels)
-    elif args.type == 'properties':
-        url_partition(redfin_base_url, proxies,
-                      max_levels=args.partition_levels)
-        crawl_redfin_with_proxies(proxies)
-        parse_addresses()
-    elif args.type == 'property_details':
-        crawl_redfin_listings(proxies)
-        # parse_addresses()
-    elif args.type == 'filtered_properties':
-        crawl_redfin_with_proxies(proxies, args.property_prefix)
-    else:
-        raise Exception('Unknown type {}'.format(args.type))
+    asyncio.run(run(args, base_urls, proxies))
@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+from datetime import date
+
+import pandas as pd
+
+import redfin_crawler
+from redfin_crawler import (
+    construct_proxy, create_tables_if_not_exist, fetched, finish_partition, get_page_info, get_paginated_urls,
+    get_price_samples, normalize_base_url, page_urls, parse_listing_page, parsed_page_statements, probe_statements,
+    scrape_page, scrape_redfin_listing, seed_partition, HEADER, INSERT_FULL_DETAILS_SQL, INSERT_URL_SQL)
+from redfin_blobs import ENCODINGS
+from redfin_cache import ResponseCache
+from redfin_fetcher import Fetcher, DEFAULT_CONCURRENCY, DEFAULT_POOL_SIZE, DEFAULT_MAX_POOLS
+from redfin_frontier import Frontier, PARTITION, PAGES, LISTINGS
+from redfin_proxies import ProxyManager
+from redfin_scheduler import RateScheduler, DEFAULT_PROXY_RATE, DEFAULT_JITTER
+from redfin_storage import SQLiteWriter
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+# Urls handed to a worker per lease.
+DEFAULT_LEASE_SIZE = 20
+# Seconds a worker has to complete a lease before its urls are handed out again.
+DEFAULT_LEASE_TIMEOUT = 300
+# Seconds a worker waits before asking again when every pending url is leased.
+IDLE_WAIT = 1.0
+# Seconds the coordinator keeps telling connected workers the crawl is done.
+DRAIN_TIMEOUT = 30
+# Longest protocol line; a completed batch of search pages carries their json.
+MAX_MESSAGE = 64 * 1024 * 1024
+
+
+class Coordinator:
+    """Owns the partition planning and the url frontier of a distributed crawl.
+
+    Workers connect over TCP and speak JSON lines: {"op": "lease"} is
+    answered with a batch of urls of one stage, and {"op": "complete"}
+    hands back what the worker fetched and parsed for them. The coordinator
+    turns the results into the statements a single-host crawl writes, and
+    is the only process that touches the db.
+
+    The stages are pipelined like crawl_pipeline: a leaf partition adds its
+    search pages to the frontier in the commit that marks it done, and with
+    details=True a search page adds its listings. Leased urls are in flight
+    in the frontier; a lease that is not completed within lease_timeout, or
+    whose worker disconnects, is failed back to pending.
+    """
+
+    def __init__(self, frontier, writer, base_url, max_levels=6, details=False, incremental=False,
+                 listing_prefix="https://redfin.com", lease_timeout=DEFAULT_LEASE_TIMEOUT):
+        self.frontier = frontier
+        self.writer = writer
+        self.base_url = base_url
+        self.max_levels = max_levels
+        self.details = details
+        self.incremental = incremental
+        self.listing_prefix = listing_prefix
+        self.lease_timeout = lease_timeout
+        self.stages = [PARTITION, PAGES, LISTINGS] if details else [PARTITION, PAGES]
+        # (stage, url) -> (level, deadline, owner)
+        self.leases = {}
+        self.owners = itertools.count()
+        self.connected = set()
+        self.price_samples = []
+        self.caught_up = False
+        self.finished = None
+        self.server = None
+
+    def start(self, resume=False):
+        seed_partition(self.frontier, self.writer, self.base_url, resume, self.incremental)
+        for stage in self.stages[1:]:
+            if resume and self.frontier.has(stage):
+                self.frontier.resume(stage)
+            else:
+                self.frontier.clear(stage)
+        self.price_samples = get_price_samples(self.base_url)
+
+    def lease(self, owner, size):
+        """Return the next batch of urls for a worker, {"wait": seconds} or {"done": true}."""
+        for stage in self.stages:
+            leased = self.frontier.lease(stage, size, self.max_levels if stage == PARTITION else None)
+            if leased:
+                deadline = time.monotonic() + self.lease_timeout
+                for url, level in leased:
+                    self.leases[stage, url] = (level, deadline, owner)
+                return {'stage': stage, 'urls': [url for url, _ in leased]}
+        if self.leases:
+            return {'wait': IDLE_WAIT}
+        if not self.caught_up:
+            # Urls left unprobed at max_levels are crawled directly, like the
+            # leftovers of crawl_pipeline.
+            self.caught_up = True
+            self.frontier.add(PAGES, get_paginated_urls(self.base_url))
+            return self.lease(owner, size)
+        if not self.finished.is_set():
+            finish_partition(self.frontier, self.writer, self.base_url, self.incremental)
+            LOGGER.info('Distributed crawl finished! {}'.format(
+                {stage: self.frontier.counts(stage) for stage in self.stages}))
+            self.finished.set()
+        return {'done': True}
+
+    def complete(self, stage, results):
+        """Store the results of leased urls; results of expired leases are dropped."""
+        today = date.today().strftime('%Y/%m/%d')
+        statements = []
+        for result in results:
+            url = result['url']
+            lease = self.leases.pop((stage, url), None)
+            if lease is None:
+                continue
+            if not result['ok']:
+                if self.frontier.fail(stage, url) and stage == PARTITION:
+                    # Out of attempts: keep the url so its pages are still crawled directly.
+                    row = tuple(result['data'])
+                    statements.append((INSERT_URL_SQL, row))
+                    statements.extend(self.frontier.add_statement(PAGES, page) for page in page_urls(*row))
+                continue
+            if stage == PARTITION:
+                row = tuple(result['data'])
+                probed, leaf = probe_statements(
+                    self.frontier, self.base_url, url, row, lease[0], self.price_samples)
+                statements.extend(probed)
+                if leaf:
+                    statements.extend(self.frontier.add_statement(PAGES, page) for page in page_urls(*row))
+            elif stage == PAGES:
+                info, rows = result['data']['info'], result['data']['rows']
+                statements.extend(parsed_page_statements(url, info, [tuple(row) for row in rows],
+                                                         redfin_crawler.BLOB_ENCODING))
+                statements.append(self.frontier.done_statement(PAGES, url))
+                if self.details:
+                    statements.extend(self.frontier.add_statement(LISTINGS, self.listing_prefix + row[0])
+                                      for row in rows)
+            else:
+                statements.append((INSERT_FULL_DETAILS_SQL, (url, today) + tuple(result['data'])))
+                statements.append(self.frontier.done_statement(LISTINGS, url))
+        self.writer.write_all(statements)
+        # The next lease reads the new urls back from the frontier.
+        self.writer.flush()
+
+    def release(self, owner=None):
+        """Fail the leases of `owner`, or every expired lease, back to pending."""
+        now = time.monotonic()
+        expired = [key for key, (_, deadline, lease_owner) in self.leases.items()
+                   if lease_owner == owner or (owner is None and deadline < now)]
+        for stage, url in expired:
+            del self.leases[stage, url]
+            self.frontier.fail(stage, url)
+        if expired:
+            LOGGER.info('{} leased urls went back to the frontier'.format(len(expired)))
+            self.writer.flush()
+
+    async def handle(self, reader, stream):
+        owner = next(self.owners)
+        self.connected.add(owner)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = json.loads(line)
+                if request['op'] == 'lease':
+                    reply = self.lease(owner, request.get('size', DEFAULT_LEASE_SIZE))
+                elif request['op'] == 'complete':
+                    self.complete(request['stage'], request['results'])
+                    reply = {'ok': True}
+                else:
+                    reply = {'error': 'unknown op {}'.format(request['op'])}
+                stream.write((json.dumps(reply) + '\n').encode())
+                await stream.drain()
+        except ConnectionError:
+            LOGGER.info('worker {} disconnected'.format(owner))
+        finally:
+            self.connected.discard(owner)
+            self.release(owner)
+            stream.close()
+
+    async def listen(self, host='127.0.0.1', port=DEFAULT_PORT, resume=False):
+        """Seed the frontier and accept workers; return the (host, port) listened on."""
+        self.start(resume)
+        self.finished = asyncio.Event()
+        self.server = await asyncio.start_server(self.handle, host, port, limit=MAX_MESSAGE)
+        address = self.server.sockets[0].getsockname()[:2]
+        LOGGER.info('coordinator listening on {}:{}'.format(*address))
+        return address
+
+    async def wait(self):
+        """Expire stale leases until the crawl is done, then stop listening.
+
+        Workers still connected get DRAIN_TIMEOUT seconds to hear that the
+        crawl is done and hang up.
+        """
+        try:
+            while not self.finished.is_set():
+                try:
+                    await asyncio.wait_for(self.finished.wait(), timeout=min(self.lease_timeout, 10))
+                except asyncio.TimeoutError:
+                    self.release()
+            deadline = time.monotonic() + DRAIN_TIMEOUT
+            while self.connected and time.monotonic() < deadline:
+                await asyncio.sleep(IDLE_WAIT / 10)
+        finally:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+def fetch_result(stage, url, resp):
+    """Parse a fetched url of `stage` into the result sent back to the coordinator."""
+    if stage == PARTITION:
+        return {'url': url, 'ok': fetched(resp), 'data': get_page_info(url, resp)}
+    if not fetched(resp):
+        return {'url': url, 'ok': False}
+    if stage == PAGES:
+        url, info = scrape_page(url, resp)
+        return {'url': url, 'ok': True, 'data': {'info': info, 'rows': parse_listing_page(info)}}
+    url, info = scrape_redfin_listing(url, resp)
+    return {'url': url, 'ok': True, 'data': info}
+
+
+async def run_worker(fetcher, host, port=DEFAULT_PORT, lease_size=DEFAULT_LEASE_SIZE, slots=None):
+    """Lease urls from the coordinator, fetch and parse them and send back the results.
+
+    `slots` leases (enough to keep the fetcher busy by default) are worked
+    on at once over one connection. Return the number of urls worked on
+    once the coordinator reports the crawl done.
+    """
+    slots = slots or max(1, 2 * fetcher.concurrency // lease_size)
+    reader, stream = await asyncio.open_connection(host, port, limit=MAX_MESSAGE)
+    lock = asyncio.Lock()
+    worked = 0
+    done = False
+
+    async def call(request):
+        async with lock:
+            if done:
+                # The coordinator stops listening once it has said so.
+                return {'done': True}
+            stream.write((json.dumps(request) + '\n').encode())
+            await stream.drain()
+            line = await reader.readline()
+        if not line:
+            raise ConnectionError('coordinator closed the connection')
+        return json.loads(line)
+
+    async def work():
+        nonlocal worked, done
+        while True:
+            reply = await call({'op': 'lease', 'size': lease_size})
+            if reply.get('done'):
+                done = True
+                return
+            if not reply.get('urls'):
+                await asyncio.sleep(reply.get('wait', IDLE_WAIT))
+                continue
+            stage = reply['stage']
+            results = [fetch_result(stage, url, resp) async for url, resp in fetcher.stream(reply['urls'])]
+            await call({'op': 'complete', 'stage': stage, 'results': results})
+            worked += len(results)
+
+    try:
+        await asyncio.gather(*(work() for _ in range(slots)))
+    finally:
+        stream.close()
+    return worked
+
+
+async def coordinate(args):
+    create_tables_if_not_exist()
+    redfin_crawler.BLOB_ENCODING = None if args.blob_encoding == 'json' else args.blob_encoding
+    writer = SQLiteWriter(redfin_crawler.SQLITE_DB_FULL_PATH, batch_size=args.batch_size)
+    frontier = Frontier(redfin_crawler.SQLITE_DB_FULL_PATH, writer)
+    coordinator = Coordinator(frontier, writer, normalize_base_url(args.redfin_base_url),
+                              max_levels=args.partition_levels, details=args.details,
+                              incremental=args.incremental, lease_timeout=args.lease_timeout)
+    try:
+        await coordinator.listen(args.host, args.port, resume=args.resume)
+        await coordinator.wait()
+    finally:
+        frontier.close()
+        writer.close()
+
+
+async def work(args):
+    proxies = None
+    if args.proxy_csv:
+        proxies = [construct_proxy(*p)['http'] for p in pd.read_csv(args.proxy_csv, encoding='utf-8').values]
+    scheduler = RateScheduler(proxies, proxy_rate=args.proxy_rate, jitter=args.jitter, manager=ProxyManager())
+    cache = ResponseCache(args.cache_dir) if args.cache_dir else None
+    async with Fetcher(scheduler, concurrency=args.concurrency, headers=HEADER,
+                       pool_size=args.pool_size, max_pools=args.max_pools, cache=cache) as fetcher:
+        worked = await run_worker(fetcher, args.host, args.port, lease_size=args.lease_size)
+    LOGGER.info('worker done after {} urls'.format(worked))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Crawl Redfin with one coordinator and any number of worker processes.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address the coordinator listens on, or workers connect to.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--logging_level', default='info', choices=['info', 'debug'])
+    roles = parser.add_subparsers(dest='role')
+    roles.required = True
+
+    coordinator_parser = roles.add_parser('coordinator', help='plan partitions and hand out urls.')
+    coordinator_parser.add_argument('redfin_base_url',
+                                    help='e.g., https://www.redfin.com/city/11203/CA/Los-Angeles/')
+    coordinator_parser.add_argument('--partition_levels', type=int, default=12)
+    coordinator_parser.add_argument('--details', action='store_true',
+                                    help='also scrape the listing page of every home.')
+    coordinator_parser.add_argument('--lease_timeout', type=float, default=DEFAULT_LEASE_TIMEOUT,
+                                    help='seconds before the urls of a silent worker are handed out again.')
+    coordinator_parser.add_argument('--batch_size', type=int, default=500)
+    coordinator_parser.add_argument('--resume', action='store_true')
+    coordinator_parser.add_argument('--incremental', action='store_true')
+    coordinator_parser.add_argument('--blob_encoding', default='json', choices=('json',) + ENCODINGS,
+                                    help='how search page json is stored, see redfin_crawler.py --blob_encoding.')
+
+    worker_parser = roles.add_parser('worker', help='fetch and parse urls leased from the coordinator.')
+    worker_parser.add_argument('--proxy_csv', default='')
+    worker_parser.add_argument('--lease_size', type=int, default=DEFAULT_LEASE_SIZE)
+    worker_parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    worker_parser.add_argument('--pool_size', type=int, default=DEFAULT_POOL_SIZE)
+    worker_parser.add_argument('--max_pools', type=int, default=DEFAULT_MAX_POOLS)
+    worker_parser.add_argument('--proxy_rate', type=float, default=DEFAULT_PROXY_RATE)
+    worker_parser.add_argument('--jitter', type=float, default=DEFAULT_JITTER)
+    worker_parser.add_argument('--cache_dir', default='',
+                               help='keep responses in this directory, see redfin_crawler.py --cache_dir.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.logging_level == 'debug' else logging.INFO)
+    # The crawler functions log through redfin_crawler.LOGGER, set by its own __main__.
+    redfin_crawler.LOGGER = logging.getLogger('redfin_crawler')
+    asyncio.run(coordinate(args) if args.role == 'coordinator' else work(args))
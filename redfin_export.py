@@ -0,0 +1,169 @@
+import argparse
+import logging
+import os
+from datetime import date
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+from redfin_storage import connect
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+load_dotenv()
+
+LOGGER = logging.getLogger(__name__)
+
+SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH')
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+SQLITE_DB_FULL_PATH = f'{DIR_PATH}/{SQLITE_DB_PATH}'
+
+FULL_DETAILS = 'listing_full_details'
+SHORT_DETAILS = 'listing_short_details'
+
+# Column types of the exported snapshots. sqlite does not enforce its
+# column types, so every value is coerced on export; one that does not fit
+# is exported as null.
+COLUMNS = {
+    FULL_DETAILS: [
+        ('URL', 'string'), ('STATUS', 'string'), ('PRICE', 'int64'), ('NUMBER_ROOMS', 'int64'),
+        ('NUMBER_BATHROOMS', 'float64'), ('SQFT', 'int64'), ('TIME_ON_REDFIN', 'int64'), ('YEAR', 'int64'),
+        ('LOT_SIZE', 'float64'), ('REDFIN_PRICE', 'int64'), ('SQFT_PRICE', 'int64'), ('MORTGAGE', 'int64')],
+    SHORT_DETAILS: [
+        ('URL', 'string'), ('NUMBER_OF_ROOMS', 'int64'), ('NAME', 'string'), ('COUNTRY', 'string'),
+        ('REGION', 'string'), ('LOCALITY', 'string'), ('STREET', 'string'), ('POSTAL', 'string'),
+        ('TYPE', 'string'), ('PRICE', 'float64')],
+}
+# The files are partitioned as <table>/city=<state>-<city>/date=<yyyy-mm-dd>/.
+PARTITION_COLUMNS = [('city', 'string'), ('date', 'string')]
+UNKNOWN_CITY = 'unknown'
+COMPRESSION = 'zstd'
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('the parquet export needs pyarrow: pip install pyarrow')
+
+
+def listing_city(url):
+    """Return the city partition of a listing url, e.g. CA-Belmont for /CA/Belmont/<address>/home/<id>."""
+    parts = [part for part in urlsplit(url).path.split('/') if part]
+    if len(parts) >= 4 and parts[-2] == 'home':
+        return '{}-{}'.format(parts[0], parts[1])
+    return UNKNOWN_CITY
+
+
+def _coerce(value, kind):
+    if value is None:
+        return None
+    if kind == 'string':
+        return str(value)
+    try:
+        return int(float(value)) if kind == 'int64' else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _schema(table):
+    return pa.schema([(name, getattr(pa, kind)()) for name, kind in COLUMNS[table]])
+
+
+def _partitioning():
+    return ds.partitioning(pa.schema([(name, getattr(pa, kind)()) for name, kind in PARTITION_COLUMNS]),
+                           flavor='hive')
+
+
+def _write(out_dir, table, day, rows):
+    """Write the rows of one day's snapshot of `table`, one file per city; return the file count."""
+    by_city = {}
+    for row in rows:
+        by_city.setdefault(listing_city(row[0]), []).append(row)
+    schema = _schema(table)
+    kinds = [kind for _, kind in COLUMNS[table]]
+    for city, city_rows in by_city.items():
+        columns = [[_coerce(value, kind) for value in values] for values, kind in zip(zip(*city_rows), kinds)]
+        path = os.path.join(out_dir, table, 'city={}'.format(city), 'date={}'.format(day.replace('/', '-')),
+                            'part-0.parquet')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside and renamed, so a reader never sees half a file.
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        pq.write_table(pa.Table.from_arrays(columns, schema=schema), tmp_path, compression=COMPRESSION)
+        os.replace(tmp_path, path)
+    return len(by_city)
+
+
+def export_day(db_path, out_dir, day, short_details=True):
+    """Export the LISTING_FULL_DETAILS rows of `day` (yyyy/mm/dd) and, with short_details, the current short details.
+
+    LISTING_SHORT_DETAILS keeps no history, so it is exported as a snapshot
+    under `day`. Exporting a day again replaces its files.
+    """
+    _require_pyarrow()
+    db = connect(db_path, readonly=True)
+    try:
+        full = db.execute('SELECT {} FROM LISTING_FULL_DETAILS WHERE DATE = ?'.format(
+            ', '.join(name for name, _ in COLUMNS[FULL_DETAILS])), (day,)).fetchall()
+        short = []
+        if short_details:
+            short = db.execute('SELECT {} FROM LISTING_SHORT_DETAILS'.format(
+                ', '.join(name for name, _ in COLUMNS[SHORT_DETAILS]))).fetchall()
+    finally:
+        db.close()
+    files = _write(out_dir, FULL_DETAILS, day, full) + _write(out_dir, SHORT_DETAILS, day, short)
+    LOGGER.info('exported {} full and {} short details of {} into {} files'.format(
+        len(full), len(short), day, files))
+
+
+def export_dates(db_path):
+    """Return every DATE in LISTING_FULL_DETAILS, for a backfill."""
+    db = connect(db_path, readonly=True)
+    try:
+        return [row[0] for row in db.execute('SELECT DISTINCT DATE FROM LISTING_FULL_DETAILS ORDER BY DATE')]
+    finally:
+        db.close()
+
+
+def load(out_dir, table=FULL_DETAILS, cities=None, start=None, end=None, columns=None):
+    """Load exported snapshots of `table` as an Arrow table, with city and date columns.
+
+    Only the partitions of `cities` and of the dates from `start` to `end`
+    (yyyy-mm-dd, inclusive) are read, and only `columns`. Files are memory
+    mapped rather than read into buffers; call .to_pandas(split_blocks=True,
+    self_destruct=True) on the result to get a frame without holding both
+    copies.
+    """
+    _require_pyarrow()
+    dataset = ds.dataset(os.path.join(out_dir, table), format='parquet', partitioning=_partitioning(),
+                         filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+    condition = None
+    for clause in [ds.field('city').isin(cities) if cities else None,
+                   ds.field('date') >= start if start else None,
+                   ds.field('date') <= end if end else None]:
+        if clause is not None:
+            condition = clause if condition is None else condition & clause
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export daily snapshots of the listing tables to Parquet files partitioned by city and date.')
+    parser.add_argument('out_dir', help='directory of the exported files.')
+    parser.add_argument('--date', default=date.today().strftime('%Y/%m/%d'),
+                        help='day to export, as yyyy/mm/dd. Defaults to today.')
+    parser.add_argument('--all_dates', action='store_true',
+                        help='also export every earlier day in LISTING_FULL_DETAILS, e.g. the first time.')
+    parser.add_argument('--logging_level', default='info', choices=['info', 'debug'])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.logging_level == 'debug' else logging.INFO)
+    if args.all_dates:
+        for day in export_dates(SQLITE_DB_FULL_PATH):
+            if day != args.date:
+                export_day(SQLITE_DB_FULL_PATH, args.out_dir, day, short_details=False)
+    export_day(SQLITE_DB_FULL_PATH, args.out_dir, args.date)
@@ -0,0 +1,154 @@
+import html
+import re
+from collections import namedtuple
+
+# Anchored scanners for the few elements the crawler reads off search result
+# and listing pages. They find their targets with precompiled patterns
+# instead of building a full BeautifulSoup tree, which is most of the parse
+# CPU per page.
+
+LD_JSON_RE = re.compile(
+    r'<script\b[^>]*?\btype\s*=\s*["\']application/ld\+json["\'][^>]*>(.*?)</script\s*>',
+    re.S | re.I)
+HOMES_SUMMARY_RE = re.compile(
+    r'<div\b[^>]*?\bclass\s*=\s*["\']homes summary["\'][^>]*>', re.I)
+DIV_TAG_RE = re.compile(r'<(/?)div\b[^>]*>', re.I)
+GO_TO_PAGE_RE = re.compile(
+    r'<a\b[^>]*?\bclass\s*=\s*["\'](?:[^"\']*\s)?goToPage(?:\s[^"\']*)?["\'][^>]*>(.*?)</a\s*>',
+    re.S | re.I)
+TAG_RE = re.compile(r'<!--.*?-->|<[^>]*>', re.S)
+
+
+def text_of(fragment):
+    """Text content of an html fragment, like BeautifulSoup's get_text()."""
+    return html.unescape(TAG_RE.sub('', fragment))
+
+
+def ld_json_scripts(page):
+    """Return the bodies of the application/ld+json script tags, in page order."""
+    return LD_JSON_RE.findall(page)
+
+
+def div_end(page, start):
+    """End of the content of the div whose opening tag ends at `start`, nested divs included."""
+    depth = 1
+    for tag in DIV_TAG_RE.finditer(page, start):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return tag.start()
+    return len(page)
+
+
+def div_text(page, start):
+    """Text of the div whose opening tag ends at `start`, nested divs included."""
+    return text_of(page[start:div_end(page, start)])
+
+
+def homes_summary(page):
+    """Return the text of the 'homes summary' div, or None if the page has none."""
+    m = HOMES_SUMMARY_RE.search(page)
+    if not m:
+        return None
+    return div_text(page, m.end())
+
+
+def go_to_pages(page):
+    """Return the texts of the goToPage pagination links."""
+    return [text_of(x) for x in GO_TO_PAGE_RE.findall(page)]
+
+
+def _number(text):
+    return int(text.replace(',', ''))
+
+
+def _lot_size(text):
+    lot = float(text.replace(',', ''))
+    # if lot size in acres, convert to sqft
+    if lot < 100:
+        lot *= 43560
+    return lot
+
+
+# A field is read from the text of the divs matching `selector`, an
+# (attribute, value) pair, when `pattern` matches that text. With a
+# `container` selector, only the divs inside the first div matching it
+# count.
+FieldSpec = namedtuple('FieldSpec', ['name', 'selector', 'pattern', 'converter', 'default', 'container'],
+                       defaults=(None,))
+
+MAIN_STATS = ('class', 'home-main-stats-variant')
+PAGE_CONTENT = ('class', 'content clear-fix')
+
+LISTING_FIELDS = [
+    FieldSpec('status', ('class', 'keyDetail'), re.compile(r'Status([a-zA-Z]+)*'), str, None, PAGE_CONTENT),
+    FieldSpec('price', ('data-rf-test-id', 'abp-price'), re.compile(r'\$([0-9,]+)*'), _number, 0, MAIN_STATS),
+    FieldSpec('beds', ('data-rf-test-id', 'abp-beds'), re.compile(r'([0-9]+)Beds*'), int, 0, MAIN_STATS),
+    FieldSpec('baths', ('data-rf-test-id', 'abp-baths'), re.compile(r'([0-9.]+)Baths*'), float, 0, MAIN_STATS),
+    FieldSpec('sqft', ('data-rf-test-id', 'abp-sqFt'), re.compile(r'([0-9,]+)Sq Ft*'), _number, 0, MAIN_STATS),
+    FieldSpec('time_on_redfin', ('class', 'keyDetail'), re.compile(r'Time on Redfin([0-9]+)*'), int, 0,
+              PAGE_CONTENT),
+    FieldSpec('year', ('class', 'keyDetail'), re.compile(r'Year Built([0-9]+)*'), int, 0, PAGE_CONTENT),
+    FieldSpec('lot_size', ('class', 'keyDetail'), re.compile(r'Lot Size([0-9,]+)*'), _lot_size, 0, PAGE_CONTENT),
+    FieldSpec('redfin_price', ('class', 'keyDetail'), re.compile(r'Redfin Estimate\$([0-9,]+)*'), _number, 0,
+              PAGE_CONTENT),
+    FieldSpec('sqft_price', ('class', 'keyDetail'), re.compile(r'Price/Sq\.Ft\.\$([0-9,]+)*'), _number, 0,
+              PAGE_CONTENT),
+    FieldSpec('mortgage', ('class', 'CalculatorSummary'), re.compile(r'\$([0-9,]+)* per month'), _number, 0),
+]
+
+
+def _div_re(selectors):
+    """Pattern of the opening tag of a div matching any of `selectors`; group s<i> tells which one."""
+    alternatives = []
+    for attr, value in selectors:
+        if attr == 'class':
+            value_re = r'(?:[^"\']*\s)?{}(?:\s[^"\']*)?'.format(re.escape(value))
+        else:
+            value_re = re.escape(value)
+        alternatives.append(r'(?P<s{}>\b{}\s*=\s*["\']{}["\'])'.format(
+            len(alternatives), re.escape(attr), value_re))
+    return re.compile(r'<div\b[^>]*?(?:{})[^>]*>'.format('|'.join(alternatives)), re.I)
+
+
+class FieldExtractor:
+    """Apply a list of FieldSpecs to a page in one pass per container.
+
+    A single pattern finds the opening tags of every selector the specs of
+    a container use; each matched div's text is then tried against the
+    specs of its selector. Class selectors match any one of the div's
+    classes, like BeautifulSoup. A field takes the first value found, as
+    BeautifulSoup's find() would.
+    """
+
+    def __init__(self, specs):
+        self.specs = list(specs)
+        by_container = {}
+        for spec in self.specs:
+            by_container.setdefault(spec.container, {}).setdefault(spec.selector, []).append(spec)
+        # (container pattern or None for the whole page, selectors, selector -> specs, tag pattern)
+        self.scopes = [(container and _div_re([container]), list(by_selector), by_selector, _div_re(by_selector))
+                       for container, by_selector in by_container.items()]
+
+    def __call__(self, page):
+        values = {spec.name: spec.default for spec in self.specs}
+        found = set()
+        for container_re, selectors, by_selector, tag_re in self.scopes:
+            start, end = 0, len(page)
+            if container_re is not None:
+                container = container_re.search(page)
+                if not container:
+                    continue
+                start, end = container.end(), div_end(page, container.end())
+            for tag in tag_re.finditer(page, start, end):
+                text = div_text(page, tag.end())
+                for spec in by_selector[selectors[int(tag.lastgroup[1:])]]:
+                    if spec.name in found:
+                        continue
+                    m = spec.pattern.match(text)
+                    if m and m.group(1) is not None:
+                        values[spec.name] = spec.converter(m.group(1))
+                        found.add(spec.name)
+        return values
+
+
+extract_listing = FieldExtractor(LISTING_FIELDS)
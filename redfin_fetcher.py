@@ -0,0 +1,270 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import namedtuple, OrderedDict
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from redfin_scheduler import RateScheduler, FairGate
+
+LOGGER = logging.getLogger(__name__)
+
+# Maximum number of requests in flight at once on the event loop.
+DEFAULT_CONCURRENCY = 200
+# Seconds before a single request is abandoned.
+DEFAULT_TIMEOUT = 60
+# Keep-alive connections held open per proxy.
+DEFAULT_POOL_SIZE = 10
+# Upper bound on proxies with an open pool; the least recently used idle pool is evicted.
+DEFAULT_MAX_POOLS = 500
+# Seconds an unused pool (and its idle connections) is kept before being closed.
+DEFAULT_POOL_IDLE_TIMEOUT = 120
+# Attempts per url; every retry goes through a different proxy.
+DEFAULT_MAX_ATTEMPTS = 3
+
+FetchResponse = namedtuple('FetchResponse', ['url', 'status', 'text', 'proxy', 'headers'], defaults=(None,))
+
+
+class _Pool:
+    def __init__(self, session):
+        self.session = session
+        self.active = 0
+        self.last_used = time.monotonic()
+
+
+class ConnectionPoolManager:
+    """Keep one long-lived keep-alive connection pool per proxy.
+
+    Reusing the pool skips the TCP and TLS handshake through the proxy on
+    every request. Pools are capped in size, closed after idle_timeout
+    seconds without use, and evicted least recently used first once more
+    than max_pools proxies are open. Pools with requests in flight are
+    never evicted.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, max_pools=DEFAULT_MAX_POOLS,
+                 idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT, headers=None, timeout=None):
+        self.pool_size = pool_size
+        self.max_pools = max_pools
+        self.idle_timeout = idle_timeout
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.pools = OrderedDict()
+
+    def _new_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size, keepalive_timeout=self.idle_timeout)
+        return aiohttp.ClientSession(
+            connector=connector, headers=self.headers, timeout=self.timeout)
+
+    async def _evict(self):
+        now = time.monotonic()
+        idle = [key for key, pool in self.pools.items()
+                if not pool.active and now - pool.last_used > self.idle_timeout]
+        # Pools are kept in least recently used order.
+        overflow = len(self.pools) - len(idle) - self.max_pools
+        for key, pool in self.pools.items():
+            if overflow <= 0:
+                break
+            if not pool.active and key not in idle:
+                idle.append(key)
+                overflow -= 1
+        for key in idle:
+            pool = self.pools.pop(key)
+            LOGGER.debug('closing connection pool for proxy {}'.format(key))
+            await pool.session.close()
+
+    @asynccontextmanager
+    async def session(self, proxy):
+        """Yield the pooled session for a proxy url (None for direct connections)."""
+        pool = self.pools.get(proxy)
+        created = pool is None
+        if created:
+            # Registered before the eviction awaits, so a concurrent first
+            # request through the same proxy shares the pool.
+            pool = self.pools[proxy] = _Pool(self._new_session())
+        self.pools.move_to_end(proxy)
+        pool.active += 1
+        try:
+            if created:
+                await self._evict()
+            yield pool.session
+        finally:
+            pool.active -= 1
+            pool.last_used = time.monotonic()
+
+    async def close(self):
+        pools, self.pools = self.pools, OrderedDict()
+        for pool in pools.values():
+            await pool.session.close()
+
+
+class Fetcher:
+    """Shared asyncio fetch layer used by every crawl stage.
+
+    One event loop drives all network I/O; the fair gate caps the number of
+    requests in flight so the concurrency is tunable independently of cores.
+    The scheduler decides which proxy each request goes through and when;
+    its ProxyManager is told how every request went, and failed or banned
+    requests are retried on a different proxy.
+
+    Requests can be tagged with a lane (see lane()); lanes take turns at
+    the fair gate, so several crawls sharing the fetcher get an even share
+    of the proxies.
+
+    With a ResponseCache (see redfin_cache.py), cached responses are served
+    without a request and successful ones are cached.
+    """
+
+    def __init__(self, scheduler=None, concurrency=DEFAULT_CONCURRENCY, headers=None,
+                 timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE, max_pools=DEFAULT_MAX_POOLS,
+                 pool_idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 cache=None):
+        self.cache = cache
+        self.scheduler = scheduler or RateScheduler()
+        self.proxies = self.scheduler.manager
+        self.max_attempts = max_attempts
+        self.concurrency = concurrency
+        self.gate = FairGate(concurrency)
+        self.pools = ConnectionPoolManager(
+            pool_size=pool_size, max_pools=max_pools, idle_timeout=pool_idle_timeout,
+            headers=headers, timeout=aiohttp.ClientTimeout(total=timeout))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        LOGGER.info(self.proxies.summary())
+        if self.cache:
+            LOGGER.info(self.cache.summary())
+        await self.pools.close()
+
+    async def _get(self, url, proxy, headers=None):
+        async with self.pools.session(proxy) as session:
+            start = time.monotonic()
+            async with session.get(url, proxy=proxy, headers=headers) as resp:
+                text = await resp.text(errors='replace')
+                return FetchResponse(url, resp.status, text, proxy, resp.headers), time.monotonic() - start
+
+    def lane(self, name):
+        """Return a view of this fetcher whose requests queue in their own lane."""
+        return FetcherLane(self, name)
+
+    async def fetch(self, url, lane=None, headers=None):
+        """Fetch a url, retrying on another proxy after an error or ban.
+
+        `headers` are sent on top of the session headers, e.g. for a
+        conditional request. Return the last response if every attempt was
+        banned; raise the last error if no attempt got a response at all.
+        """
+        if self.cache:
+            resp = self.cache.get(url)
+            if resp is not None:
+                return resp
+        await self.gate.acquire(lane)
+        try:
+            resp, ok = await self._fetch(url, headers)
+        finally:
+            self.gate.release()
+        # A ban (a captcha page can come with a 200) is never cached.
+        if self.cache and ok:
+            self.cache.put(resp)
+        return resp
+
+    async def _fetch(self, url, headers=None):
+        """Return (response, whether the ProxyManager accepted it)."""
+        tried, resp, error = set(), None, None
+        for _ in range(self.max_attempts):
+            # The request waits for a rate token while holding its gate slot:
+            # lanes take turns at the gate, so that is what shares the
+            # proxies' tokens evenly between them.
+            proxy = await self.scheduler.acquire(url, exclude=tried)
+            tried.add(proxy)
+            try:
+                resp, latency = await self._get(url, proxy, headers)
+            except Exception as e:
+                LOGGER.debug('failed for url {}, proxy {}: {!r}'.format(url, proxy, e))
+                self.proxies.record_error(proxy)
+                error = e
+                continue
+            if self.proxies.record_response(proxy, latency, resp.status, resp.text):
+                return resp, True
+            LOGGER.debug('proxy {} rejected for url {} with status {}'.format(proxy, url, resp.status))
+        if resp is None:
+            raise error
+        return resp, False
+
+    async def _fetch_or_none(self, url, lane=None, headers=None):
+        try:
+            return url, await self.fetch(url, lane, headers.get(url) if headers else None)
+        except Exception as e:
+            LOGGER.warning('failed for url {}: {!r}'.format(url, e))
+            return url, None
+
+    async def stream(self, urls, window=None, lane=None, headers=None):
+        """Fetch urls and yield (url, response) pairs in completion order.
+
+        The response is None when the request itself failed. At most `window`
+        requests (twice the concurrency by default) are scheduled at a time,
+        so memory stays bounded however many urls there are. `urls` may also
+        be an async iterator, such as the output of an earlier stage; it is
+        pulled from as the window has room. `headers` optionally maps urls
+        to extra request headers.
+        """
+        window = window or 2 * self.concurrency
+        if hasattr(urls, '__anext__'):
+            async for result in self._stream_async(urls, window, lane, headers):
+                yield result
+            return
+        urls = iter(urls)
+        pending = {asyncio.ensure_future(self._fetch_or_none(url, lane, headers))
+                   for url in itertools.islice(urls, window)}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for url in itertools.islice(urls, len(done)):
+                    pending.add(asyncio.ensure_future(self._fetch_or_none(url, lane, headers)))
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _stream_async(self, urls, window, lane, headers):
+        pending, next_url = set(), None
+        try:
+            while True:
+                if next_url is None and urls is not None and len(pending) < window:
+                    next_url = asyncio.ensure_future(urls.__anext__())
+                waiting = pending | {next_url} if next_url else pending
+                if not waiting:
+                    return
+                done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if next_url in done:
+                    try:
+                        pending.add(asyncio.ensure_future(self._fetch_or_none(next_url.result(), lane, headers)))
+                    except StopAsyncIteration:
+                        urls = None
+                    next_url = None
+                for task in done & pending:
+                    pending.remove(task)
+                    yield task.result()
+        finally:
+            for task in pending | ({next_url} if next_url else set()):
+                task.cancel()
+
+
+class FetcherLane:
+    """A Fetcher whose requests all go through one lane of its fair gate."""
+
+    def __init__(self, fetcher, name):
+        self.fetcher = fetcher
+        self.name = name
+
+    async def fetch(self, url, headers=None):
+        return await self.fetcher.fetch(url, self.name, headers)
+
+    def stream(self, urls, window=None, headers=None):
+        return self.fetcher.stream(urls, window, self.name, headers)
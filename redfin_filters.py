@@ -1,3 +1,5 @@
+import bisect
+import math
 import re
 import logging
 
@@ -19,6 +21,12 @@ MAX_YEAR_PATTERN = r'.*max-year-built=([0-9a-zA-Z]+).*'
 MIN_YEAR = 1970
 MAX_YEAR = 2021
 
+# Share of the pagination cap a planned child range is sized for, leaving
+# room for an uneven spread of homes inside the range.
+FILL_FACTOR = 0.8
+# Most child ranges a single range is planned into.
+MAX_SPLITS = 20
+
 # PROPERY_TYPE_PATTERN = r'.*property-type=([a-zA-Z]+).*'
 SOLD_PATTERN = r'.*include=sold-([0-9a-zA-Z]+).*'
 
@@ -97,7 +105,35 @@ def construct_filter_url(redfin_base_url, **kwargs):
     return f'{redfin_base_url}filter/{",".join(filters)}'
 
 
-def add_sqft_filters(min_sqft, max_sqft):
+def split_count(count, cap):
+    """Number of child ranges needed so each is expected to stay under the cap."""
+    return max(2, min(MAX_SPLITS, math.ceil(count / (cap * FILL_FACTOR))))
+
+
+def plan_splits(lo, hi, splits, ticker, samples=None):
+    """Cut [lo, hi] into about `splits` ranges on multiples of `ticker`.
+
+    With `samples` (sorted values seen before, e.g. listing prices) the cuts
+    are their quantiles inside the range, so every child gets a similar
+    share of homes; otherwise the range is cut evenly.
+    """
+    inner = []
+    if samples:
+        inner = samples[bisect.bisect_left(samples, lo):bisect.bisect_left(samples, hi)]
+    if len(inner) >= splits:
+        cuts = [inner[len(inner) * k // splits] for k in range(1, splits)]
+    else:
+        cuts = [lo + (hi - lo) * k / splits for k in range(1, splits)]
+    tickers = [lo]
+    for cut in cuts:
+        cut = int(round(cut / ticker) * ticker)
+        if tickers[-1] < cut < hi:
+            tickers.append(cut)
+    tickers.append(hi)
+    return list(zip(tickers[:-1], tickers[1:]))
+
+
+def add_sqft_filters(min_sqft, max_sqft, splits=None):
     sqft_range = max_sqft - min_sqft
     if sqft_range == 0:
         return [(min_sqft, max_sqft)]
@@ -105,6 +141,8 @@ def add_sqft_filters(min_sqft, max_sqft):
     # 1000 is the break point. Above 1000, the min ticker becomes 10.
     if min_sqft < 1000 and max_sqft > 1000:
         sqft_filters.extend([(min_sqft, 1000), (1000, max_sqft)])
+    elif splits:
+        sqft_filters = plan_splits(min_sqft, max_sqft, splits, 10 if min_sqft >= 1000 else 1)
     else:
         min_ticker = 10 if min_sqft >= 1000 else 1
         sqft_ticker = sqft_range // 5
@@ -122,12 +160,15 @@ def add_sqft_filters(min_sqft, max_sqft):
     return sqft_filters
 
 
-def add_price_filters(min_price, max_price):
+def add_price_filters(min_price, max_price, splits=None, samples=None):
     if min_price == max_price:
         return [(min_price, max_price)]
     price_filters = []
     if min_price < 1000000 and max_price > 1000000:
         price_filters.extend([(min_price, 1000000), (1000000, max_price)])
+    elif splits:
+        price_filters = plan_splits(min_price, max_price, splits,
+                                    10000 if min_price >= 1000000 else 1000, samples)
     else:
         price_diff = max_price - min_price
         min_ticker = 10000 if min_price >= 1000000 else 1000
@@ -142,9 +183,11 @@ def add_price_filters(min_price, max_price):
     return price_filters
 
 
-def add_year_filters(min_year, max_year):
+def add_year_filters(min_year, max_year, splits=None):
     if min_year == max_year:
         return [(min_year, max_year)]
+    if splits:
+        return plan_splits(min_year, max_year, splits, 1)
 
     year_diff = max_year - min_year
     year_ticker = max(1, year_diff // 5)
@@ -158,12 +201,51 @@ def add_year_filters(min_year, max_year):
     return year_filters
 
 
-def apply_filters(url, redfin_base_url):
+def merge_adjacent_filters(siblings, redfin_base_url, limit):
+    """Merge runs of adjacent sibling ranges whose summed count stays within `limit`.
+
+    `siblings` are (url, count) pairs of urls that differ in one range
+    filter only, such as the children of one split. Return (merged url,
+    member urls, summed count) for every run of two or more ranges.
+    """
+    parsed = [(parse_filter_params(url.split('/filter/')[1]), url, count) for url, count in siblings]
+    for dimension in ('price', 'sqft', 'year'):
+        lo, hi = 'min_' + dimension, 'max_' + dimension
+        others = [{k: v for k, v in params.items() if k not in (lo, hi)} for params, _, _ in parsed]
+        if all(o == others[0] for o in others) and \
+                all(params[lo] is not None and params[hi] is not None for params, _, _ in parsed):
+            break
+    else:
+        return []
+
+    merged = []
+    run = []
+    for params, url, count in sorted(parsed, key=lambda x: x[0][lo]) + [(None, None, None)]:
+        if run and params is not None and params[lo] == run[-1][0][hi] and \
+                sum(c for _, _, c in run) + count <= limit:
+            run.append((params, url, count))
+            continue
+        if len(run) > 1:
+            merged_params = {k: v for k, v in run[0][0].items() if v is not None}
+            merged_params[hi] = run[-1][0][hi]
+            merged.append((construct_filter_url(redfin_base_url, **merged_params),
+                           [u for _, u, _ in run], sum(c for _, _, c in run)))
+        run = [(params, url, count)]
+    return merged
+
+
+def apply_filters(url, redfin_base_url, count=None, cap=None, price_samples=None):
     """Apply more filters to make it more fine-grained.
     Return a list of urls containing filters, which adds up
     to the original url.
     Filter priority: price, sqft-size, year-built
+
+    When the url's result `count` and the pagination `cap` are known, the
+    range is split into as many children as needed for each to fit under
+    the cap, with price cuts placed by `price_samples` (sorted prices), in
+    place of the fixed five-way split.
     """
+    splits = split_count(count, cap) if count and cap else None
     if '/filter/' not in url:
         price_filters = [(300000, 600000)]
         return [construct_filter_url(redfin_base_url, min_price=x[0], max_price=x[1]) for x in price_filters]
@@ -185,7 +267,7 @@ def apply_filters(url, redfin_base_url):
     sold_range = filter_params.get('sold_range')
 
     if min_year:
-        year_filters = add_year_filters(min_year, max_year)
+        year_filters = add_year_filters(min_year, max_year, splits)
         if len(year_filters) == 1:
             LOGGER.warning(
                 'Reaching the finest granularity. Cannot split any more.')
@@ -197,7 +279,7 @@ def apply_filters(url, redfin_base_url):
         return sub_urls
 
     if min_sqft:
-        sqft_filters = add_sqft_filters(min_sqft, max_sqft)
+        sqft_filters = add_sqft_filters(min_sqft, max_sqft, splits)
         if len(sqft_filters) == 1:
             return [construct_filter_url(redfin_base_url, **{**filter_params, **{'min_year': MIN_YEAR, 'max_year': MAX_YEAR}})]
         else:
@@ -210,7 +292,7 @@ def apply_filters(url, redfin_base_url):
             return sub_urls
 
     if min_price:
-        price_filters = add_price_filters(min_price, max_price)
+        price_filters = add_price_filters(min_price, max_price, splits, price_samples)
         if len(price_filters) == 1:
             return [construct_filter_url(redfin_base_url, **{**filter_params, **{'min_sqft': MIN_SQFT, 'max_sqft': 1000}}), construct_filter_url(redfin_base_url, **{**filter_params, **{'min_sqft': 1000, 'max_sqft': MAX_SQFT}})]
         else:
@@ -0,0 +1,164 @@
+import logging
+
+from redfin_storage import connect
+
+LOGGER = logging.getLogger(__name__)
+
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+
+# Crawl stages tracked in the frontier.
+PARTITION = 'partition'
+PAGES = 'pages'
+LISTINGS = 'listings'
+BULK = 'bulk'
+
+# Passes over a url before it is given up as failed.
+DEFAULT_MAX_ATTEMPTS = 3
+
+ADD_SQL = '''
+    INSERT OR IGNORE INTO FRONTIER (URL, STAGE, STATE, LEVEL, UPDATED_AT)
+    VALUES (?, ?, 'pending', ?, datetime('now'))'''
+START_SQL = '''
+    UPDATE FRONTIER SET STATE = 'in_flight', ATTEMPTS = ATTEMPTS + 1, UPDATED_AT = datetime('now')
+    WHERE STAGE = ? AND URL = ?'''
+DONE_SQL = '''
+    UPDATE FRONTIER SET STATE = 'done', UPDATED_AT = datetime('now')
+    WHERE STAGE = ? AND URL = ?'''
+
+
+class Frontier:
+    """Durable per-stage url frontier kept in the crawler's sqlite db.
+
+    Every url of a stage is a row with a state (pending, in_flight, done,
+    failed) and an attempt count, so an interrupted run can be resumed
+    without re-fetching finished work. Urls that were in flight when the
+    run died are put back to pending on resume.
+
+    Writes go through the shared SQLiteWriter; bulk updates (clear, add,
+    resume, start) wait for their commit so that reads see them.
+
+    Frontiers with different `scope`s (one per city in batch mode) share
+    the table without seeing each other's urls. The table is created by
+    the db migrations (see redfin_migrations.py).
+    """
+
+    def __init__(self, db_path, writer, max_attempts=DEFAULT_MAX_ATTEMPTS, scope=None):
+        self.db = connect(db_path, readonly=True)
+        self.writer = writer
+        self.max_attempts = max_attempts
+        self.scope = scope
+
+    def close(self):
+        self.db.close()
+
+    def _stage(self, stage):
+        return '{}|{}'.format(self.scope, stage) if self.scope else stage
+
+    def has(self, stage):
+        stage = self._stage(stage)
+        row = self.db.execute(
+            'SELECT 1 FROM FRONTIER WHERE STAGE = ? LIMIT 1', (stage,)).fetchone()
+        return row is not None
+
+    def clear(self, stage):
+        stage = self._stage(stage)
+        self.writer.write('DELETE FROM FRONTIER WHERE STAGE = ?', (stage,))
+        self.writer.flush()
+
+    def add(self, stage, urls, level=0):
+        self.writer.write_all(self.add_statement(stage, url, level) for url in urls)
+        self.writer.flush()
+
+    def add_statement(self, stage, url, level=0):
+        """Return the (sql, params) adding a pending url, to commit along with other results."""
+        stage = self._stage(stage)
+        return ADD_SQL, (url, stage, level)
+
+    def resume(self, stage):
+        """Put urls left in flight by an interrupted run back to pending."""
+        in_flight = self.counts(stage).get(IN_FLIGHT, 0)
+        stage = self._stage(stage)
+        self.writer.write('''
+            UPDATE FRONTIER SET STATE = ?, UPDATED_AT = datetime('now')
+            WHERE STAGE = ? AND STATE = ?''', (PENDING, stage, IN_FLIGHT))
+        self.writer.flush()
+        LOGGER.info('resuming stage {}: {} urls were in flight'.format(stage, in_flight))
+
+    def next_level(self, stage):
+        """Return the lowest level that still has pending urls, or None."""
+        stage = self._stage(stage)
+        row = self.db.execute(
+            'SELECT MIN(LEVEL) FROM FRONTIER WHERE STAGE = ? AND STATE = ?',
+            (stage, PENDING)).fetchone()
+        return row[0]
+
+    def pending(self, stage, level=None):
+        stage = self._stage(stage)
+        query = 'SELECT URL FROM FRONTIER WHERE STAGE = ? AND STATE = ?'
+        params = (stage, PENDING)
+        if level is not None:
+            query += ' AND LEVEL = ?'
+            params += (level,)
+        return [row[0] for row in self.db.execute(query, params)]
+
+    def lease(self, stage, size, max_level=None):
+        """Start and return up to `size` pending (url, level) pairs, lowest level first.
+
+        Urls at `max_level` or deeper are left pending.
+        """
+        query = 'SELECT URL, LEVEL FROM FRONTIER WHERE STAGE = ? AND STATE = ?'
+        params = (self._stage(stage), PENDING)
+        if max_level is not None:
+            query += ' AND LEVEL < ?'
+            params += (max_level,)
+        leased = self.db.execute(query + ' ORDER BY LEVEL LIMIT ?', params + (size,)).fetchall()
+        if leased:
+            self.start(stage, [url for url, _ in leased])
+        return leased
+
+    def start(self, stage, urls):
+        stage = self._stage(stage)
+        self.writer.write_all((START_SQL, (stage, url)) for url in urls)
+        self.writer.flush()
+
+    def start_statements(self, stage, urls, level=0):
+        """Return the (sql, params) adding urls already in flight.
+
+        For pipelined stages, which fetch urls as soon as an earlier stage
+        finds them and so cannot wait for add() and start() to commit.
+        """
+        statements = [self.add_statement(stage, url, level) for url in urls]
+        stage = self._stage(stage)
+        statements.extend((START_SQL, (stage, url)) for url in urls)
+        return statements
+
+    def done(self, stage, url):
+        self.writer.write(*self.done_statement(stage, url))
+
+    def done_statement(self, stage, url):
+        """Return the (sql, params) marking a url done, to commit along with its results."""
+        stage = self._stage(stage)
+        return DONE_SQL, (stage, url)
+
+    def fail(self, stage, url):
+        """Send a url back to pending, or to failed once it ran out of attempts.
+
+        Return True if the url will not be retried.
+        """
+        stage = self._stage(stage)
+        # ATTEMPTS was committed by start(), so the read connection sees it.
+        row = self.db.execute(
+            'SELECT ATTEMPTS FROM FRONTIER WHERE STAGE = ? AND URL = ?', (stage, url)).fetchone()
+        failed = row is not None and row[0] >= self.max_attempts
+        self.writer.write('''
+            UPDATE FRONTIER SET STATE = ?, UPDATED_AT = datetime('now')
+            WHERE STAGE = ? AND URL = ?''', (FAILED if failed else PENDING, stage, url))
+        return failed
+
+    def counts(self, stage):
+        stage = self._stage(stage)
+        return dict(self.db.execute(
+            'SELECT STATE, COUNT(*) FROM FRONTIER WHERE STAGE = ? GROUP BY STATE', (stage,)))
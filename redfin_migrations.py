@@ -0,0 +1,219 @@
+import logging
+
+from redfin_storage import connect
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _create_tables(db):
+    """The layout every db had before versioning."""
+    db.execute('''CREATE TABLE IF NOT EXISTS URLS
+             (
+             URL                    TEXT    NOT NULL,
+             NUM_PROPERTIES         INT,
+             NUM_PAGES              INT,
+             PER_PAGE_PROPERTIES    INT);''')
+    db.execute('''CREATE TABLE IF NOT EXISTS LISTINGS
+             (
+             URL            TEXT    NOT NULL,
+             INFO           TEXT);''')
+    db.execute('''CREATE TABLE IF NOT EXISTS LISTING_SHORT_DETAILS
+             (
+             URL                TEXT    NOT NULL,
+             NUMBER_OF_ROOMS    INT,
+             NAME               TEXT,
+             COUNTRY            TEXT,
+             REGION             TEXT,
+             LOCALITY           TEXT,
+             STREET             TEXT,
+             POSTAL             TEXT,
+             TYPE               TEXT,
+             PRICE              REAL
+             );''')
+    db.execute('''CREATE TABLE IF NOT EXISTS LISTING_FULL_DETAILS
+            (
+            URL                 TEXT    NOT NULL,
+            DATE                TEXT,
+            STATUS              TEXT,
+            PRICE               INT,
+            NUMBER_ROOMS        INT,
+            NUMBER_BATHROOMS    REAL,
+            SQFT                INT,
+            TIME_ON_REDFIN      INT,
+            YEAR                INT,
+            LOT_SIZE            REAL,
+            REDFIN_PRICE        INT,
+            SQFT_PRICE          INT,
+            MORTGAGE            INT
+            );''')
+
+
+def add_unique_key(db, table, columns):
+    """Create the unique index the upserts conflict on.
+
+    Dbs written before the index existed may hold duplicate rows; only the
+    last written row of each key is kept.
+    """
+    index = '{}_KEY'.format(table)
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,)).fetchone()
+    if exists:
+        return
+    key = ', '.join(columns)
+    removed = db.execute('''
+        DELETE FROM {table} WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM {table} GROUP BY {key})'''.format(table=table, key=key)).rowcount
+    db.execute('CREATE UNIQUE INDEX {} ON {} ({})'.format(index, table, key))
+    if removed:
+        LOGGER.info('removed {} duplicate rows from {}'.format(removed, table))
+
+
+def _add_keys(db):
+    add_unique_key(db, 'URLS', ['URL'])
+    add_unique_key(db, 'LISTINGS', ['URL'])
+    add_unique_key(db, 'LISTING_SHORT_DETAILS', ['URL'])
+    add_unique_key(db, 'LISTING_FULL_DETAILS', ['URL', 'DATE'])
+    # data_reporter.py filters on STATUS, and on DATE for the daily report.
+    db.execute('''CREATE INDEX IF NOT EXISTS LISTING_FULL_DETAILS_STATUS_DATE
+             ON LISTING_FULL_DETAILS (STATUS, DATE);''')
+
+
+def _split_listing_blobs(db):
+    """Move the page json out of LISTINGS into LISTING_BLOBS.
+
+    LISTINGS keeps one narrow row per page, so scans over it no longer
+    page through the json.
+    """
+    db.execute('''CREATE TABLE LISTING_BLOBS
+             (
+             URL            TEXT    PRIMARY KEY,
+             INFO           TEXT);''')
+    db.execute('INSERT INTO LISTING_BLOBS (URL, INFO) SELECT URL, INFO FROM LISTINGS')
+    # Older sqlite versions cannot drop a column, so rebuild the table.
+    db.execute('''CREATE TABLE LISTINGS_V3
+             (
+             URL            TEXT    NOT NULL,
+             FETCHED_AT     TEXT);''')
+    db.execute('INSERT INTO LISTINGS_V3 (URL) SELECT URL FROM LISTINGS')
+    db.execute('DROP TABLE LISTINGS')
+    db.execute('ALTER TABLE LISTINGS_V3 RENAME TO LISTINGS')
+    db.execute('CREATE UNIQUE INDEX LISTINGS_KEY ON LISTINGS (URL)')
+
+
+def _add_listing_seq(db):
+    """Number LISTINGS writes so parse_addresses can pick up only new pages.
+
+    SEQ is bumped on every insert or update of a page, and CRAWL_STATE
+    holds the high-water marks of the incremental passes.
+    """
+    db.execute('ALTER TABLE LISTINGS ADD COLUMN SEQ INT')
+    db.execute('UPDATE LISTINGS SET SEQ = rowid')
+    db.execute('CREATE INDEX LISTINGS_SEQ ON LISTINGS (SEQ)')
+    db.execute('''CREATE TABLE CRAWL_STATE
+             (
+             KEY            TEXT    PRIMARY KEY,
+             VALUE          INT);''')
+
+
+def _add_partition_tree(db):
+    """Keep the partition tree in URLS so repeat runs can start from its leaves."""
+    db.execute('ALTER TABLE URLS ADD COLUMN PARENT TEXT')
+    db.execute('ALTER TABLE URLS ADD COLUMN LEAF INT')
+    db.execute('CREATE INDEX URLS_PARENT ON URLS (PARENT)')
+
+
+def _add_fetch_state(db):
+    """Remember what every listing page looked like when it was last fetched.
+
+    ETAG and LAST_MODIFIED make the next fetch a conditional request; HASH
+    covers the extracted fields, so CHANGED_AT only moves when they do.
+    """
+    db.execute('''CREATE TABLE FETCH_STATE
+             (
+             URL            TEXT    PRIMARY KEY,
+             ETAG           TEXT,
+             LAST_MODIFIED  TEXT,
+             HASH           TEXT,
+             CHECKED_AT     TEXT,
+             CHANGED_AT     TEXT);''')
+
+
+def _add_blob_encoding(db):
+    """Record how every LISTING_BLOBS.INFO is stored; NULL is the plain json of older rows."""
+    db.execute('ALTER TABLE LISTING_BLOBS ADD COLUMN ENCODING TEXT')
+
+
+def _add_frontier(db):
+    """The url frontier of the crawl stages (see redfin_frontier.py).
+
+    Runs before this version created the table themselves, so it may
+    already be there.
+    """
+    db.execute('''CREATE TABLE IF NOT EXISTS FRONTIER
+             (
+             URL            TEXT    NOT NULL,
+             STAGE          TEXT    NOT NULL,
+             STATE          TEXT    NOT NULL,
+             ATTEMPTS       INT     DEFAULT 0,
+             LEVEL          INT     DEFAULT 0,
+             UPDATED_AT     TEXT,
+             PRIMARY KEY (STAGE, URL));''')
+    db.execute('''CREATE INDEX IF NOT EXISTS FRONTIER_STATE
+             ON FRONTIER (STAGE, STATE, LEVEL);''')
+
+
+def _add_listing_parsed(db):
+    """Mark the pages parsed as they were stored with PARSED rather than a NULL SEQ.
+
+    A NULL SEQ could lower MAX(SEQ), which new pages take their SEQ from,
+    and put them below the parse_addresses high-water mark.
+    """
+    db.execute('ALTER TABLE LISTINGS ADD COLUMN PARSED INT NOT NULL DEFAULT 0')
+    db.execute('UPDATE LISTINGS SET PARSED = 1 WHERE SEQ IS NULL')
+
+
+# Applied in order; a db at version N has had the first N applied.
+MIGRATIONS = [
+    _create_tables,
+    _add_keys,
+    _split_listing_blobs,
+    _add_listing_seq,
+    _add_partition_tree,
+    _add_fetch_state,
+    _add_blob_encoding,
+    _add_frontier,
+    _add_listing_parsed,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db_path):
+    """Bring the db at `db_path` up to SCHEMA_VERSION.
+
+    The version lives in sqlite's user_version header field. Each migration
+    runs in its own transaction together with the version bump, so an
+    interrupted upgrade resumes from the last finished step.
+    """
+    db = connect(db_path)
+    db.isolation_level = None
+    try:
+        version = schema_version(db)
+        if version > SCHEMA_VERSION:
+            raise RuntimeError('db schema version {} is newer than this crawler ({})'.format(
+                version, SCHEMA_VERSION))
+        for version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            LOGGER.info('migrating db to version {}: {}'.format(version, migration.__name__))
+            db.execute('BEGIN')
+            try:
+                migration(db)
+                db.execute('PRAGMA user_version = {}'.format(version))
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+    finally:
+        db.close()
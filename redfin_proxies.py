@@ -0,0 +1,134 @@
+import logging
+import sqlite3
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# Status codes Redfin answers with once it has flagged a proxy.
+BAN_STATUS_CODES = (403, 429)
+# Markers of the bot-detection interstitial served with a 200.
+CAPTCHA_MARKERS = ('px-captcha', 'access to this page has been denied')
+# Weight of the newest sample in the latency moving average.
+LATENCY_SMOOTHING = 0.3
+# Latency in seconds at which a proxy loses half of its latency score.
+REFERENCE_LATENCY = 2.0
+# Consecutive plain errors before a proxy is quarantined.
+FAILURE_THRESHOLD = 3
+# First quarantine in seconds; doubled on every further strike.
+BASE_BACKOFF = 30
+MAX_BACKOFF = 3600
+# Health never drops to zero so a recovered proxy can still earn traffic.
+MIN_HEALTH = 0.05
+
+
+class ProxyStats:
+    def __init__(self):
+        self.successes = 0
+        self.errors = 0
+        self.bans = 0
+        self.latency = None
+        self.consecutive_failures = 0
+        self.strikes = 0
+        self.quarantined_until = 0
+
+
+def is_ban(status, text):
+    if status in BAN_STATUS_CODES:
+        return True
+    if text:
+        head = text[:4096].lower()
+        return any(marker in head for marker in CAPTCHA_MARKERS)
+    return False
+
+
+class ProxyManager:
+    """Track per-proxy latency, error rate and bans during a run.
+
+    health() combines a smoothed success rate with a latency score; the
+    scheduler scales each proxy's request rate by it, so fast and reliable
+    proxies get a larger share of traffic. A ban, or FAILURE_THRESHOLD errors
+    in a row, quarantines the proxy with exponential backoff.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.stats = {}
+
+    def _stats(self, proxy):
+        stats = self.stats.get(proxy)
+        if stats is None:
+            stats = self.stats[proxy] = ProxyStats()
+        return stats
+
+    def seed(self, proxy, latency, success_rate, samples=1):
+        """Pre-rank a proxy from an earlier measurement (e.g. tools/proxy_checker.py)."""
+        stats = self._stats(proxy)
+        stats.latency = latency
+        stats.successes += round(success_rate * samples)
+        stats.errors += samples - round(success_rate * samples)
+        if not success_rate:
+            self._quarantine(proxy, stats)
+
+    def load_checker_results(self, db_path, table='PROXY_STATS'):
+        """Seed every proxy found in the table written by tools/proxy_checker.py."""
+        with sqlite3.connect(db_path) as db:
+            rows = db.execute(f'SELECT PROXY, P50, SUCCESS_RATE, TRIES FROM {table}').fetchall()
+        for proxy, p50, success_rate, tries in rows:
+            self.seed(proxy, p50, success_rate, samples=tries or 1)
+        LOGGER.info('pre-ranked {} proxies from {}'.format(len(rows), db_path))
+
+    def health(self, proxy):
+        stats = self.stats.get(proxy)
+        if stats is None:
+            return 1.0
+        # Laplace smoothing keeps a proxy with few samples near neutral.
+        total = stats.successes + stats.errors + stats.bans
+        success_rate = (stats.successes + 1) / (total + 1)
+        latency_score = 1.0
+        if stats.latency is not None:
+            latency_score = REFERENCE_LATENCY / (REFERENCE_LATENCY + stats.latency)
+        return max(MIN_HEALTH, success_rate * latency_score)
+
+    def available_at(self, proxy):
+        stats = self.stats.get(proxy)
+        return stats.quarantined_until if stats else 0
+
+    def _quarantine(self, proxy, stats):
+        stats.strikes += 1
+        backoff = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (stats.strikes - 1))
+        stats.quarantined_until = self.clock() + backoff
+        stats.consecutive_failures = 0
+        LOGGER.info('quarantining proxy {} for {}s'.format(proxy, backoff))
+
+    def record_response(self, proxy, latency, status, text):
+        """Record a completed request. Return False if it should be retried on another proxy."""
+        stats = self._stats(proxy)
+        if is_ban(status, text):
+            stats.bans += 1
+            self._quarantine(proxy, stats)
+            return False
+        if stats.latency is None:
+            stats.latency = latency
+        else:
+            stats.latency += LATENCY_SMOOTHING * (latency - stats.latency)
+        if status >= 500:
+            self.record_error(proxy)
+            return False
+        stats.successes += 1
+        stats.consecutive_failures = 0
+        stats.strikes = max(0, stats.strikes - 1)
+        return True
+
+    def record_error(self, proxy):
+        stats = self._stats(proxy)
+        stats.errors += 1
+        stats.consecutive_failures += 1
+        if stats.consecutive_failures >= FAILURE_THRESHOLD:
+            self._quarantine(proxy, stats)
+
+    def summary(self):
+        now = self.clock()
+        quarantined = sum(1 for s in self.stats.values() if s.quarantined_until > now)
+        bans = sum(s.bans for s in self.stats.values())
+        return '{} proxies used, {} quarantined, {} bans'.format(
+            len(self.stats), quarantined, bans)
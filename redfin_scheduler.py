@@ -0,0 +1,199 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+
+from redfin_proxies import ProxyManager
+
+LOGGER = logging.getLogger(__name__)
+
+# Requests per second allowed through a single proxy (or the direct connection).
+DEFAULT_PROXY_RATE = 0.5
+# Requests per second allowed against a single host across all proxies. None means unlimited.
+DEFAULT_HOST_RATE = None
+# Requests a bucket may issue back to back after being idle.
+DEFAULT_BURST = 1
+# Upper bound in seconds of the random delay added to every wait.
+DEFAULT_JITTER = 1.0
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity=DEFAULT_BURST, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available, 0 if one is available now."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def ready_at(self):
+        """Absolute time the bucket next has a token, as of its last refill."""
+        if self.tokens >= 1:
+            return self.updated
+        return self.updated + (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class RateScheduler:
+    """Hand out proxies so that every proxy and every host stays under its rate.
+
+    Proxies are kept in a heap ordered by the time their bucket next has a
+    token, so a request always goes to the proxy that is ready soonest rather
+    than waiting on a fixed one. Each proxy's rate is scaled by its health from
+    the ProxyManager, and quarantined proxies are not ready until their
+    backoff ends. Waits get a random jitter so requests do not leave in
+    lockstep.
+    """
+
+    def __init__(self, proxies=None, proxy_rate=DEFAULT_PROXY_RATE, host_rate=DEFAULT_HOST_RATE,
+                 burst=DEFAULT_BURST, jitter=DEFAULT_JITTER, manager=None, clock=time.monotonic):
+        # A single None entry stands for the direct connection.
+        self.proxies = list(proxies) if proxies else [None]
+        self.proxy_rate = proxy_rate
+        self.host_rate = host_rate
+        self.burst = burst
+        self.jitter = jitter
+        self.clock = clock
+        self.manager = manager or ProxyManager(clock=clock)
+        now = clock()
+        self.proxy_buckets = [TokenBucket(proxy_rate, burst, now) for _ in self.proxies]
+        self.host_buckets = {}
+        # (time the proxy bucket next has a token, proxy index)
+        self.ready = [(now, i) for i in range(len(self.proxies))]
+        heapq.heapify(self.ready)
+
+    def _host_bucket(self, host, now):
+        if not self.host_rate:
+            return None
+        bucket = self.host_buckets.get(host)
+        if bucket is None:
+            bucket = self.host_buckets[host] = TokenBucket(self.host_rate, self.burst, now)
+        return bucket
+
+    def _ready_at(self, i):
+        proxy = self.proxies[i]
+        bucket = self.proxy_buckets[i]
+        bucket.rate = self.proxy_rate * self.manager.health(proxy)
+        return max(bucket.ready_at(), self.manager.available_at(proxy))
+
+    def try_acquire(self, host, exclude=()):
+        """Return (proxy, 0) if a request may go out now, else (None, seconds to wait).
+
+        Proxies in `exclude` are skipped unless no other proxy exists.
+        """
+        now = self.clock()
+        host_bucket = self._host_bucket(host, now)
+        wait = host_bucket.delay(now) if host_bucket else 0
+        if wait > 0:
+            return None, wait
+        if len(exclude) >= len(self.proxies):
+            exclude = ()
+        skipped = []
+        try:
+            while True:
+                ready_at, i = self.ready[0]
+                # Health and quarantine change after the entry was pushed,
+                # so re-check it lazily and sink it only if it is no longer
+                # ready; an idle proxy keeps its (past) entry.
+                actual = self._ready_at(i)
+                if actual > ready_at and actual > now:
+                    heapq.heapreplace(self.ready, (actual, i))
+                    continue
+                if actual > now:
+                    return None, actual - now
+                if self.proxies[i] in exclude:
+                    skipped.append(heapq.heappop(self.ready))
+                    if not self.ready:
+                        return None, self.jitter
+                    continue
+                self.proxy_buckets[i].take(now)
+                if host_bucket:
+                    host_bucket.take(now)
+                heapq.heapreplace(self.ready, (self._ready_at(i), i))
+                return self.proxies[i], 0
+        finally:
+            for entry in skipped:
+                heapq.heappush(self.ready, entry)
+
+    async def acquire(self, url, exclude=()):
+        """Wait until the host of `url` and some proxy both have a token; return that proxy."""
+        host = urlsplit(url).netloc
+        while True:
+            proxy, wait = self.try_acquire(host, exclude)
+            if not wait:
+                return proxy
+            await asyncio.sleep(wait + random.random() * self.jitter)
+
+
+class FairGate:
+    """Admit at most `limit` holders at once, taking turns between lanes.
+
+    Waiters queue per lane and a freed slot goes to the next lane in
+    round-robin order, so a lane with thousands of queued requests (a big
+    city) cannot starve a lane with a few.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        # lane -> waiting futures, in the order lanes get their turn
+        self.waiters = OrderedDict()
+
+    async def acquire(self, lane=None):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.setdefault(lane, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before the cancel.
+                self.release()
+            else:
+                # release() may already have dropped the cancelled waiter.
+                queue = self.waiters.get(lane)
+                if queue and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self.waiters[lane]
+            raise
+
+    def release(self):
+        """Hand the slot to the next lane's oldest waiter, or free it.
+
+        Waiters cancelled before their turn came are dropped on the way,
+        like asyncio.Semaphore does, without costing their lane its turn.
+        """
+        while self.waiters:
+            lane, queue = self.waiters.popitem(last=False)
+            waiter = queue.popleft()
+            if waiter.done():
+                if queue:
+                    self.waiters[lane] = queue
+                    self.waiters.move_to_end(lane, last=False)
+                continue
+            if queue:
+                self.waiters[lane] = queue
+            waiter.set_result(None)
+            return
+        self.active -= 1
@@ -0,0 +1,96 @@
+import csv
+import io
+import re
+from datetime import date
+from urllib.parse import urlencode, urlsplit
+
+from redfin_filters import parse_filter_params
+
+# Redfin's "download all" endpoint. It answers a search with one csv of up to
+# NUM_HOMES rows, in place of the search pages plus one page per home.
+GIS_CSV_PATH = '/stingray/api/gis-csv'
+NUM_HOMES = 350
+CITY_PATTERN = re.compile(r'/city/([0-9]+)/')
+CITY_REGION_TYPE = 6
+# uipt for property-type=house, the only property type in BASE_FILTERS.
+HOUSE_PROPERTY_TYPE = 1
+FOR_SALE_STATUS = 9
+SOLD_DAYS = {'1wk': 7, '1mo': 30, '3mo': 90, '6mo': 180, '1yr': 365, '2yr': 730, '3yr': 1095, '5yr': 1825}
+
+# construct_filter_url parameter -> gis-csv query parameter.
+QUERY_PARAMS = {
+    'min_price': 'min_price',
+    'max_price': 'max_price',
+    'min_sqft': 'min_listing_approx_size',
+    'max_sqft': 'max_listing_approx_size',
+    'min_year': 'min_year_built',
+    'max_year': 'max_year_built',
+}
+URL_COLUMN = 'URL (SEE https://www.redfin.com/buy-a-home/comparative-market-analysis FOR INFO ON PRICING)'
+
+
+def gis_csv_url(filter_url):
+    """Return the gis-csv request equivalent to a search url built by construct_filter_url."""
+    parts = urlsplit(filter_url)
+    m = CITY_PATTERN.search(parts.path)
+    if not m:
+        raise ValueError('no city region id in {}'.format(filter_url))
+    query = {
+        'al': 1,
+        'num_homes': NUM_HOMES,
+        'region_id': m.group(1),
+        'region_type': CITY_REGION_TYPE,
+        'uipt': HOUSE_PROPERTY_TYPE,
+        'status': FOR_SALE_STATUS,
+        'v': 8,
+    }
+    filters = parse_filter_params(parts.path.split('/filter/', 1)[1]) if '/filter/' in parts.path else {}
+    for name, param in QUERY_PARAMS.items():
+        if filters.get(name):
+            query[param] = filters[name]
+    if filters.get('sold_range'):
+        query['sold_within_days'] = SOLD_DAYS[filters['sold_range']]
+    return '{}://{}{}?{}'.format(parts.scheme, parts.netloc, GIS_CSV_PATH, urlencode(query))
+
+
+def _int(value, default=0):
+    try:
+        return int(float(value.replace(',', '')))
+    except (AttributeError, ValueError):
+        return default
+
+
+def _float(value, default=0):
+    try:
+        return float(value.replace(',', ''))
+    except (AttributeError, ValueError):
+        return default
+
+
+def parse_gis_csv(text, prefix, today=None):
+    """Return (short details rows, full details rows) for a gis-csv response.
+
+    Short details are keyed by the listing path, like the JSON-LD urls of the
+    search pages; full details by `prefix` + path, like crawl_redfin_listings.
+    Fields the csv does not carry (redfin estimate, mortgage) keep the
+    html parser's default of 0.
+    """
+    today = today or date.today().strftime('%Y/%m/%d')
+    short_rows, full_rows = [], []
+    for row in csv.DictReader(io.StringIO(text)):
+        url = row.get(URL_COLUMN)
+        # The csv ends with a disclaimer row that is not a listing.
+        if not url or not url.startswith('http'):
+            continue
+        path = urlsplit(url).path
+        name = '{}, {}, {} {}'.format(
+            row.get('ADDRESS'), row.get('CITY'), row.get('STATE OR PROVINCE'), row.get('ZIP OR POSTAL CODE'))
+        short_rows.append((
+            path, _int(row.get('BEDS'), None), name, 'US', row.get('STATE OR PROVINCE'), row.get('CITY'),
+            row.get('ADDRESS'), row.get('ZIP OR POSTAL CODE'), row.get('PROPERTY TYPE'),
+            _float(row.get('PRICE'), None)))
+        full_rows.append((
+            prefix + path, today, row.get('STATUS') or None, _int(row.get('PRICE')), _int(row.get('BEDS')),
+            _float(row.get('BATHS')), _int(row.get('SQUARE FEET')), _int(row.get('DAYS ON MARKET')),
+            _int(row.get('YEAR BUILT')), _float(row.get('LOT SIZE')), 0, _int(row.get('$/SQUARE FEET')), 0))
+    return short_rows, full_rows
@@ -0,0 +1,172 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# Statements buffered before they are committed.
+DEFAULT_BATCH_SIZE = 500
+# Seconds buffered statements may wait before they are committed.
+DEFAULT_FLUSH_INTERVAL = 5.0
+# Seconds a connection waits on a lock held by another connection.
+BUSY_TIMEOUT = 30
+
+
+def connect(db_path, readonly=False):
+    """Open a connection to the crawler db.
+
+    The db runs in WAL mode so readers (the crawl stages, data_reporter.py)
+    are never blocked by the writer. With WAL, synchronous=NORMAL is still
+    crash safe for the db file; only the last commits can be lost on power
+    failure.
+    """
+    db = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    if not readonly:
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('PRAGMA temp_store=MEMORY')
+    return db
+
+
+class _Barrier:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+_CLOSE = object()
+
+
+class SQLiteWriter:
+    """The single writer of the crawler db, running on its own thread.
+
+    Every table write goes through write() or write_all(), which only queue
+    the statements, so storing a response never waits on a commit. flush()
+    does block its caller until the writer has caught up: the crawl stages
+    and the frontier call it from the event loop between rounds and before
+    reading their own writes back, which holds the loop up for about one
+    commit.
+
+    The writer thread commits in explicit transactions once batch_size
+    statements are buffered or flush_interval seconds have passed.
+    Statements queued together with write_all() always land in the same
+    commit; if a commit fails, the groups are retried one transaction each,
+    so a bad group is dropped whole and the others are kept. Back to back
+    groups made of the same statements (one per url, say) go through one
+    prepared executemany per statement.
+    """
+
+    def __init__(self, db_path, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, sql, params=()):
+        self.queue.put([(sql, params)])
+
+    def write_all(self, statements):
+        """Queue (sql, params) pairs that must be committed together."""
+        self.queue.put(list(statements))
+
+    def flush(self):
+        """Block until everything queued so far is committed."""
+        barrier = _Barrier()
+        self.queue.put(barrier)
+        barrier.done.wait()
+        self._raise_error()
+
+    def close(self):
+        self.queue.put(_CLOSE)
+        self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        # Autocommit mode: transactions are opened and committed explicitly.
+        db = connect(self.db_path)
+        db.isolation_level = None
+        batch, size = [], 0
+        last_commit = time.monotonic()
+        while True:
+            timeout = None
+            if batch:
+                timeout = max(0, self.flush_interval - (time.monotonic() - last_commit))
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, list):
+                if item:
+                    batch.append(item)
+                    size += len(item)
+                if size < self.batch_size:
+                    continue
+            try:
+                self._commit(db, batch)
+            except Exception as e:
+                LOGGER.exception('sqlite writer failed')
+                self.error = e
+            batch, size = [], 0
+            last_commit = time.monotonic()
+            if isinstance(item, _Barrier):
+                item.done.set()
+            elif item is _CLOSE:
+                db.close()
+                return
+
+    def _commit(self, db, batch):
+        """Commit a batch of statement groups (the lists queued by write and write_all)."""
+        if not batch:
+            return
+        try:
+            self._execute(db, batch)
+        except sqlite3.Error as e:
+            # Fall back to one transaction per group so one bad record does
+            # not lose the batch, nor leave half of its own group behind.
+            LOGGER.info('batch failed ({}), retrying group by group'.format(e))
+            for group in batch:
+                try:
+                    self._execute(db, [group])
+                except sqlite3.Error as e:
+                    LOGGER.info('failed records: {}'.format([params for _, params in group]))
+                    LOGGER.info(e)
+        LOGGER.debug('committed {} statements'.format(sum(len(group) for group in batch)))
+
+    def _execute(self, db, groups):
+        db.execute('BEGIN')
+        try:
+            for run in _runs(groups):
+                # A run of groups with the same statements is executed a
+                # statement at a time over all of them.
+                for i, (sql, _) in enumerate(run[0]):
+                    rows = [group[i][1] for group in run]
+                    if len(rows) == 1:
+                        db.execute(sql, rows[0])
+                    else:
+                        db.executemany(sql, rows)
+            db.execute('COMMIT')
+        except sqlite3.Error:
+            db.execute('ROLLBACK')
+            raise
+
+
+def _runs(groups):
+    """Split statement groups into runs of consecutive groups with the same sql, in the same order."""
+    runs, shape = [], None
+    for group in groups:
+        group_shape = [sql for sql, _ in group]
+        if group_shape == shape:
+            runs[-1].append(group)
+        else:
+            runs.append([group])
+            shape = group_shape
+    return runs
@@ -0,0 +1,71 @@
+import asyncio
+import http.server
+import logging
+import threading
+
+import pytest
+
+import redfin_crawler
+from redfin_crawler import create_tables_if_not_exist
+from redfin_fetcher import Fetcher
+from redfin_frontier import Frontier
+from redfin_scheduler import RateScheduler
+from redfin_storage import SQLiteWriter
+
+
+@pytest.fixture
+def crawler_db_path(tmp_path, monkeypatch):
+    """Path of an empty db that redfin_crawler reads and writes for this test."""
+    db_path = str(tmp_path / 'redfin.db')
+    monkeypatch.setattr(redfin_crawler, 'SQLITE_DB_FULL_PATH', db_path)
+    monkeypatch.setattr(redfin_crawler, 'LOGGER', logging.getLogger('redfin_crawler'))
+    return db_path
+
+
+@pytest.fixture
+def crawler_db(crawler_db_path):
+    """Path of a crawler db with the current schema."""
+    create_tables_if_not_exist()
+    return crawler_db_path
+
+
+@pytest.fixture
+def writer(crawler_db):
+    writer = SQLiteWriter(crawler_db)
+    yield writer
+    writer.close()
+
+
+@pytest.fixture
+def frontier(crawler_db, writer):
+    frontier = Frontier(crawler_db, writer)
+    yield frontier
+    frontier.close()
+
+
+@pytest.fixture
+def serve():
+    """Start a local http server for a handler class; return its base url."""
+    servers = []
+
+    def start(handler):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return 'http://127.0.0.1:{}'.format(server.server_port)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def run_crawl():
+    """Return a function that runs the coroutine function `crawl(fetcher)` with a fetcher without rate limits."""
+    def run(crawl, **kwargs):
+        async def main():
+            async with Fetcher(RateScheduler(proxy_rate=1000, jitter=0), **kwargs) as fetcher:
+                return await crawl(fetcher)
+        return asyncio.run(main())
+    return run
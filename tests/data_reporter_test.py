@@ -0,0 +1,66 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from data_reporter import score_listings, top_rows
+
+
+def apply_scores(df):
+    """The row by row scoring score_listings replaced."""
+    for c in ['PRICE', 'MORTGAGE', 'YEAR', 'SQFT', 'LOT_SIZE', 'SQFT_PRICE']:
+        col_range = df[c].max() - df[c].min()
+        col_min = df[c].min()
+        if c == 'PRICE' or c == 'MORTGAGE':
+            df['STD_' + c] = df.apply(lambda row: 1 - ((row[c] - col_min) / col_range), axis=1)
+        elif c == 'LOT_SIZE':
+            df['STD_' + c] = df.apply(lambda row: ((row[c] - col_min) / col_range) * 0.8, axis=1)
+        elif c == 'SQFT_PRICE':
+            new_col = 'SQFT_PER_THOUSAND'
+            df[new_col] = df.apply(lambda row: row['SQFT'] / (row['PRICE'] / 1000), axis=1)
+            col_range = df[new_col].max() - df[new_col].min()
+            col_min = df[new_col].min()
+            df['STD_' + new_col] = df.apply(lambda row: (row[new_col] - col_min) / col_range, axis=1)
+        else:
+            df['STD_' + c] = df.apply(lambda row: (row[c] - col_min) / col_range, axis=1)
+    df['SCORE'] = df.apply(lambda row: np.sum([
+        row['STD_PRICE'], row['STD_MORTGAGE'], row['STD_YEAR'], row['STD_SQFT'], row['STD_LOT_SIZE'],
+        row['STD_SQFT_PER_THOUSAND']]), axis=1)
+    return df
+
+
+def listings(**columns):
+    df = pd.DataFrame({
+        'URL': ['/home/{}'.format(n) for n in range(5)],
+        'PRICE': [500000, 650000, 420000, 800000, 560000],
+        'MORTGAGE': [2900, 3600, 2500, 4400, np.nan],
+        'YEAR': [1994, 2005, 1978, 2019, 2001],
+        'SQFT': [2104, 2500, 1600, 3100, 1900],
+        'LOT_SIZE': [10890.0, 7500.0, np.nan, 21780.0, 6000.0],
+        'SQFT_PRICE': [238, 262, 263, 258, 295],
+    })
+    for name, values in columns.items():
+        df[name] = values
+    return df
+
+
+def assert_same_scores(df):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = apply_scores(df.copy())['SCORE'].to_numpy(dtype=float)
+    np.testing.assert_allclose(score_listings(df)['SCORE'].to_numpy(), expected)
+
+
+def test_score_listings_matches_row_by_row_scores():
+    assert_same_scores(listings())
+    # Every listing built the same year: the column has no range.
+    assert_same_scores(listings(YEAR=[2000] * 5))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert_same_scores(listings(LOT_SIZE=[np.nan] * 5))
+
+
+def test_top_rows_puts_the_best_first_and_nan_last():
+    scores = np.array([0.5, np.nan, 2.0, 1.0, np.nan, 3.0])
+    assert list(top_rows(scores, 3)) == [5, 2, 3]
+    assert list(top_rows(scores, 10)) == [5, 2, 3, 0, 1, 4]
+    assert list(top_rows(scores, 0)) == []
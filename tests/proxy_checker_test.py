@@ -0,0 +1,58 @@
+import asyncio
+import http.server
+import sqlite3
+from urllib.parse import urlsplit
+
+from redfin_proxies import ProxyManager
+from tools.proxy_checker import read_proxy_file, check_proxies, save_results, percentile
+
+
+class StandInProxy(http.server.BaseHTTPRequestHandler):
+    # A plain http proxy receives the absolute url in the request line.
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_read_proxy_file(tmp_path):
+    txt = tmp_path / 'proxies.txt'
+    txt.write_text('proxy.io:22225:user-ip-1.2.3.4:secret\n')
+    assert read_proxy_file(str(txt)) == [('proxy.io', '22225', 'user-ip-1.2.3.4', 'secret')]
+
+    plain = tmp_path / 'proxies.csv'
+    plain.write_text('ip,port\n1.2.3.4,8080\n')
+    assert read_proxy_file(str(plain)) == [('1.2.3.4', '8080', None, None)]
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([1, 2, 3, 4, 5], 50) == 3
+    assert percentile([1, 2], 90) == 1.9
+
+
+def test_check_proxies_against_local_stand_in(tmp_path, serve):
+    good = ('127.0.0.1', str(urlsplit(serve(StandInProxy)).port), None, None)
+    dead = ('127.0.0.1', '1', None, None)
+    results = asyncio.run(check_proxies(
+        [good, dead], url='http://example.invalid/', tries=3, timeout=5, concurrency=2))
+
+    by_port = {r['port']: r for r in results}
+    assert by_port[good[1]]['success_rate'] == 1
+    assert by_port[good[1]]['p50'] is not None
+    assert by_port['1']['success_rate'] == 0
+
+    db_path = str(tmp_path / 'stats.db')
+    save_results(results, db_path)
+    with sqlite3.connect(db_path) as db:
+        assert db.execute('SELECT COUNT(*) FROM PROXY_STATS').fetchone()[0] == 2
+
+    manager = ProxyManager()
+    manager.load_checker_results(db_path)
+    assert manager.health(f'http://127.0.0.1:{good[1]}') > manager.health('http://127.0.0.1:1')
+    assert manager.available_at('http://127.0.0.1:1') > 0
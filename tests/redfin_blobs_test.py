@@ -0,0 +1,35 @@
+import json
+import os
+
+import pytest
+
+from redfin_blobs import encode_blob, decode_blob, slim_details
+from redfin_crawler import parse_listing_page
+from redfin_extract import ld_json_scripts
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _fixture_page():
+    with open(os.path.join(FIXTURES, 'search_page.html'), encoding='utf-8') as f:
+        return json.dumps([json.loads(x) for x in ld_json_scripts(f.read())])
+
+
+@pytest.mark.parametrize('encoding', ['zlib', 'slim'])
+def test_encoded_page_parses_the_same(encoding):
+    info = _fixture_page()
+    blob = encode_blob(info, encoding)
+    assert len(blob) < len(info) / 3
+    assert parse_listing_page(decode_blob(blob, encoding)) == parse_listing_page(info)
+
+
+def test_slim_keeps_only_parsed_fields():
+    details = [[{'url': '/home/1', 'address': {'streetAddress': '1 St', 'geo': 'x'}, 'image': 'y'},
+                {'offers': {'price': 5, 'priceCurrency': 'USD'}, 'url': '/home/1'},
+                {'@type': 'Event'}],
+               {'name': 'no address'}, 3]
+    assert slim_details(details) == [[{'url': '/home/1', 'address': {'streetAddress': '1 St'}},
+                                      {'offers': {'price': 5}}], {}]
+    assert decode_blob(encode_blob('[]')) == '[]'
+    with pytest.raises(ValueError):
+        encode_blob('[]', 'lz4')
@@ -0,0 +1,96 @@
+import http.server
+import os
+import sqlite3
+import time
+
+import redfin_cache
+from redfin_cache import ResponseCache, read_entry
+from redfin_crawler import replay_cache
+from redfin_fetcher import FetchResponse
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_cache_round_trip_and_ttl(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path), ttl=60)
+    cache.put(FetchResponse('http://x/a', 200, 'héllo\nworld', 'proxy', {'ETag': '"1"', 'Server': 'x'}))
+    cache.put(FetchResponse('http://x/b', 403, 'banned', 'proxy'))
+
+    assert cache.get('http://x/a') == FetchResponse('http://x/a', 200, 'héllo\nworld', None, {'ETag': '"1"'})
+    assert cache.get('http://x/b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    path, = cache.paths()
+    assert os.path.getsize(path) == cache.size == ResponseCache(str(tmp_path)).size
+
+    now = time.time()
+    monkeypatch.setattr(redfin_cache.time, 'time', lambda: now + 61)
+    assert cache.get('http://x/a') is None
+    assert ResponseCache(str(tmp_path), ttl=None).get('http://x/a') is not None
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    for n in range(4):
+        cache.put(FetchResponse('http://x/{}'.format(n), 200, os.urandom(1000).hex(), None))
+        os.utime(cache._path('http://x/{}'.format(n), redfin_cache.EXTENSIONS[0]), (n, n))
+    cache.get('http://x/0')
+    cache.max_bytes = cache.size - 1
+    cache.put(FetchResponse('http://x/4', 200, os.urandom(1000).hex(), None))
+
+    kept = {read_entry(path)[0].url for path in cache.paths()}
+    assert kept == {'http://x/0', 'http://x/3', 'http://x/4'}
+    assert cache.size <= cache.max_bytes * redfin_cache.EVICT_TO
+
+
+class Counting(http.server.BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):
+        Counting.requests += 1
+        body = b'<div id="px-captcha"></div>' if self.path == '/captcha' else b'page'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_fetcher_serves_cached_responses(tmp_path, serve, run_crawl):
+    url = serve(Counting) + '/p'
+
+    async def fetch_twice(fetcher):
+        return [(await fetcher.fetch(url)).text for _ in range(2)]
+
+    Counting.requests = 0
+    assert run_crawl(fetch_twice, cache=ResponseCache(str(tmp_path))) == ['page', 'page']
+    assert Counting.requests == 1
+
+    # A captcha served with a 200 is a ban, and is asked for again (by a
+    # fresh fetcher, as the ban quarantines the connection).
+    url = url.replace('/p', '/captcha')
+    Counting.requests = 0
+    for _ in range(2):
+        run_crawl(lambda fetcher: fetcher.fetch(url), cache=ResponseCache(str(tmp_path)), max_attempts=1)
+    assert Counting.requests == 2
+
+
+def test_replay_cache(tmp_path, crawler_db, writer):
+    cache = ResponseCache(str(tmp_path / 'cache'))
+    with open(os.path.join(FIXTURES, 'listing_page.html'), encoding='utf-8') as f:
+        cache.put(FetchResponse('https://redfin.com/WA/Vancouver/1-Main-St/home/1', 200, f.read(), None))
+    with open(os.path.join(FIXTURES, 'search_page.html'), encoding='utf-8') as f:
+        page = f.read()
+    cache.put(FetchResponse('https://redfin.com/city/1/WA/Vancouver/filter/property-type=house,sort=lo-price/page-1',
+                            200, page, None))
+    cache.put(FetchResponse('https://redfin.com/city/1/WA/Vancouver/filter/property-type=house', 200, page, None))
+
+    replay_cache(writer, cache, max_workers=2)
+    with sqlite3.connect(crawler_db) as db:
+        assert db.execute('SELECT URL, PRICE FROM LISTING_FULL_DETAILS').fetchall() == [
+            ('https://redfin.com/WA/Vancouver/1-Main-St/home/1', 615000)]
+        assert db.execute('SELECT COUNT(*) FROM LISTINGS').fetchone() == (1,)
+        assert db.execute('SELECT COUNT(*) FROM LISTING_SHORT_DETAILS').fetchone()[0] > 0
+        # Probes are not replayed.
+        assert db.execute('SELECT COUNT(*) FROM URLS').fetchone() == (0,)
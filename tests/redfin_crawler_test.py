@@ -0,0 +1,394 @@
+import http.server
+import json
+import logging
+import math
+import os
+import sqlite3
+
+import redfin_crawler
+from redfin_crawler import (
+    create_tables_if_not_exist, crawl_pipeline, get_page_info, merge_sibling_partitions, parse_addresses, url_partition,
+    INSERT_URL_SQL, INSERT_FULL_DETAILS_SQL, INSERT_LISTING_SQL, blob_statement, compact_listings, parse_listing_page,
+    parsed_page_statements)
+from redfin_fetcher import FetchResponse
+from redfin_filters import parse_filter_params
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def test_tables_dedupe_and_upsert(crawler_db_path):
+    db_path = crawler_db_path
+    # A db written before the keys existed, with a duplicate url.
+    with sqlite3.connect(db_path) as db:
+        db.execute('CREATE TABLE URLS (URL TEXT NOT NULL, NUM_PROPERTIES INT, '
+                   'NUM_PAGES INT, PER_PAGE_PROPERTIES INT)')
+        db.execute("INSERT INTO URLS VALUES ('a', 1, 1, 20)")
+        db.execute("INSERT INTO URLS VALUES ('a', 2, 1, 20)")
+    create_tables_if_not_exist()
+    create_tables_if_not_exist()
+
+    with sqlite3.connect(db_path) as db:
+        assert db.execute('SELECT URL, NUM_PROPERTIES FROM URLS').fetchall() == [('a', 2)]
+        db.execute(INSERT_URL_SQL, ('a', 3, 1, 20))
+        assert db.execute('SELECT URL, NUM_PROPERTIES FROM URLS').fetchall() == [('a', 3)]
+
+        row = ('Active', 1, 3, 2.0, 1000, 1, 1990, 0.1, 1, 1, 1)
+        db.execute(INSERT_FULL_DETAILS_SQL, ('/home/1', '2022/01/01') + row)
+        db.execute(INSERT_FULL_DETAILS_SQL, ('/home/1', '2022/01/01') + row)
+        db.execute(INSERT_FULL_DETAILS_SQL, ('/home/1', '2022/01/02') + row)
+        assert db.execute('SELECT COUNT(*) FROM LISTING_FULL_DETAILS').fetchone() == (2,)
+        plan = db.execute('EXPLAIN QUERY PLAN SELECT * FROM LISTING_FULL_DETAILS '
+                          "WHERE STATUS = 'Active' AND DATE = '2022/01/02'").fetchall()
+        assert 'LISTING_FULL_DETAILS_STATUS_DATE' in str(plan)
+
+
+def _page(n):
+    return json.dumps([[
+        {'url': '/home/{}'.format(n), 'name': 'h{}'.format(n), 'numberOfRooms': 3,
+         'address': {'streetAddress': '{} St'.format(n), 'postalCode': '98664'}},
+        {'offers': {'price': n * 1000}}]])
+
+
+def test_parse_addresses_only_reads_new_pages(crawler_db, writer):
+    def store(url, n):
+        writer.write_all([(INSERT_LISTING_SQL, (url,)), blob_statement(url, _page(n))])
+        writer.flush()
+
+    store('p1', 1)
+    store('p2', 2)
+    parse_addresses(writer, chunk_size=1, max_workers=2)
+    writer.write('DELETE FROM LISTING_SHORT_DETAILS')
+    store('p1', 3)
+    parse_addresses(writer, chunk_size=1, max_workers=2)
+
+    with sqlite3.connect(crawler_db) as db:
+        assert db.execute('SELECT URL, PRICE FROM LISTING_SHORT_DETAILS').fetchall() == [
+            ('/home/3', 3000)]
+
+
+def test_parse_addresses_reads_pages_stored_after_a_parsed_page(crawler_db, writer):
+    def store(url, n):
+        writer.write_all([(INSERT_LISTING_SQL, (url,)), blob_statement(url, _page(n))])
+        writer.flush()
+
+    store('p1', 1)
+    store('p2', 2)
+    parse_addresses(writer)
+    # The pipeline stores p2 again, parsed as it is written.
+    writer.write_all(parsed_page_statements('p2', _page(2), parse_listing_page(_page(2))))
+    store('p3', 3)
+    parse_addresses(writer)
+
+    with sqlite3.connect(crawler_db) as db:
+        assert db.execute("SELECT PRICE FROM LISTING_SHORT_DETAILS WHERE URL = '/home/3'").fetchone() == (3000,)
+
+
+def test_compact_listings_keeps_parsed_rows(crawler_db, writer):
+    writer.write_all([(INSERT_LISTING_SQL, ('p1',)), blob_statement('p1', _page(1))])
+    writer.write_all([(INSERT_LISTING_SQL, ('p2',)), blob_statement('p2', _page(2), 'zlib')])
+    writer.flush()
+    compact_listings(writer, 'slim', chunk_size=1)
+    parse_addresses(writer, max_workers=1)
+
+    with sqlite3.connect(crawler_db) as db:
+        assert db.execute('SELECT DISTINCT ENCODING FROM LISTING_BLOBS').fetchall() == [('slim',)]
+        rows = db.execute('SELECT URL, NAME, STREET, PRICE FROM LISTING_SHORT_DETAILS ORDER BY URL').fetchall()
+        assert rows == [
+            ('/home/1', 'h1', '1 St', 1000), ('/home/2', 'h2', '2 St', 2000)]
+
+
+def test_get_page_info_from_fixtures(monkeypatch):
+    monkeypatch.setattr(redfin_crawler, 'LOGGER', logging.getLogger(__name__))
+    for name, expected in [('search_page.html', (412, 21, 20)),
+                           ('search_page_single.html', (7, 1, 7)),
+                           ('search_page_empty.html', (0, 0, 20))]:
+        with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+            resp = FetchResponse('u', 200, f.read(), None)
+        assert get_page_info('u', resp) == ('u',) + expected
+
+
+def test_get_page_info_of_an_error_page(monkeypatch, caplog):
+    monkeypatch.setattr(redfin_crawler, 'LOGGER', logging.getLogger(__name__))
+    assert get_page_info('u', FetchResponse('u', 404, 'Not Found', None)) == ('u', None, None, None)
+    assert [(record.levelname, record.exc_info) for record in caplog.records] == [('WARNING', None)]
+
+
+class FakeSearch(http.server.BaseHTTPRequestHandler):
+    """Search pages of a city whose homes are listed at PRICES, 20 per page, 9 pages at most."""
+    prices = []
+    requests = 0
+
+    def do_GET(self):
+        FakeSearch.requests += 1
+        params = parse_filter_params(self.path.split('/filter/')[1])
+        count = sum(params['min_price'] <= p < params['max_price'] for p in FakeSearch.prices)
+        pages = max(1, min(9, math.ceil(count / 20)))
+        body = '<div class="homes summary">20 of {} •</div>{}'.format(
+            count, ''.join('<a class="goToPage">{}</a>'.format(p) for p in range(1, pages + 1))).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_incremental_partition(crawler_db, writer, frontier, serve, run_crawl):
+    base = serve(FakeSearch) + '/city/1/WA/Vancouver/'
+
+    def partition(incremental):
+        FakeSearch.requests = 0
+        run_crawl(lambda fetcher: url_partition(fetcher, frontier, writer, base, incremental=incremental))
+        writer.flush()
+        return FakeSearch.requests
+
+    def leaves():
+        with sqlite3.connect(crawler_db) as db:
+            return db.execute('SELECT URL, NUM_PROPERTIES FROM URLS WHERE LEAF = 1').fetchall()
+
+    FakeSearch.prices = list(range(300000, 600000, 100))
+    full = partition(incremental=False)
+    stored = leaves()
+    assert sum(n for _, n in stored) == len(FakeSearch.prices)
+    assert partition(incremental=True) == len(stored) < full
+    assert sorted(leaves()) == sorted(stored)
+
+    # Most homes sold: siblings collapse back into their parents.
+    FakeSearch.prices = FakeSearch.prices[::30]
+    partition(incremental=True)
+    assert len(leaves()) < len(stored)
+    assert sum(n for _, n in leaves()) == len(FakeSearch.prices)
+
+
+def test_partition_small_city_collapses_into_root(crawler_db, writer, frontier, serve, run_crawl):
+    base = serve(FakeSearch) + '/city/1/WA/Vancouver/'
+    FakeSearch.prices = list(range(300000, 315000, 1000))
+    run_crawl(lambda fetcher: url_partition(fetcher, frontier, writer, base))
+    writer.flush()
+    with sqlite3.connect(crawler_db) as db:
+        assert db.execute('SELECT COUNT(*) FROM URLS WHERE URL = PARENT').fetchone() == (0,)
+        leaves = db.execute('SELECT URL, PARENT, NUM_PROPERTIES FROM URLS WHERE LEAF = 1').fetchall()
+        assert len(leaves) == 1 and leaves[0][1] is None and leaves[0][2] == len(FakeSearch.prices)
+        assert db.execute('SELECT COUNT(*) FROM URLS').fetchone() == (1,)
+
+
+def test_incremental_partition_of_a_self_parented_root(crawler_db, writer, frontier, serve, run_crawl):
+    base = serve(FakeSearch) + '/city/1/WA/Vancouver/'
+    FakeSearch.prices = list(range(300000, 315000, 1000))
+    run_crawl(lambda fetcher: url_partition(fetcher, frontier, writer, base))
+    writer.flush()
+    with sqlite3.connect(crawler_db) as db:
+        # The row older versions left behind after merging a small city's children.
+        db.execute('UPDATE URLS SET PARENT = URL WHERE LEAF = 1')
+    assert redfin_crawler.merge_partition_leaves(writer, base) == 0
+    run_crawl(lambda fetcher: url_partition(fetcher, frontier, writer, base, incremental=True))
+    writer.flush()
+    with sqlite3.connect(crawler_db) as db:
+        assert db.execute('SELECT SUM(NUM_PROPERTIES) FROM URLS WHERE LEAF = 1').fetchone() == (15,)
+
+
+def test_merge_sibling_partitions(crawler_db, writer):
+    db_path = crawler_db
+    base = 'https://www.redfin.com/city/1/WA/Vancouver/'
+    parent = base + 'filter/property-type=house,min-price=300000,max-price=400000'
+    with sqlite3.connect(db_path) as db:
+        db.execute('INSERT INTO URLS VALUES (?, 500, 9, 20, NULL, 0)', (parent,))
+        for lo, count in [(300000, 40), (320000, 30), (340000, 400), (360000, 10), (380000, 10)]:
+            db.execute('INSERT INTO URLS VALUES (?, ?, 2, 20, ?, 1)', (
+                base + 'filter/property-type=house,min-price={},max-price={}'.format(lo, lo + 20000),
+                count, parent))
+    assert merge_sibling_partitions(writer, base) == 4
+
+    with sqlite3.connect(db_path) as db:
+        assert sorted(db.execute('SELECT URL, NUM_PROPERTIES, NUM_PAGES FROM URLS WHERE LEAF = 1')) == [
+            (base + 'filter/property-type=house,min-price=300000,max-price=340000', 70, 4),
+            (base + 'filter/property-type=house,min-price=340000,max-price=360000', 400, 2),
+            (base + 'filter/property-type=house,min-price=360000,max-price=400000', 20, 1)]
+
+
+class FakeCity(http.server.BaseHTTPRequestHandler):
+    """FakeSearch plus its search pages, with a json-ld script per home, and the homes' listing pages."""
+    prices = []
+    log = []
+    # Homes listed on the search pages served so far.
+    served = 0
+
+    def do_GET(self):
+        headers = {}
+        if self.path.startswith('/home/'):
+            if self.headers.get('If-None-Match') == '"v1"':
+                FakeCity.log.append('home-304')
+                self.send_response(304)
+                self.end_headers()
+                return
+            FakeCity.log.append('home')
+            with open(os.path.join(FIXTURES, 'listing_page.html'), 'rb') as f:
+                body = f.read()
+            headers['ETag'] = '"v1"'
+        else:
+            search, _, page = self.path.split('/filter/')[1].partition(',sort=lo-price/page-')
+            params = parse_filter_params(search)
+            prices = [p for p in FakeCity.prices if params['min_price'] <= p < params['max_price']]
+            if page:
+                FakeCity.log.append('page')
+                FakeCity.served += len(prices[(int(page) - 1) * 20:int(page) * 20])
+                body = ''.join('<script type="application/ld+json">{}</script>'.format(json.dumps([
+                    {'url': '/home/{}'.format(p), 'address': {'addressLocality': 'Vancouver'}},
+                    {'offers': {'price': p}}])) for p in prices[(int(page) - 1) * 20:int(page) * 20])
+            else:
+                FakeCity.log.append('probe')
+                pages = max(1, min(9, math.ceil(len(prices) / 20)))
+                body = '<div class="homes summary">20 of {} •</div>{}'.format(
+                    len(prices), ''.join('<a class="goToPage">{}</a>'.format(p) for p in range(1, pages + 1)))
+            body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_crawl_pipeline_streams_stages(crawler_db, writer, frontier, serve, run_crawl):
+    host = serve(FakeCity)
+    # A dense range splits a level deeper than the rest, so leaves come in while probes are still out.
+    FakeCity.prices = list(range(300000, 600000, 300)) + list(range(300001, 310000, 20))
+    FakeCity.log = []
+    run_crawl(lambda fetcher: crawl_pipeline(
+        fetcher, frontier, writer, host + '/city/1/WA/Vancouver/', details=True, listing_prefix=host))
+    writer.flush()
+
+    # Pages were scraped while partitioning, and homes while pages were.
+    assert FakeCity.log.index('page') < len(FakeCity.log) - FakeCity.log[::-1].index('probe')
+    assert FakeCity.log.index('home') < len(FakeCity.log) - FakeCity.log[::-1].index('page')
+    assert FakeCity.log.count('home') == len(FakeCity.prices)
+    with sqlite3.connect(crawler_db) as db:
+        assert db.execute('SELECT COUNT(*) FROM LISTING_SHORT_DETAILS').fetchone() == (len(FakeCity.prices),)
+        assert db.execute('SELECT COUNT(*) FROM LISTING_FULL_DETAILS').fetchone() == (len(FakeCity.prices),)
+        # Parsed as they were stored, so parse_addresses skips them.
+        assert db.execute('SELECT COUNT(*) FROM LISTINGS WHERE PARSED = 0').fetchone() == (0,)
+
+
+def test_crawl_pipeline_fetches_every_home_once(crawler_db, writer, frontier, serve, run_crawl):
+    host = serve(FakeCity)
+    # Dense low end, sparse high end: many small leaves that merge afterwards.
+    FakeCity.prices = list(range(300000, 400000, 50)) + list(range(400000, 600000, 4000))
+    FakeCity.served = 0
+    run_crawl(lambda fetcher: crawl_pipeline(fetcher, frontier, writer, host + '/city/1/WA/Vancouver/'))
+    writer.flush()
+
+    assert FakeCity.served == len(FakeCity.prices)
+    with sqlite3.connect(crawler_db) as db:
+        assert db.execute('SELECT COUNT(*) FROM LISTING_SHORT_DETAILS').fetchone() == (len(FakeCity.prices),)
+        # The tree is still tidied for the next run: merged leaves had none of their pages fetched.
+        assert db.execute("""
+            SELECT COUNT(*) FROM URLS U WHERE LEAF = 1
+            AND NOT EXISTS (SELECT 1 FROM LISTINGS L WHERE substr(L.URL, 1, length(U.URL)) = U.URL)""").fetchone()[0]
+
+
+def test_crawl_pipeline_asks_for_listings_conditionally(crawler_db, writer, frontier, serve, run_crawl):
+    host = serve(FakeCity)
+    FakeCity.prices = list(range(300000, 301000, 20))
+
+    def crawl():
+        FakeCity.log = []
+        run_crawl(lambda fetcher: crawl_pipeline(
+            fetcher, frontier, writer, host + '/city/1/WA/Vancouver/', details=True, listing_prefix=host))
+        writer.flush()
+        return [entry for entry in FakeCity.log if entry.startswith('home')]
+
+    assert crawl() == ['home'] * len(FakeCity.prices)
+    assert crawl() == ['home-304'] * len(FakeCity.prices)
+    with sqlite3.connect(crawler_db) as db:
+        assert db.execute('SELECT COUNT(*) FROM LISTING_FULL_DETAILS').fetchone() == (len(FakeCity.prices),)
+    assert frontier.counts('listings') == {'done': len(FakeCity.prices)}
+
+
+class FakeListings(http.server.BaseHTTPRequestHandler):
+    """Listing pages with an ETag per page; answers 304 when the client has the current one."""
+    etags = {}
+    statuses = []
+    missing = set()
+
+    def do_GET(self):
+        if self.path in FakeListings.missing:
+            FakeListings.statuses.append(404)
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = FakeListings.etags.get(self.path, '"v1"')
+        if self.headers.get('If-None-Match') == etag:
+            FakeListings.statuses.append(304)
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        FakeListings.statuses.append(200)
+        with open(os.path.join(FIXTURES, 'listing_page.html'), 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_crawl_listings_skips_unchanged_pages(crawler_db, writer, frontier, serve, run_crawl):
+    db_path = crawler_db
+    host = serve(FakeListings)
+    with sqlite3.connect(db_path) as db:
+        for n in range(4):
+            db.execute('INSERT INTO LISTING_SHORT_DETAILS (URL, PRICE) VALUES (?, 615000)', ('/home/{}'.format(n),))
+
+    def crawl(**kwargs):
+        FakeListings.statuses = []
+        run_crawl(lambda fetcher: redfin_crawler.crawl_redfin_listings(
+            fetcher, frontier, writer, prefix=host, **kwargs))
+        writer.flush()
+        return sorted(FakeListings.statuses)
+
+    def move_to_yesterday():
+        with sqlite3.connect(db_path) as db:
+            db.execute("DELETE FROM LISTING_FULL_DETAILS WHERE DATE = '2000/01/01'")
+            db.execute("UPDATE LISTING_FULL_DETAILS SET DATE = '2000/01/01'")
+
+    assert crawl() == [200] * 4
+    move_to_yesterday()
+    FakeListings.etags['/home/3'] = '"v2"'
+    assert crawl() == [200] + [304] * 3
+    # Unchanged homes were carried forward to today.
+    with sqlite3.connect(db_path) as db:
+        rows = db.execute("SELECT URL, PRICE FROM LISTING_FULL_DETAILS WHERE DATE != '2000/01/01'").fetchall()
+    assert sorted(rows) == [(host + '/home/{}'.format(n), 615000) for n in range(4)]
+
+    # A price cut on the search pages puts its home first in line.
+    move_to_yesterday()
+    with sqlite3.connect(db_path) as db:
+        db.execute("UPDATE LISTING_SHORT_DETAILS SET PRICE = 499000 WHERE URL = '/home/2'")
+    assert redfin_crawler.rank_listing_urls([host + '/home/{}'.format(n) for n in range(4)], host)[0] == \
+        host + '/home/2'
+    assert crawl(max_details=1) == [304]
+    with sqlite3.connect(db_path) as db:
+        assert db.execute("SELECT COUNT(*) FROM LISTING_FULL_DETAILS WHERE DATE != '2000/01/01'").fetchone() == (4,)
+
+
+def test_crawl_listings_does_not_store_error_pages(crawler_db, writer, frontier, serve, run_crawl, monkeypatch):
+    db_path = crawler_db
+    host = serve(FakeListings)
+    monkeypatch.setattr(FakeListings, 'missing', {'/home/1'})
+    with sqlite3.connect(db_path) as db:
+        for n in range(2):
+            db.execute('INSERT INTO LISTING_SHORT_DETAILS (URL, PRICE) VALUES (?, 615000)', ('/home/{}'.format(n),))
+    run_crawl(lambda fetcher: redfin_crawler.crawl_redfin_listings(fetcher, frontier, writer, prefix=host))
+    writer.flush()
+    assert frontier.counts('listings') == {'done': 1, 'failed': 1}
+    with sqlite3.connect(db_path) as db:
+        assert db.execute('SELECT URL FROM LISTING_FULL_DETAILS').fetchall() == [(host + '/home/0',)]
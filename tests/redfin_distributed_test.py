@@ -0,0 +1,43 @@
+import asyncio
+import json
+import sqlite3
+
+import redfin_distributed
+from redfin_distributed import Coordinator, run_worker
+from redfin_fetcher import Fetcher
+from redfin_frontier import PAGES, LISTINGS
+from redfin_scheduler import RateScheduler
+from tests.redfin_crawler_test import FakeCity
+
+
+def test_coordinator_and_workers(crawler_db, writer, frontier, serve, monkeypatch):
+    monkeypatch.setattr(redfin_distributed, 'IDLE_WAIT', 0.01)
+    host = serve(FakeCity)
+    coordinator = Coordinator(frontier, writer, host + '/city/1/WA/Vancouver/', details=True, listing_prefix=host)
+    FakeCity.prices = list(range(300000, 600000, 1000))
+    FakeCity.log = []
+
+    async def worker(address):
+        async with Fetcher(RateScheduler(proxy_rate=1000, jitter=0), concurrency=4) as fetcher:
+            return await run_worker(fetcher, *address, lease_size=4)
+
+    async def crawl():
+        address = await coordinator.listen(port=0)
+        # A worker that dies holding a lease: its urls go back to the frontier.
+        reader, stream = await asyncio.open_connection(*address)
+        stream.write(b'{"op": "lease", "size": 2}\n')
+        assert json.loads(await reader.readline())['urls']
+        stream.close()
+        return await asyncio.gather(worker(address), worker(address), coordinator.wait())
+
+    worked = asyncio.run(crawl())[:2]
+    writer.flush()
+
+    assert all(worked)
+    assert sum(worked) == len(FakeCity.log)
+    assert FakeCity.log.count('home') == len(FakeCity.prices)
+    assert frontier.counts(PAGES) == {'done': FakeCity.log.count('page')}
+    assert frontier.counts(LISTINGS) == {'done': len(FakeCity.prices)}
+    with sqlite3.connect(crawler_db) as db:
+        assert db.execute('SELECT COUNT(*) FROM LISTING_SHORT_DETAILS').fetchone() == (len(FakeCity.prices),)
+        assert db.execute('SELECT COUNT(*) FROM LISTING_FULL_DETAILS').fetchone() == (len(FakeCity.prices),)
@@ -0,0 +1,36 @@
+import sqlite3
+
+import pytest
+
+from redfin_crawler import INSERT_FULL_DETAILS_SQL, INSERT_SHORT_DETAILS_SQL
+from redfin_export import export_day, listing_city, load, SHORT_DETAILS
+
+pa = pytest.importorskip('pyarrow')
+
+
+def test_listing_city():
+    assert listing_city('https://redfin.com/CA/Belmont/1-Main-St-94002/home/123') == 'CA-Belmont'
+    assert listing_city('/WA/Vancouver/2-Oak-Ave-98664/home/7') == 'WA-Vancouver'
+    assert listing_city('/city/1362/CA/Belmont') == 'unknown'
+
+
+def test_export_and_load_partitions(tmp_path, crawler_db):
+    db_path = crawler_db
+    row = ('Active', '615000', 3, 2.5, 1850, 4, 1990, 0.1, 600000, 332, 3000)
+    with sqlite3.connect(db_path) as db:
+        for day in ['2022/01/01', '2022/01/02']:
+            db.execute(INSERT_FULL_DETAILS_SQL, ('https://redfin.com/CA/Belmont/1-St/home/1', day) + row)
+            db.execute(INSERT_FULL_DETAILS_SQL, ('https://redfin.com/WA/Vancouver/2-St/home/2', day) + row)
+        db.execute(INSERT_SHORT_DETAILS_SQL,
+                   ('/CA/Belmont/1-St/home/1', '3', 'h1', 'US', 'CA', 'Belmont', '1 St', '94002', 'House', 615000))
+    out_dir = str(tmp_path / 'export')
+    export_day(db_path, out_dir, '2022/01/01')
+    export_day(db_path, out_dir, '2022/01/02')
+
+    table = load(out_dir, cities=['CA-Belmont'], start='2022-01-02', columns=['URL', 'PRICE', 'date'])
+    assert table.schema.field('PRICE').type == pa.int64()
+    assert table.to_pydict() == {
+        'URL': ['https://redfin.com/CA/Belmont/1-St/home/1'], 'PRICE': [615000], 'date': ['2022-01-02']}
+    assert load(out_dir).num_rows == 4
+    short = load(out_dir, SHORT_DETAILS, start='2022-01-02').to_pandas(split_blocks=True, self_destruct=True)
+    assert short['NUMBER_OF_ROOMS'].tolist() == [3] and short['city'].tolist() == ['CA-Belmont']
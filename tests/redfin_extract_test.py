@@ -0,0 +1,65 @@
+import os
+
+import pytest
+from bs4 import BeautifulSoup
+
+import re
+
+from redfin_extract import (
+    ld_json_scripts, homes_summary, go_to_pages, extract_listing, FieldExtractor, FieldSpec)
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('name', [
+    'search_page.html', 'search_page_single.html', 'search_page_empty.html'])
+def test_extract_matches_beautifulsoup(name):
+    page = read_fixture(name)
+    bf = BeautifulSoup(page, 'lxml')
+
+    assert ld_json_scripts(page) == [
+        x.text for x in bf.find_all('script', type='application/ld+json')]
+    div = bf.find('div', {'class': 'homes summary'})
+    summary = homes_summary(page)
+    # lxml drops whitespace-only text right before a closing tag.
+    assert (summary.rstrip() if summary else None) == (div.get_text().rstrip() if div else None)
+    assert go_to_pages(page) == [x.get_text() for x in bf.find_all('a', {'class': 'goToPage'})]
+
+
+def test_extract_search_page():
+    page = read_fixture('search_page.html')
+    assert homes_summary(page).startswith('20 of 412 Homes •')
+    assert go_to_pages(page) == ['1', '2', '21']
+    assert len(ld_json_scripts(page)) == 3
+
+
+def test_extract_listing():
+    fields = extract_listing(read_fixture('listing_page.html'))
+    assert fields == {
+        'status': 'Active', 'price': 615000, 'beds': 4, 'baths': 2.5, 'sqft': 2104,
+        'time_on_redfin': 12, 'year': 1994, 'lot_size': 0.0, 'redfin_price': 621412,
+        'sqft_price': 292, 'mortgage': 3512}
+    assert extract_listing('<html></html>')['status'] is None
+
+
+def test_field_extractor_new_field():
+    extract = FieldExtractor([
+        FieldSpec('type', ('class', 'keyDetail'), re.compile(r'Property Type(.+)'), str, None)])
+    assert extract(read_fixture('listing_page.html')) == {'type': 'Single Family Residential'}
+
+
+def test_extract_listing_reads_stats_from_their_containers():
+    page = read_fixture('listing_page.html')
+    # A similar home's stats and details elsewhere on the page are not the listing's.
+    decoy = ('<div class="similar-homes"><div data-rf-test-id="abp-price">$1,250,000</div>'
+             '<div class="keyDetail"><span>Year Built</span><span>2021</span></div></div>')
+    fields = extract_listing(page.replace('</body>', decoy + '</body>'))
+    assert fields['price'] == 615000
+    assert fields['year'] == 1994
+    fields = extract_listing(decoy)
+    assert fields['price'] == 0 and fields['year'] == 0
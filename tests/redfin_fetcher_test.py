@@ -0,0 +1,24 @@
+import asyncio
+
+from redfin_fetcher import ConnectionPoolManager
+
+
+def test_pool_manager_shares_a_new_pool_between_concurrent_requests():
+    async def run():
+        pools = ConnectionPoolManager(max_pools=1)
+        async with pools.session('http://a:1'):
+            pass
+        sessions = []
+
+        async def request():
+            async with pools.session('http://b:1') as session:
+                sessions.append(session)
+                await asyncio.sleep(0.01)
+
+        # Both wait on the eviction of the idle pool of a.
+        await asyncio.gather(request(), request())
+        assert len(sessions) == 2 and sessions[0] is sessions[1]
+        assert list(pools.pools) == ['http://b:1']
+        await pools.close()
+
+    asyncio.run(run())
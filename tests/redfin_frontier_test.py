@@ -0,0 +1,73 @@
+from redfin_migrations import migrate
+from redfin_storage import SQLiteWriter
+from redfin_frontier import Frontier, PAGES, PARTITION, PENDING, IN_FLIGHT, DONE, FAILED
+
+
+def test_frontier_lifecycle(tmp_path):
+    db_path = str(tmp_path / 'crawl.db')
+    migrate(db_path)
+    writer = SQLiteWriter(db_path)
+    frontier = Frontier(db_path, writer, max_attempts=2)
+    frontier.add(PAGES, ['a', 'b', 'c'])
+    frontier.add(PAGES, ['a'])
+    assert sorted(frontier.pending(PAGES)) == ['a', 'b', 'c']
+
+    frontier.start(PAGES, ['a', 'b', 'c'])
+    frontier.done(PAGES, 'a')
+    assert not frontier.fail(PAGES, 'b')
+    writer.flush()
+    assert frontier.counts(PAGES) == {DONE: 1, PENDING: 1, IN_FLIGHT: 1}
+
+    frontier.start(PAGES, ['b'])
+    assert frontier.fail(PAGES, 'b')
+    writer.flush()
+    assert frontier.counts(PAGES) == {DONE: 1, FAILED: 1, IN_FLIGHT: 1}
+    frontier.close()
+    writer.close()
+
+
+def test_frontier_resume(tmp_path):
+    db_path = str(tmp_path / 'crawl.db')
+    migrate(db_path)
+    writer = SQLiteWriter(db_path)
+    frontier = Frontier(db_path, writer)
+    frontier.add(PARTITION, ['root'], level=0)
+    frontier.start(PARTITION, ['root'])
+    frontier.done(PARTITION, 'root')
+    frontier.add(PARTITION, ['x', 'y'], level=1)
+    frontier.start(PARTITION, ['x', 'y'])
+    frontier.close()
+    writer.close()
+
+    # A new process picks up the urls that were in flight when the old one died.
+    writer = SQLiteWriter(db_path)
+    frontier = Frontier(db_path, writer)
+    assert frontier.has(PARTITION)
+    assert frontier.next_level(PARTITION) is None
+    frontier.resume(PARTITION)
+    assert frontier.next_level(PARTITION) == 1
+    assert sorted(frontier.pending(PARTITION, 1)) == ['x', 'y']
+    assert not frontier.has(PAGES)
+    writer.close()
+
+
+def test_frontier_lease(tmp_path):
+    db_path = str(tmp_path / 'crawl.db')
+    migrate(db_path)
+    writer = SQLiteWriter(db_path)
+    frontier = Frontier(db_path, writer)
+    frontier.add(PARTITION, ['deep'], level=2)
+    frontier.add(PARTITION, ['a', 'b', 'c'], level=1)
+
+    first = frontier.lease(PARTITION, 2, max_level=2)
+    second = frontier.lease(PARTITION, 2, max_level=2)
+    assert len(first) == 2 and second == [(({'a', 'b', 'c'} - {url for url, _ in first}).pop(), 1)]
+    assert frontier.lease(PARTITION, 2, max_level=2) == []
+    assert frontier.counts(PARTITION) == {IN_FLIGHT: 3, PENDING: 1}
+
+    # A lease that is given up goes back to pending and is handed out again.
+    assert not frontier.fail(PARTITION, first[0][0])
+    writer.flush()
+    assert frontier.lease(PARTITION, 2, max_level=2) == [first[0]]
+    frontier.close()
+    writer.close()
@@ -0,0 +1,40 @@
+import sqlite3
+
+from redfin_migrations import migrate, schema_version, SCHEMA_VERSION
+
+
+def test_migrate_fresh_db(tmp_path):
+    db_path = str(tmp_path / 'redfin.db')
+    migrate(db_path)
+    migrate(db_path)
+    with sqlite3.connect(db_path) as db:
+        assert schema_version(db) == SCHEMA_VERSION
+        columns = [row[1] for row in db.execute('PRAGMA table_info(LISTINGS)')]
+        assert columns == ['URL', 'FETCHED_AT', 'SEQ', 'PARSED']
+
+
+def test_migrate_unversioned_db_in_place(tmp_path):
+    db_path = str(tmp_path / 'redfin.db')
+    with sqlite3.connect(db_path) as db:
+        db.execute('CREATE TABLE LISTINGS (URL TEXT NOT NULL, INFO TEXT)')
+        db.executemany('INSERT INTO LISTINGS VALUES (?, ?)',
+                       [('a', '[1]'), ('a', '[2]'), ('b', '[3]')])
+    migrate(db_path)
+    with sqlite3.connect(db_path) as db:
+        assert schema_version(db) == SCHEMA_VERSION
+        assert db.execute('SELECT URL FROM LISTINGS ORDER BY URL').fetchall() == [('a',), ('b',)]
+        assert db.execute('SELECT URL, INFO FROM LISTING_BLOBS ORDER BY URL').fetchall() == [
+            ('a', '[2]'), ('b', '[3]')]
+
+
+def test_migrate_keeps_a_frontier_created_before_versioning_it(tmp_path):
+    db_path = str(tmp_path / 'redfin.db')
+    with sqlite3.connect(db_path) as db:
+        # Runs before the frontier migration created the table on their own.
+        db.execute('''CREATE TABLE FRONTIER (URL TEXT NOT NULL, STAGE TEXT NOT NULL, STATE TEXT NOT NULL,
+                      ATTEMPTS INT DEFAULT 0, LEVEL INT DEFAULT 0, UPDATED_AT TEXT, PRIMARY KEY (STAGE, URL))''')
+        db.execute("INSERT INTO FRONTIER (URL, STAGE, STATE) VALUES ('a', 'pages', 'pending')")
+    migrate(db_path)
+    with sqlite3.connect(db_path) as db:
+        assert db.execute('SELECT URL, STATE FROM FRONTIER').fetchall() == [('a', 'pending')]
+        assert db.execute("SELECT 1 FROM sqlite_master WHERE name = 'FRONTIER_STATE'").fetchone()
@@ -0,0 +1,80 @@
+import bisect
+import random
+
+from redfin_filters import (
+    apply_filters, merge_adjacent_filters, parse_filter_params, plan_splits, split_count, MAX_SPLITS)
+
+BASE = 'https://www.redfin.com/city/18823/WA/Vancouver/'
+CAP = 360
+
+
+def test_split_count():
+    assert split_count(100, CAP) == 2
+    assert split_count(3000, CAP) == 11
+    assert split_count(10 ** 6, CAP) == MAX_SPLITS
+
+
+def test_plan_splits_even_and_by_samples():
+    assert plan_splits(300000, 600000, 3, 1000) == [
+        (300000, 400000), (400000, 500000), (500000, 600000)]
+    samples = sorted([310000] * 90 + [550000] * 10 + [590000] * 10)
+    ranges = plan_splits(300000, 600000, 2, 1000, samples)
+    assert ranges[0][0] == 300000 and ranges[-1][1] == 600000
+    assert ranges[0][1] < 450000
+    # Cuts never repeat when samples pile up on one value.
+    assert plan_splits(300000, 600000, 4, 1000, [310000] * 100) == [(300000, 310000), (310000, 600000)]
+
+
+def test_apply_filters_sizes_children_by_count():
+    url = BASE + 'filter/property-type=house,min-price=300000,max-price=600000'
+    assert len(apply_filters(url, BASE)) == 5
+    children = apply_filters(url, BASE, count=2400, cap=CAP)
+    assert len(children) == split_count(2400, CAP)
+
+
+def _probe_rounds(prices, count_aware):
+    """Partition a fake city like url_partition does; return (levels, probes)."""
+    def count(url):
+        params = parse_filter_params(url.split('/filter/')[1])
+        return bisect.bisect_left(prices, params['max_price']) - bisect.bisect_left(prices, params['min_price'])
+
+    level = apply_filters(BASE, BASE)
+    levels, probes = 0, 0
+    while level:
+        levels += 1
+        probes += len(level)
+        next_level = []
+        for url in level:
+            n = count(url)
+            if n > CAP:
+                if count_aware:
+                    next_level.extend(apply_filters(url, BASE, count=n, cap=CAP, price_samples=prices))
+                else:
+                    next_level.extend(apply_filters(url, BASE))
+        level = next_level
+    return levels, probes
+
+
+def test_count_aware_partition_needs_fewer_probes():
+    rng = random.Random(7)
+    prices = sorted(min(599999, max(300000, int(rng.lognormvariate(12.9, 0.15)))) for _ in range(6000))
+    fixed = _probe_rounds(prices, count_aware=False)
+    planned = _probe_rounds(prices, count_aware=True)
+    assert planned[0] < fixed[0]
+    assert planned[1] < fixed[1]
+
+
+def test_merge_adjacent_filters():
+    def url(lo, hi):
+        return BASE + 'filter/property-type=house,min-price=300000,max-price=310000,' \
+                      'min-year-built={},max-year-built={}'.format(lo, hi)
+
+    siblings = [(url(1970, 1980), 30), (url(1980, 1990), 10), (url(1990, 2000), 5),
+                (url(2000, 2010), 200), (url(2010, 2021), 20)]
+    assert merge_adjacent_filters(siblings, BASE, limit=100) == [
+        (url(1970, 2000), [url(1970, 1980), url(1980, 1990), url(1990, 2000)], 45)]
+    assert merge_adjacent_filters(siblings, BASE, limit=10) == []
+    # Ranges of different dimensions are not siblings of one split.
+    assert merge_adjacent_filters(
+        [(url(1970, 1980), 1), (BASE + 'filter/property-type=house,min-price=310000,max-price=320000', 1)],
+        BASE, limit=100) == []
@@ -0,0 +1,55 @@
+from redfin_proxies import ProxyManager, is_ban, BASE_BACKOFF, FAILURE_THRESHOLD
+from redfin_scheduler import RateScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_is_ban():
+    assert is_ban(403, '')
+    assert is_ban(429, '')
+    assert is_ban(200, '<div id="px-captcha"></div>')
+    assert not is_ban(200, '<html>homes</html>')
+    assert not is_ban(404, '')
+
+
+def test_health_prefers_fast_reliable_proxies():
+    manager = ProxyManager(clock=FakeClock())
+    for _ in range(5):
+        manager.record_response('fast', 0.2, 200, '')
+        manager.record_response('slow', 6.0, 200, '')
+        manager.record_error('flaky')
+        manager.record_response('flaky', 0.2, 200, '')
+    assert manager.health('fast') > manager.health('slow')
+    assert manager.health('fast') > manager.health('flaky')
+    assert manager.health('unknown') == 1.0
+
+
+def test_quarantine_backoff():
+    clock = FakeClock()
+    manager = ProxyManager(clock=clock)
+    assert not manager.record_response('a', 0.1, 403, '')
+    assert manager.available_at('a') == BASE_BACKOFF
+    clock.now = BASE_BACKOFF
+    manager.record_response('a', 0.1, 429, '')
+    assert manager.available_at('a') == BASE_BACKOFF + 2 * BASE_BACKOFF
+
+    for _ in range(FAILURE_THRESHOLD):
+        manager.record_error('b')
+    assert manager.available_at('b') == clock.now + BASE_BACKOFF
+
+
+def test_scheduler_skips_quarantined_and_excluded():
+    clock = FakeClock()
+    manager = ProxyManager(clock=clock)
+    scheduler = RateScheduler(['a', 'b', 'c'], proxy_rate=100, manager=manager, clock=clock)
+    manager.record_response('a', 0.1, 403, '')
+    for _ in range(10):
+        proxy, wait = scheduler.try_acquire('redfin.com', exclude={'b'})
+        assert proxy == 'c' and wait == 0
+        clock.now += 0.02
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+from redfin_scheduler import TokenBucket, RateScheduler, FairGate
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, capacity=2, now=0)
+    assert bucket.delay(0) == 0
+    bucket.take(0)
+    bucket.take(0)
+    assert bucket.delay(0) == 0.5
+    assert bucket.delay(0.5) == 0
+    # Refill never exceeds the capacity.
+    assert bucket.delay(100) == 0
+    assert bucket.tokens == 2
+
+
+def test_scheduler_spreads_over_ready_proxies():
+    clock = FakeClock()
+    scheduler = RateScheduler(['a', 'b'], proxy_rate=1, clock=clock)
+    first, _ = scheduler.try_acquire('redfin.com')
+    second, _ = scheduler.try_acquire('redfin.com')
+    assert {first, second} == {'a', 'b'}
+    proxy, wait = scheduler.try_acquire('redfin.com')
+    assert proxy is None and wait == 1
+    clock.now = 1
+    proxy, wait = scheduler.try_acquire('redfin.com')
+    assert proxy in ('a', 'b') and wait == 0
+
+
+def test_scheduler_host_rate():
+    clock = FakeClock()
+    scheduler = RateScheduler(['a', 'b', 'c'], proxy_rate=10, host_rate=1, clock=clock)
+    assert scheduler.try_acquire('redfin.com')[1] == 0
+    assert scheduler.try_acquire('redfin.com')[1] == 1
+    # Other hosts have their own bucket.
+    assert scheduler.try_acquire('example.com')[1] == 0
+
+
+def test_scheduler_acquire_is_cheap_with_many_proxies():
+    clock = FakeClock()
+    proxies = ['p{}'.format(i) for i in range(20000)]
+    scheduler = RateScheduler(proxies, proxy_rate=1, clock=clock)
+    start = time.perf_counter()
+    used = set()
+    for _ in range(2000):
+        clock.now += 0.001
+        proxy, wait = scheduler.try_acquire('redfin.com')
+        assert wait == 0
+        used.add(proxy)
+    # Idle proxies are not re-pushed on every acquire.
+    assert time.perf_counter() - start < 1
+    assert len(used) == 2000
+
+
+def test_fair_gate_takes_turns_between_lanes():
+    order = []
+
+    async def request(gate, lane, i):
+        await gate.acquire(lane)
+        order.append((lane, i))
+        await asyncio.sleep(0)
+        gate.release()
+
+    async def run():
+        gate = FairGate(1)
+        await gate.acquire()
+        tasks = [asyncio.ensure_future(request(gate, 'big', i)) for i in range(4)]
+        tasks.append(asyncio.ensure_future(request(gate, 'small', 0)))
+        cancelled = asyncio.ensure_future(request(gate, 'small', 1))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        gate.release()
+        await asyncio.gather(*tasks)
+        assert gate.active == 0 and not gate.waiters
+
+    asyncio.run(run())
+    assert order == [('big', 0), ('small', 0), ('big', 1), ('big', 2), ('big', 3)]
+
+
+def test_fair_gate_skips_a_cancelled_waiter():
+    async def run():
+        gate = FairGate(1)
+        await gate.acquire()
+        cancelled = asyncio.ensure_future(gate.acquire('a'))
+        waiting = asyncio.ensure_future(gate.acquire('b'))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        # The slot goes past the cancelled waiter at the head of the line.
+        gate.release()
+        await waiting
+        assert cancelled.cancelled()
+        gate.release()
+        assert gate.active == 0 and not gate.waiters
+
+        await gate.acquire()
+        cancelled = asyncio.ensure_future(gate.acquire('a'))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        gate.release()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert gate.active == 0 and not gate.waiters
+
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+import http.server
+import os
+import sqlite3
+from urllib.parse import urlsplit, parse_qs
+
+from redfin_crawler import crawl_redfin_gis_csv, INSERT_URL_SQL
+from redfin_frontier import BULK
+from redfin_stingray import gis_csv_url, parse_gis_csv, GIS_CSV_PATH
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'gis_csv.csv')
+
+
+class RecordedStingray(http.server.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        RecordedStingray.requests.append(self.path)
+        status, body = 404, b''
+        if self.path.startswith(GIS_CSV_PATH):
+            with open(FIXTURE, 'rb') as f:
+                status, body = 200, f.read()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_gis_csv_url():
+    url = gis_csv_url('https://www.redfin.com/city/18823/WA/Vancouver/filter/'
+                      'property-type=house,min-price=300000,max-price=360000,'
+                      'min-sqft=1000-sqft,max-sqft=2000-sqft,include=sold-3yr')
+    parts = urlsplit(url)
+    query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+    assert parts.netloc == 'www.redfin.com' and parts.path == GIS_CSV_PATH
+    assert query['region_id'] == '18823' and query['region_type'] == '6'
+    assert query['min_price'] == '300000' and query['max_price'] == '360000'
+    assert query['min_listing_approx_size'] == '1000'
+    assert query['max_listing_approx_size'] == '2000'
+    assert query['sold_within_days'] == '1095'
+
+
+def test_parse_gis_csv():
+    with open(FIXTURE, encoding='utf-8') as f:
+        short_rows, full_rows = parse_gis_csv(f.read(), 'https://redfin.com', today='2022/06/01')
+    assert short_rows[0] == (
+        '/WA/Vancouver/1403-NE-125th-St-98685/home/14612230', 4, '1403 NE 125th St, Vancouver, WA 98685',
+        'US', 'WA', 'Vancouver', '1403 NE 125th St', '98685', 'Single Family Residential', 615000.0)
+    assert full_rows[1] == (
+        'https://redfin.com/WA/Vancouver/5512-NW-Lincoln-Ave-98663/home/14562987', '2022/06/01', 'Active',
+        489900, 3, 2.0, 1512, 3, 1952, 0, 0, 324, 0)
+    assert len(short_rows) == len(full_rows) == 2
+
+
+def test_crawl_gis_csv_against_recorded_responses(crawler_db, writer, frontier, serve, run_crawl):
+    base = serve(RecordedStingray) + '/city/18823/WA/Vancouver/'
+    # One partitioned parent and one leaf.
+    writer.write(INSERT_URL_SQL, (base + 'filter/property-type=house', 900, 9, 40))
+    writer.write(INSERT_URL_SQL, (base + 'filter/property-type=house,min-price=300000', 2, 1, 40))
+    writer.flush()
+    run_crawl(lambda fetcher: crawl_redfin_gis_csv(fetcher, frontier, writer))
+    writer.flush()
+
+    assert len(RecordedStingray.requests) == 1
+    assert 'min_price=300000' in RecordedStingray.requests[0]
+    assert frontier.counts(BULK) == {'done': 1}
+    with sqlite3.connect(crawler_db) as db:
+        assert db.execute('SELECT COUNT(*) FROM LISTING_SHORT_DETAILS').fetchone() == (2,)
+        assert db.execute('SELECT COUNT(*) FROM LISTING_FULL_DETAILS').fetchone() == (2,)
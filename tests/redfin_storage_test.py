@@ -0,0 +1,100 @@
+import sqlite3
+import time
+
+import redfin_storage
+from redfin_storage import SQLiteWriter, connect
+
+
+def make_db(tmp_path):
+    db_path = str(tmp_path / 'crawl.db')
+    with sqlite3.connect(db_path) as db:
+        db.execute('CREATE TABLE T (URL TEXT NOT NULL, N INT)')
+    return db_path
+
+
+def count(db_path):
+    with connect(db_path, readonly=True) as db:
+        return db.execute('SELECT COUNT(*) FROM T').fetchone()[0]
+
+
+def test_writer_commits_by_size(tmp_path):
+    db_path = make_db(tmp_path)
+    writer = SQLiteWriter(db_path, batch_size=3, flush_interval=3600)
+    writer.write('INSERT INTO T VALUES (?, ?)', ('a', 1))
+    writer.write_all([('INSERT INTO T VALUES (?, ?)', ('b', 2)),
+                      ('INSERT INTO T VALUES (?, ?)', ('c', 3))])
+    for _ in range(100):
+        if count(db_path) == 3:
+            break
+        time.sleep(0.01)
+    assert count(db_path) == 3
+
+    writer.write('INSERT INTO T VALUES (?, ?)', ('d', 4))
+    time.sleep(0.05)
+    assert count(db_path) == 3
+    writer.flush()
+    assert count(db_path) == 4
+    writer.close()
+
+    with sqlite3.connect(db_path) as db:
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_writer_commits_by_time(tmp_path):
+    db_path = make_db(tmp_path)
+    writer = SQLiteWriter(db_path, batch_size=1000, flush_interval=0.05)
+    writer.write('INSERT INTO T VALUES (?, ?)', ('a', 1))
+    time.sleep(0.3)
+    assert count(db_path) == 1
+    writer.close()
+
+
+def test_writer_keeps_good_rows_of_a_bad_batch(tmp_path):
+    db_path = make_db(tmp_path)
+    writer = SQLiteWriter(db_path)
+    writer.write('INSERT INTO T VALUES (?, ?)', ('a', 1))
+    writer.write('INSERT INTO T VALUES (?, ?)', (None, 2))
+    writer.write('INSERT INTO T VALUES (?, ?)', ('c', 3))
+    writer.close()
+    with sqlite3.connect(db_path) as db:
+        assert db.execute('SELECT URL FROM T ORDER BY N').fetchall() == [('a',), ('c',)]
+
+
+def test_writer_drops_a_bad_group_whole(tmp_path):
+    db_path = make_db(tmp_path)
+    writer = SQLiteWriter(db_path)
+    writer.write_all([('INSERT INTO T VALUES (?, ?)', ('a', 1)),
+                      ('INSERT INTO T VALUES (?, ?)', (None, 2))])
+    writer.write('INSERT INTO T VALUES (?, ?)', ('c', 3))
+    writer.close()
+    with sqlite3.connect(db_path) as db:
+        assert db.execute('SELECT URL FROM T ORDER BY N').fetchall() == [('c',)]
+
+
+class CountingConnection(sqlite3.Connection):
+    calls = []
+
+    def execute(self, sql, *args):
+        CountingConnection.calls.append(('execute', sql))
+        return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        CountingConnection.calls.append(('executemany', sql))
+        return super().executemany(sql, *args)
+
+
+def test_writer_batches_groups_of_the_same_statements(tmp_path, monkeypatch):
+    db_path = make_db(tmp_path)
+    with sqlite3.connect(db_path) as db:
+        db.execute('CREATE TABLE DONE (URL TEXT)')
+    monkeypatch.setattr(redfin_storage, 'connect', lambda path: sqlite3.connect(path, factory=CountingConnection))
+    CountingConnection.calls = []
+    writer = SQLiteWriter(db_path, flush_interval=3600)
+    for n in range(100):
+        url = '/home/{}'.format(n)
+        writer.write_all([('INSERT INTO T VALUES (?, ?)', (url, n)), ('INSERT INTO DONE VALUES (?)', (url,))])
+    writer.close()
+    assert CountingConnection.calls == [
+        ('execute', 'BEGIN'), ('executemany', 'INSERT INTO T VALUES (?, ?)'),
+        ('executemany', 'INSERT INTO DONE VALUES (?)'), ('execute', 'COMMIT')]
+    assert count(db_path) == 100
@@ -1,11 +1,18 @@
+import aiohttp
+import asyncio
+import csv
 import requests
+import sqlite3
 import time
 import argparse
 import fake_useragent
-import pandas as pd
+from datetime import datetime
 
 TOTAL_TRIES_PER_URL = 2
 URL = 'https://www.redfin.com/city/1362/CA/Belmont/filter/include=sold-3yr,min-price=500000'
+# Number of proxies checked at the same time.
+DEFAULT_CONCURRENCY = 200
+PROXY_STATS_TABLE = 'PROXY_STATS'
 
 
 def build_proxies(ip_addr, port, user=None, password=None):
@@ -21,23 +28,108 @@ def build_proxies(ip_addr, port, user=None, password=None):
     }
 
 
-def time_proxy(ip_addr, port, proxy_user=None, proxy_pass=None,  url='https://www.google.com', timeout=10):
-    success_counts = 0
-    start = time.time()
-    ua = fake_useragent.UserAgent()
+def read_proxy_file(path):
+    """Read proxies as (ip_addr, port, user, password) tuples.
 
-    pull_proxies = build_proxies(ip_addr, port, proxy_user, proxy_pass)
-    for i in range(TOTAL_TRIES_PER_URL):
-        try:
-            r = requests.get(url, proxies=pull_proxies, headers={'User-agent': ua.chrome}, timeout=timeout)
-            if r.status_code == 200:
-                success_counts += 1
-        except Exception as e:
-            print(e)
-
-    print('for proxy {}'.format(pull_proxies))
-    print('total time {} for visiting {} times'.format(time.time() - start, TOTAL_TRIES_PER_URL))
-    print('success rate = {}'.format(success_counts / TOTAL_TRIES_PER_URL))
+    Accepts the csv format described in the README (with a header row) and the
+    colon separated host:port:user:pass format of ips-data_center.txt.
+    """
+    with open(path, encoding='utf-8') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if not lines:
+        return []
+    if ',' in lines[0]:
+        rows = list(csv.reader(lines))[1:]
+    else:
+        rows = [line.split(':', 3) for line in lines]
+    return [tuple(row) + (None,) * (4 - len(row)) for row in rows]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+async def check_proxy(session, semaphore, proxy_info, url, tries, timeout, user_agent):
+    """Time `tries` requests through one proxy and summarize them."""
+    proxy = build_proxies(*proxy_info)['http']
+    latencies, success_counts = [], 0
+    async with semaphore:
+        for i in range(tries):
+            start = time.monotonic()
+            try:
+                async with session.get(url, proxy=proxy, headers={'User-agent': user_agent},
+                                       timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                    await r.read()
+                    if r.status == 200:
+                        success_counts += 1
+                        latencies.append(time.monotonic() - start)
+            except Exception:
+                pass
+    return {
+        'proxy': proxy,
+        'ip_addr': proxy_info[0],
+        'port': proxy_info[1],
+        'user': proxy_info[2],
+        'password': proxy_info[3],
+        'success_rate': success_counts / tries,
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'tries': tries,
+    }
+
+
+async def check_proxies(proxies, url=URL, tries=TOTAL_TRIES_PER_URL, timeout=10,
+                        concurrency=DEFAULT_CONCURRENCY):
+    """Check all proxies concurrently and return one result dict per proxy."""
+    semaphore = asyncio.Semaphore(concurrency)
+    user_agent = fake_useragent.UserAgent().chrome
+    # Every proxy is a different endpoint, so there is nothing to gain from keep-alive.
+    connector = aiohttp.TCPConnector(limit=concurrency, force_close=True)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        return await asyncio.gather(*(
+            check_proxy(session, semaphore, p, url, tries, timeout, user_agent)
+            for p in proxies))
+
+
+def save_results(results, db_path):
+    """Persist check results; the crawler reads this table with --proxy_stats to pre-rank proxies."""
+    checked_at = datetime.utcnow().isoformat()
+    with sqlite3.connect(db_path) as db:
+        db.execute(f'''CREATE TABLE IF NOT EXISTS {PROXY_STATS_TABLE}
+            (
+            PROXY           TEXT    PRIMARY KEY,
+            IP_ADDR         TEXT,
+            PORT            TEXT,
+            USER            TEXT,
+            PASSWORD        TEXT,
+            SUCCESS_RATE    REAL,
+            P50             REAL,
+            P90             REAL,
+            P99             REAL,
+            TRIES           INT,
+            CHECKED_AT      TEXT);''')
+        db.executemany(f'''
+            INSERT OR REPLACE INTO {PROXY_STATS_TABLE}
+            (PROXY, IP_ADDR, PORT, USER, PASSWORD, SUCCESS_RATE, P50, P90, P99, TRIES, CHECKED_AT)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            [(r['proxy'], r['ip_addr'], r['port'], r['user'], r['password'], r['success_rate'],
+              r['p50'], r['p90'], r['p99'], r['tries'], checked_at) for r in results])
+
+
+def report(results):
+    ok = [r for r in results if r['success_rate'] > 0]
+    print('{} of {} proxies answered'.format(len(ok), len(results)))
+    p50s = [r['p50'] for r in ok]
+    if p50s:
+        print('median latency p50={:.2f}s p90={:.2f}s p99={:.2f}s'.format(
+            percentile(p50s, 50), percentile(p50s, 90), percentile(p50s, 99)))
 
 
 def time_no_proxy(url='https://www.google.com'):
@@ -58,10 +150,23 @@ if __name__ == '__main__':
         '--proxy_csv_path',
         help='proxies csv path. '
              'It should contain ip_addr,port,user,password if using proxies with auth. '
-             'Or just contain ip_addr,port columns if no auth needed.'
+             'Or just contain ip_addr,port columns if no auth needed. '
+             'A host:port:user:pass file such as ips-data_center.txt is also accepted.'
     )
+    parser.add_argument('--url', default=URL, help='url requested through every proxy')
+    parser.add_argument('--tries', type=int, default=TOTAL_TRIES_PER_URL,
+                        help='requests sent through every proxy')
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='seconds before a single request is abandoned')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='number of proxies checked at the same time')
+    parser.add_argument('--output', default='proxy_stats.db',
+                        help='sqlite file the results are written to')
     args = parser.parse_args()
 
-    proxies = pd.read_csv(args.proxy_csv_path, encoding='utf-8').values
-    for proxy_info in proxies:
-        time_proxy(*proxy_info, url=URL)
+    proxies = read_proxy_file(args.proxy_csv_path)
+    results = asyncio.run(check_proxies(
+        proxies, url=args.url, tries=args.tries, timeout=args.timeout,
+        concurrency=args.concurrency))
+    save_results(results, args.output)
+    report(results)